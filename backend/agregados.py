@@ -0,0 +1,314 @@
+"""
+Totales precalculados para los resúmenes (/resumen): recaudación por Año_Mes,
+facturado por período, deuda total y cantidad de contribuyentes por estado de
+suscripción.
+
+Se mantienen de forma incremental en la tabla agregados: cada pago que se
+registra aplica su diferencia (alta, cambio de estado o reversión) en la misma
+transacción que escribe la fila de pagos, así que los endpoints leen unas
+pocas filas en lugar de recorrer pagos y contribuyentes. recalcular() los
+vuelve a armar desde cero (primer arranque o después de una corrección a mano).
+
+Uso (desde la raíz del proyecto):
+    python -m backend.agregados --recalcular
+"""
+import argparse
+from collections import Counter, defaultdict
+
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend.database import SessionLocal, engine
+from backend.models import Agregado, Contribuyente, FacturacionItem, Pago
+from backend.webhook_queue import utcnow
+
+RECAUDADO = "recaudado"  # por Año_Mes del pago
+FACTURADO = "facturado"  # por período de la facturación masiva
+DEUDA = "deuda"  # clave TOTAL: suma de contribuyentes.deuda y cuántos deben
+SUSCRIPCIONES = "suscripciones"  # por Estado_Suscripcion
+TOTAL = "total"
+SIN_ESTADO = "Sin_Estado"
+
+# Solo los pagos aprobados cuentan como cobrados
+COBRADO = "approved"
+
+
+def anio_mes(fecha):
+    return fecha.strftime("%Y-%m") if fecha else "sin_fecha"
+
+
+def sumar(db, nombre, clave, total=0.0, cantidad=0):
+    """Suma (o resta) sobre un agregado con un upsert atómico, dentro de la transacción de `db`."""
+    if not total and not cantidad:
+        return
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(Agregado).values(
+        nombre=nombre, clave=clave, total=total, cantidad=cantidad, updated_at=utcnow(),
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[Agregado.nombre, Agregado.clave],
+        set_={
+            "total": Agregado.total + stmt.excluded.total,
+            "cantidad": Agregado.cantidad + stmt.excluded.cantidad,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    ))
+
+
+def reemplazar(db, nombre, valores, claves=None):
+    """Reemplaza los agregados de `nombre` (o solo `claves`) por {clave: (total, cantidad)}."""
+    stmt = delete(Agregado).where(Agregado.nombre == nombre)
+    if claves is not None:
+        stmt = stmt.where(Agregado.clave.in_(list(claves)))
+    db.execute(stmt)
+    now = utcnow()
+    rows = [
+        {"nombre": nombre, "clave": clave, "total": total, "cantidad": cantidad, "updated_at": now}
+        for clave, (total, cantidad) in valores.items()
+    ]
+    if rows:
+        db.execute(insert(Agregado), rows)
+
+
+def aplicar_pago(db, payment_id, status, dni, amount, paid_at):
+    """Aplica a los agregados el cambio que va a producir el upsert del pago.
+
+    Se llama antes de pago_upsert, en la misma transacción: lee la fila anterior
+    del pago para revertir lo que había sumado (si estaba aprobado) y suma el
+    estado nuevo.
+    """
+    previous = db.execute(
+        select(Pago.estado_pago, Pago.monto_pagado, Pago.fecha_pago_real, Pago.contribuyente_dni)
+        .where(Pago.id_transaccion_mp == payment_id)
+        .with_for_update()
+    ).first()
+    if previous is not None and previous.estado_pago == COBRADO:
+        _cobro(db, previous.contribuyente_dni, -(previous.monto_pagado or 0.0), previous.fecha_pago_real, -1)
+    if status == COBRADO:
+        _cobro(db, dni, amount or 0.0, paid_at, 1)
+
+
+def _cobro(db, dni, monto, fecha, cantidad):
+    sumar(db, RECAUDADO, anio_mes(fecha), monto, cantidad)
+    # La deuda del contribuyente baja con cada pago aprobado (y vuelve si el pago se revierte).
+    # No baja de 0: lo pagado de más queda como saldo a favor y es lo primero que se
+    # descuenta si el pago se revierte
+    row = db.execute(
+        select(Contribuyente.deuda, Contribuyente.saldo_a_favor).where(Contribuyente.dni == dni).with_for_update()
+    ).first()
+    if row is None or row.deuda is None:
+        return
+    deuda, saldo = row.deuda, row.saldo_a_favor or 0.0
+    if monto >= 0:
+        aplicado = min(max(deuda, 0.0), monto)
+        nueva, saldo = deuda - aplicado, saldo + monto - aplicado
+    else:
+        desde_saldo = min(saldo, -monto)
+        nueva, saldo = deuda - monto - desde_saldo, saldo - desde_saldo
+    db.execute(update(Contribuyente).where(Contribuyente.dni == dni).values(deuda=nueva, saldo_a_favor=saldo))
+    sumar(db, DEUDA, TOTAL, nueva - deuda, _debe(nueva) - _debe(deuda))
+
+
+def _debe(deuda):
+    return int(deuda is not None and round(deuda, 2) > 0)
+
+
+def cambiar_suscripcion(anterior, nuevo):
+    """Mueve un contribuyente de un estado de suscripción a otro."""
+    cambiar_suscripciones([(anterior, nuevo)])
+
+
+def cambiar_suscripciones(cambios):
+    """Versión en lote de cambiar_suscripcion: [(anterior, nuevo)] en una sola transacción."""
+    conteo = Counter()
+    for anterior, nuevo in cambios:
+        anterior, nuevo = anterior or SIN_ESTADO, nuevo or SIN_ESTADO
+        if anterior != nuevo:
+            conteo[anterior] -= 1
+            conteo[nuevo] += 1
+    if not any(conteo.values()):
+        return
+    db = SessionLocal()
+    try:
+        for estado, cantidad in conteo.items():
+            sumar(db, SUSCRIPCIONES, estado, cantidad=cantidad)
+        db.commit()
+    finally:
+        db.close()
+
+
+# --- recálculo completo ---
+
+def recalcular_suscripciones(records):
+    """Cuenta los estados de suscripción sobre la tabla completa (registros con formato Airtable)."""
+    conteo = Counter(r.get("fields", {}).get("Estado_Suscripcion") or SIN_ESTADO for r in records)
+    db = SessionLocal()
+    try:
+        reemplazar(db, SUSCRIPCIONES, {estado: (0.0, n) for estado, n in conteo.items()})
+        db.commit()
+    finally:
+        db.close()
+    return dict(conteo)
+
+
+def recalcular_deuda(db=None):
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        total, deudores = db.execute(select(
+            func.coalesce(func.sum(Contribuyente.deuda), 0.0),
+            func.coalesce(func.sum(case((Contribuyente.deuda > 0.005, 1), else_=0)), 0),
+        )).one()
+        reemplazar(db, DEUDA, {TOTAL: (float(total), int(deudores))})
+        if own:
+            db.commit()
+    finally:
+        if own:
+            db.close()
+
+
+def recalcular_facturado(periodo=None, db=None):
+    """Facturado por período desde la tabla facturacion (uno solo si se indica `periodo`)."""
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        query = select(FacturacionItem.periodo, func.sum(FacturacionItem.monto), func.count(FacturacionItem.id))
+        if periodo is not None:
+            query = query.where(FacturacionItem.periodo == periodo)
+        valores = {p: (float(total or 0.0), n) for p, total, n in db.execute(query.group_by(FacturacionItem.periodo))}
+        reemplazar(db, FACTURADO, valores, claves=None if periodo is None else [periodo])
+        if own:
+            db.commit()
+    finally:
+        if own:
+            db.close()
+
+
+def recalcular_recaudado(db):
+    valores = defaultdict(lambda: [0.0, 0])
+    pagos = db.execute(
+        select(Pago.monto_pagado, Pago.fecha_pago_real).where(Pago.estado_pago == COBRADO)
+    ).yield_per(5000)
+    for monto, fecha in pagos:
+        valor = valores[anio_mes(fecha)]
+        valor[0] += monto or 0.0
+        valor[1] += 1
+    reemplazar(db, RECAUDADO, {k: tuple(v) for k, v in valores.items()})
+
+
+def recalcular(records=None):
+    """Rearma todos los agregados. Sin `records` las suscripciones se cuentan en la tabla local."""
+    db = SessionLocal()
+    try:
+        recalcular_recaudado(db)
+        recalcular_facturado(db=db)
+        recalcular_deuda(db)
+        if records is None:
+            conteo = db.execute(
+                select(Contribuyente.estado_suscripcion, func.count()).group_by(Contribuyente.estado_suscripcion)
+            ).all()
+            reemplazar(db, SUSCRIPCIONES, {(estado or SIN_ESTADO): (0.0, n) for estado, n in conteo})
+        db.commit()
+    finally:
+        db.close()
+    if records is not None:
+        recalcular_suscripciones(records)
+
+
+def vacio():
+    db = SessionLocal()
+    try:
+        return db.query(Agregado.nombre).first() is None
+    finally:
+        db.close()
+
+
+# --- lecturas para los endpoints ---
+
+def leer(nombre, desde=None, hasta=None):
+    """{clave: (total, cantidad)} de un agregado, con rango opcional de claves."""
+    db = SessionLocal()
+    try:
+        query = db.query(Agregado.clave, Agregado.total, Agregado.cantidad).filter(Agregado.nombre == nombre)
+        if desde is not None:
+            query = query.filter(Agregado.clave >= desde)
+        if hasta is not None:
+            query = query.filter(Agregado.clave <= hasta)
+        return {clave: (total, cantidad) for clave, total, cantidad in query.order_by(Agregado.clave)}
+    finally:
+        db.close()
+
+
+def resumen():
+    db = SessionLocal()
+    try:
+        rows = db.query(Agregado.nombre, Agregado.clave, Agregado.total, Agregado.cantidad).all()
+    finally:
+        db.close()
+    por_nombre = defaultdict(dict)
+    for nombre, clave, total, cantidad in rows:
+        por_nombre[nombre][clave] = (total, cantidad)
+    deuda_total, deudores = por_nombre[DEUDA].get(TOTAL, (0.0, 0))
+    recaudado = por_nombre[RECAUDADO]
+    ultimo_mes = max((k for k in recaudado if k != "sin_fecha"), default=None)
+    return {
+        "deuda": {"total": round(deuda_total, 2), "contribuyentes_con_deuda": deudores},
+        "suscripciones": {estado: cantidad for estado, (_, cantidad) in sorted(por_nombre[SUSCRIPCIONES].items())},
+        "recaudado": {
+            "total": round(sum(t for t, _ in recaudado.values()), 2),
+            "pagos": sum(n for _, n in recaudado.values()),
+            "ultimo_mes": {"anio_mes": ultimo_mes, "total": round(recaudado[ultimo_mes][0], 2),
+                           "pagos": recaudado[ultimo_mes][1]} if ultimo_mes else None,
+        },
+    }
+
+
+def recaudacion(desde=None, hasta=None):
+    return [
+        {"anio_mes": clave, "total": round(total, 2), "pagos": cantidad}
+        for clave, (total, cantidad) in leer(RECAUDADO, desde, hasta).items()
+    ]
+
+
+def periodo(periodo):
+    """Facturado, cobrado y pendiente de un período (pendiente = facturado - recaudado en ese Año_Mes).
+
+    Solo hay facturado para los períodos que pasaron por una facturación masiva
+    (o por /pagar): las columnas mensuales del padrón no se importan por período.
+    """
+    facturado, items = leer(FACTURADO, periodo, periodo).get(periodo, (0.0, 0))
+    recaudado, pagos = leer(RECAUDADO, periodo, periodo).get(periodo, (0.0, 0))
+    return {
+        "periodo": periodo,
+        "facturado": round(facturado, 2),
+        "contribuyentes_facturados": items,
+        "recaudado": round(recaudado, 2),
+        "pagos": pagos,
+        "pendiente": round(max(facturado - recaudado, 0.0), 2),
+    }
+
+
+def deuda_de(dni):
+    db = SessionLocal()
+    try:
+        return db.query(Contribuyente.deuda).filter(Contribuyente.dni == dni).scalar()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recalcular", action="store_true", help="Rearmar todos los agregados desde las tablas")
+    args = parser.parse_args()
+
+    from backend import models
+    from backend.database import migrate_columns
+    models.Base.metadata.create_all(bind=engine)
+    migrate_columns(models.Base.metadata)
+    if args.recalcular:
+        recalcular()
+    print(resumen())
+
+
+if __name__ == "__main__":
+    main()
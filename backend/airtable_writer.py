@@ -0,0 +1,235 @@
+import asyncio
+
+from backend.breaker import CircuitOpenError
+from backend.upstream import AIRTABLE_BATCH_SIZE, UpstreamError
+
+# Escritor de Airtable con buffer: junta las escrituras de una ventana corta,
+# combina varios updates al mismo registro en uno solo y los manda en lotes de
+# 10 registros (el máximo por request de la API). El ritmo lo marca el
+# TokenBucket del AirtableClient, que también maneja los 429.
+#
+# Con `defer`, un lote que no se puede mandar porque Airtable está caído o
+# limitando (circuito abierto, 429, 5xx, red) no se pierde: se guarda en el
+# outbox local y el replicador lo manda cuando Airtable vuelve.
+
+
+def deferrable(error):
+    """Errores por los que la escritura se deja para después en lugar de fallar."""
+    if isinstance(error, (CircuitOpenError, TimeoutError, OSError)):
+        return True
+    if isinstance(error, UpstreamError):
+        return error.status_code == 429 or error.status_code >= 500
+    import httpx
+
+    return isinstance(error, httpx.TransportError)
+
+
+class AirtableWriter:
+    """Buffer de updates/inserts para una tabla de Airtable.
+
+    `update()`, `insert()` y `upsert()` devuelven cuando el lote que contiene la escritura
+    se confirmó en Airtable (o levantan la excepción del lote), así quien llama
+    sigue sabiendo si la escritura se hizo. Una escritura diferida devuelve None.
+
+    `upsert()` necesita `merge_on` (los campos por los que Airtable busca el
+    registro): el mismo alta repetida actualiza la fila en lugar de duplicarla.
+
+    `defer(updates, inserts)` es una corrutina que guarda [(record_id, campos)] y
+    [campos] en el outbox (los upserts van como inserts: el outbox ya hace upsert); `should_defer()` indica si hay que diferir sin intentar
+    (circuito abierto o escrituras anteriores todavía en el outbox, para no
+    adelantarse a ellas).
+    """
+
+    def __init__(self, client, window_seconds=0.2, batch_size=AIRTABLE_BATCH_SIZE, defer=None, should_defer=None,
+                 merge_on=None):
+        self.client = client
+        self.merge_on = merge_on
+        self.window_seconds = window_seconds
+        self.batch_size = batch_size
+        self.defer = defer
+        self.should_defer = should_defer
+        self._updates = {}  # record_id -> [fields, [futures]]
+        self._inserts = []  # [(fields, future)]
+        self._upserts = {}  # valor de merge_on -> [fields, [futures]]
+        self._wakeup = None
+        self._task = None
+        self.requests = 0
+        self.records = 0
+        self.coalesced = 0
+        self.deferred = 0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def _pending(self):
+        return len(self._updates) + len(self._inserts) + len(self._upserts)
+
+    def _schedule(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def update(self, record_id, fields):
+        future = asyncio.get_running_loop().create_future()
+        if record_id in self._updates:
+            # Mismo registro ya en el buffer: se combinan los campos en un solo PATCH
+            self._updates[record_id][0].update(fields)
+            self._updates[record_id][1].append(future)
+            self.coalesced += 1
+        else:
+            self._updates[record_id] = [dict(fields), [future]]
+        self._schedule()
+        if self._task is None:
+            await self.flush()
+        return await future
+
+    async def insert(self, fields):
+        future = asyncio.get_running_loop().create_future()
+        self._inserts.append((fields, future))
+        self._schedule()
+        if self._task is None:
+            await self.flush()
+        return await future
+
+    async def upsert(self, fields):
+        if not self.merge_on:
+            raise ValueError("upsert() necesita merge_on")
+        future = asyncio.get_running_loop().create_future()
+        key = tuple(fields.get(field) for field in self.merge_on)
+        if key in self._upserts:
+            # Airtable no acepta dos registros con la misma clave en un performUpsert
+            self._upserts[key][0].update(fields)
+            self._upserts[key][1].append(future)
+            self.coalesced += 1
+        else:
+            self._upserts[key] = [dict(fields), [future]]
+        self._schedule()
+        if self._task is None:
+            await self.flush()
+        return await future
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            if self._pending() < self.batch_size:
+                # Ventana corta para juntar más escrituras en el mismo lote
+                await asyncio.sleep(self.window_seconds)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Manda todo lo que haya en el buffer, en lotes de `batch_size`."""
+        updates, self._updates = self._updates, {}
+        inserts, self._inserts = self._inserts, []
+        upserts, self._upserts = self._upserts, {}
+        update_items = list(updates.items())
+        upsert_items = list(upserts.values())
+        if self.defer is not None and self.should_defer is not None and self.should_defer() and (updates or inserts or upserts):
+            await self._defer(update_items, inserts, upsert_items)
+            return
+        sends = []
+        for i in range(0, len(update_items), self.batch_size):
+            sends.append(self._send_updates(update_items[i:i + self.batch_size]))
+        for i in range(0, len(inserts), self.batch_size):
+            sends.append(self._send_inserts(inserts[i:i + self.batch_size]))
+        for i in range(0, len(upsert_items), self.batch_size):
+            sends.append(self._send_upserts(upsert_items[i:i + self.batch_size]))
+        if sends:
+            await asyncio.gather(*sends)
+
+    async def _send_updates(self, items):
+        payload = [{"id": record_id, "fields": fields} for record_id, (fields, _) in items]
+        futures = [f for _, (_, fs) in items for f in fs]
+        try:
+            results = await self.client.batch_update(payload)
+        except Exception as e:
+            if self.defer is not None and deferrable(e):
+                await self._defer(items, [])
+            else:
+                _fail(futures, e)
+            return
+        self.requests += 1
+        self.records += len(items)
+        by_id = {r.get("id"): r for r in results}
+        for record_id, (_, fs) in items:
+            for future in fs:
+                if not future.done():
+                    future.set_result(by_id.get(record_id))
+
+    async def _send_inserts(self, items):
+        futures = [future for _, future in items]
+        try:
+            results = await self.client.batch_insert([fields for fields, _ in items])
+        except Exception as e:
+            if self.defer is not None and deferrable(e):
+                await self._defer([], items)
+            else:
+                _fail(futures, e)
+            return
+        self.requests += 1
+        self.records += len(items)
+        for future, record in zip(futures, results):
+            if not future.done():
+                future.set_result(record)
+
+    async def _send_upserts(self, items):
+        futures = [f for _, fs in items for f in fs]
+        try:
+            results = await self.client.batch_upsert([fields for fields, _ in items], self.merge_on)
+        except Exception as e:
+            if self.defer is not None and deferrable(e):
+                await self._defer([], [], items)
+            else:
+                _fail(futures, e)
+            return
+        self.requests += 1
+        self.records += len(items)
+        for (_, fs), record in zip(items, results):
+            for future in fs:
+                if not future.done():
+                    future.set_result(record)
+
+    async def _defer(self, update_items, inserts, upsert_items=()):
+        futures = [f for _, (_, fs) in update_items for f in fs] + [future for _, future in inserts]
+        futures += [f for _, fs in upsert_items for f in fs]
+        try:
+            await self.defer(
+                [(record_id, fields) for record_id, (fields, _) in update_items],
+                [fields for fields, _ in inserts] + [fields for fields, _ in upsert_items],
+            )
+        except Exception as e:
+            _fail(futures, e)
+            return
+        self.deferred += len(update_items) + len(inserts) + len(upsert_items)
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    def stats(self):
+        return {
+            "pending": self._pending(),
+            "requests": self.requests,
+            "records": self.records,
+            "coalesced": self.coalesced,
+            "deferred": self.deferred,
+        }
+
+
+def _fail(futures, error):
+    for future in futures:
+        if not future.done():
+            future.set_exception(error)
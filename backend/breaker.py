@@ -0,0 +1,126 @@
+import time
+
+# Circuit breaker por upstream (uno para Airtable y otro para MercadoPago).
+#
+#   cerrado      las llamadas pasan; N fallas seguidas (errores de red, 5xx,
+#                429 o llamadas más lentas que slow_call_seconds) lo abren
+#   abierto      las llamadas fallan enseguida con CircuitOpenError, sin ir al
+#                upstream, durante reset_seconds
+#   semiabierto  pasado ese tiempo se deja pasar una sola llamada de prueba:
+#                si sale bien se cierra, si falla vuelve a abrirse
+#
+# Mientras está abierto, las consultas se sirven del snapshot local, las
+# escrituras a Airtable van al outbox y las notificaciones se posponen sin
+# gastar intentos. Al cerrarse se avisa a quien esté esperando (on_close).
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """El upstream está marcado como caído: la llamada no se hizo."""
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} no disponible (circuito abierto), reintentar en {retry_after:.1f} s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0, slow_call_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._listeners = []
+        self.opened = 0
+        self.rejected = 0
+        self.slow_calls = 0
+
+    def on_close(self, callback):
+        self._listeners.append(callback)
+
+    def retry_after(self):
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def allows(self):
+        """Si una llamada pasaría ahora (sin ocupar la prueba del semiabierto)."""
+        if self.state == OPEN:
+            return self.retry_after() == 0.0
+        return not (self.state == HALF_OPEN and self._probing)
+
+    def check(self):
+        """Falla enseguida con CircuitOpenError si no pasaría una llamada, sin ocupar la prueba.
+
+        Para llamar antes de esperar turno (token bucket, semáforo): la prueba del
+        semiabierto recién se toma con before(), justo antes del request.
+        """
+        if not self.allows():
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self.retry_after() or self.reset_seconds)
+
+    def before(self):
+        """Llamar antes de cada request; levanta CircuitOpenError si no puede pasar."""
+        if self.state == OPEN and self.retry_after() == 0.0:
+            self.state = HALF_OPEN
+        if self.state == OPEN or (self.state == HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self.retry_after() or self.reset_seconds)
+        if self.state == HALF_OPEN:
+            self._probing = True
+
+    def cancel(self):
+        """La llamada se cortó sin resultado (cancelada, ej. por un wait_for): libera la prueba sin contarla."""
+        if self.state == HALF_OPEN:
+            self._probing = False
+
+    def record(self, ok, duration=None):
+        """Resultado de la llamada: `ok` False para errores de red, 5xx y 429."""
+        if ok and self.slow_call_seconds is not None and duration is not None and duration > self.slow_call_seconds:
+            self.slow_calls += 1
+            ok = False
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if ok:
+                self._close()
+            else:
+                self._open()
+            return
+        if ok:
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.opened += 1
+        print(f"ADVERTENCIA: Circuito de {self.name} abierto tras {self.failures} fallas; "
+              f"se reintenta en {self.reset_seconds:.0f} s.")
+
+    def _close(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        print(f"Circuito de {self.name} cerrado: el upstream volvió a responder.")
+        for callback in self._listeners:
+            callback()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after_seconds": round(self.retry_after(), 2),
+            "opened_total": self.opened,
+            "rejected_total": self.rejected,
+            "slow_calls_total": self.slow_calls,
+        }
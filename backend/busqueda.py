@@ -0,0 +1,243 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+# Índice en memoria para buscar contribuyentes por nombre, DNI (todos los
+# titulares de la celda), nomenclatura catastral, lote y manzana.
+#
+# Cada registro se parte en tokens normalizados (minúsculas, sin acentos, DNIs
+# sin puntos). Sobre los tokens hay tres niveles de coincidencia:
+#   - exacta: diccionario token -> registros
+#   - prefijo: lista ordenada de tokens + bisect ("alv" encuentra "alvarado")
+#   - aproximada: índice de trigramas de los tokens ("albarado" -> "alvarado")
+# El índice se actualiza por registro (upsert/remove) y sync() compara contra
+# una lectura completa de la tabla y solo reindexa lo que cambió.
+
+# Peso de cada campo en el ranking
+FIELD_WEIGHTS = {
+    "id": 4.0,
+    "dnis": 4.0,
+    "nomenclatura": 3.0,
+    "nombre": 2.0,
+    "lote": 1.0,
+    "manzana": 1.0,
+}
+# Fracción del peso según cómo coincidió el token buscado
+EXACT, PREFIX, FUZZY = 1.0, 0.7, 0.5
+
+MIN_PREFIX_LENGTH = 2
+MIN_FUZZY_LENGTH = 3
+MIN_FUZZY_SIMILARITY = 0.4
+# Tope de tokens distintos que puede abarcar un prefijo corto ("a", "20")
+MAX_PREFIX_EXPANSION = 500
+
+# Puntos de miles entre dígitos: 24.017.675 -> 24017675
+_THOUSANDS_RE = re.compile(r"(?<=\d)\.(?=\d{3}(?!\d))")
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text):
+    """Minúsculas, sin acentos ni puntos de miles; todo lo que no es alfanumérico pasa a espacio."""
+    if text is None:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii").lower()
+    return _NON_ALNUM_RE.sub(" ", _THOUSANDS_RE.sub("", text)).strip()
+
+
+def tokenize(text):
+    return normalize(text).split()
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def document(record):
+    """Registro (formato Airtable) -> (clave, resumen, {token: peso}, lote, manzana)."""
+    fields = record.get("fields", {})
+    key = fields.get("ID_Contribuyente")
+    if not key:
+        return None
+    dnis = (fields.get("DNIs") or "").split()
+    summary = {
+        "id": record.get("id"),
+        "dni": key,
+        "dnis": dnis,
+        "nombre": fields.get("Nombre_Contribuyente"),
+        "nomenclatura": fields.get("Nomenclatura_Catastral"),
+        "lote": fields.get("Lote"),
+        "manzana": fields.get("Manzana"),
+        "monto_mensual_impuesto": fields.get("Monto_Mensual_Impuesto"),
+    }
+    sources = {
+        "id": key,
+        "dnis": " ".join(dnis),
+        "nomenclatura": summary["nomenclatura"],
+        "nombre": summary["nombre"],
+        "lote": summary["lote"],
+        "manzana": summary["manzana"],
+    }
+    weights = {}
+    for field, value in sources.items():
+        for token in tokenize(value):
+            weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS[field])
+    return key, summary, weights, normalize(summary["lote"]), normalize(summary["manzana"])
+
+
+class ContribuyentesIndex:
+    def __init__(self):
+        self._docs = {}  # clave -> (resumen, {token: peso}, lote, manzana)
+        self._postings = {}  # token -> {clave: peso}
+        self._sorted_tokens = []
+        self._trigrams = defaultdict(set)  # trigrama -> tokens
+        self._lock = threading.RLock()
+        self.searches = 0
+        self.updates = 0
+        self.last_sync_at = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    # --- mantenimiento ---
+
+    def upsert(self, record):
+        """Indexa (o reindexa) un registro. Devuelve True si cambió algo."""
+        doc = document(record)
+        if doc is None:
+            return False
+        key, summary, weights, lote, manzana = doc
+        with self._lock:
+            current = self._docs.get(key)
+            if current is not None and current[0] == summary:
+                return False
+            if current is not None:
+                self._unindex(key, current[1])
+            self._docs[key] = (summary, weights, lote, manzana)
+            for token, weight in weights.items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    bisect.insort(self._sorted_tokens, token)
+                    for trigram in trigrams(token):
+                        self._trigrams[trigram].add(token)
+                postings[key] = weight
+            self.updates += 1
+            return True
+
+    def remove(self, key):
+        with self._lock:
+            current = self._docs.pop(key, None)
+            if current is None:
+                return False
+            self._unindex(key, current[1])
+            self.updates += 1
+            return True
+
+    def _unindex(self, key, weights):
+        for token in weights:
+            postings = self._postings[token]
+            del postings[key]
+            if postings:
+                continue
+            del self._postings[token]
+            del self._sorted_tokens[bisect.bisect_left(self._sorted_tokens, token)]
+            for trigram in trigrams(token):
+                tokens = self._trigrams[trigram]
+                tokens.discard(token)
+                if not tokens:
+                    del self._trigrams[trigram]
+
+    def sync(self, records):
+        """Deja el índice igual a `records` (tabla completa) tocando solo lo que cambió."""
+        keys = set()
+        changed = 0
+        for record in records:
+            key = record.get("fields", {}).get("ID_Contribuyente")
+            if not key:
+                continue
+            keys.add(key)
+            changed += self.upsert(record)
+        with self._lock:
+            gone = [key for key in self._docs if key not in keys]
+        for key in gone:
+            self.remove(key)
+        self.last_sync_at = time.time()
+        return {"indexed": len(keys), "changed": changed, "removed": len(gone)}
+
+    # --- búsqueda ---
+
+    def _matches(self, token):
+        """{clave: puntaje} de los registros que coinciden con un token de la consulta."""
+        scores = {}
+
+        def add(candidate, factor):
+            for key, weight in self._postings[candidate].items():
+                score = weight * factor
+                if score > scores.get(key, 0.0):
+                    scores[key] = score
+
+        if token in self._postings:
+            add(token, EXACT)
+        if len(token) >= MIN_PREFIX_LENGTH:
+            start = bisect.bisect_right(self._sorted_tokens, token)
+            for candidate in self._sorted_tokens[start:start + MAX_PREFIX_EXPANSION]:
+                if not candidate.startswith(token):
+                    break
+                # Cuanto más completa el prefijo al token, más cerca del exacto
+                add(candidate, PREFIX * (0.5 + 0.5 * len(token) / len(candidate)))
+        if not scores and len(token) >= MIN_FUZZY_LENGTH:
+            wanted = trigrams(token)
+            shared = defaultdict(int)
+            for trigram in wanted:
+                for candidate in self._trigrams.get(trigram, ()):
+                    shared[candidate] += 1
+            for candidate, count in shared.items():
+                similarity = count / (len(wanted) + len(trigrams(candidate)) - count)
+                if similarity >= MIN_FUZZY_SIMILARITY:
+                    add(candidate, FUZZY * similarity)
+        return scores
+
+    def search(self, query="", lote=None, manzana=None, limit=20, offset=0):
+        """Resultados ordenados por puntaje; todos los términos de `query` tienen que coincidir."""
+        tokens = list(dict.fromkeys(tokenize(query)))
+        lote = normalize(lote) if lote else None
+        manzana = normalize(manzana) if manzana else None
+        with self._lock:
+            self.searches += 1
+            if tokens:
+                per_token = sorted((self._matches(token) for token in tokens), key=len)
+                scores = dict(per_token[0])
+                for matches in per_token[1:]:
+                    scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+            else:
+                scores = dict.fromkeys(self._docs, 0.0)
+            hits = []
+            for key, score in scores.items():
+                summary, _, doc_lote, doc_manzana = self._docs[key]
+                if lote is not None and doc_lote != lote:
+                    continue
+                if manzana is not None and doc_manzana != manzana:
+                    continue
+                hits.append((-score, summary["nombre"] or "", key, summary))
+        hits.sort(key=lambda hit: hit[:3])
+        return {
+            "total": len(hits),
+            "limit": limit,
+            "offset": offset,
+            "results": [dict(summary, score=round(-neg, 3)) for neg, _, _, summary in hits[offset:offset + limit]],
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "tokens": len(self._postings),
+                "trigrams": len(self._trigrams),
+                "searches": self.searches,
+                "updates": self.updates,
+                "last_sync_at": self.last_sync_at,
+            }
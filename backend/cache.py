@@ -0,0 +1,256 @@
+import asyncio
+import time
+import threading
+from collections import OrderedDict
+
+# Cache local de la tabla Contribuyentes indexado por ID_Contribuyente (DNI).
+# Evita un round trip a Airtable por cada búsqueda del frontend y nos mantiene
+# lejos del límite de 5 req/s por base.
+
+DEFAULT_TTL_SECONDS = 15 * 60
+DEFAULT_MAX_ENTRIES = 50_000
+
+
+class ContribuyentesCache:
+    """Cache en memoria de registros de Airtable con TTL y desalojo LRU."""
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # dni -> (expira_en, registro)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.last_warm_at = None
+
+    def get(self, dni):
+        """Devuelve el registro cacheado para el DNI o None si no está o expiró."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(dni)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, record = entry
+            if expires_at <= now:
+                del self._entries[dni]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(dni)
+            self.hits += 1
+            return record
+
+    def put(self, dni, record):
+        if not dni:
+            return
+        with self._lock:
+            self._put_locked(dni, record, time.monotonic() + self.ttl_seconds)
+
+    def _put_locked(self, dni, record, expires_at):
+        self._entries[dni] = (expires_at, record)
+        self._entries.move_to_end(dni)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, dni):
+        with self._lock:
+            if self._entries.pop(dni, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def warm(self, records):
+        """Carga en bloque registros de Airtable (lista de dicts con 'fields')."""
+        expires_at = time.monotonic() + self.ttl_seconds
+        loaded = 0
+        with self._lock:
+            for record in records:
+                dni = record.get('fields', {}).get('ID_Contribuyente')
+                if dni:
+                    self._put_locked(dni, record, expires_at)
+                    loaded += 1
+            self.last_warm_at = time.time()
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "last_warm_at": self.last_warm_at,
+            }
+
+
+class SharedContribuyentesCache:
+    """ContribuyentesCache con los registros en el estado compartido entre workers (backend/compartido.py).
+
+    Misma interfaz: lo que cachea un worker lo ven los demás y una invalidación
+    vale para todos, así no hay copias viejas en otro proceso. Los aciertos y
+    fallos se cuentan por proceso; el resto de los números es de todos.
+    """
+
+    ESPACIO = "contribuyentes"
+    PRECARGA = "contribuyentes_precargado_en"
+
+    def __init__(self, estado, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.estado = estado
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, dni):
+        record = self.estado.get(self.ESPACIO, dni)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return record
+
+    def put(self, dni, record):
+        if dni:
+            self.estado.put(self.ESPACIO, dni, record, self.ttl_seconds)
+
+    def invalidate(self, dni):
+        if self.estado.delete(self.ESPACIO, dni):
+            self.invalidations += 1
+
+    def clear(self):
+        self.estado.delete(self.ESPACIO)
+
+    def warm(self, records):
+        items = [(r['fields']['ID_Contribuyente'], r) for r in records if r.get('fields', {}).get('ID_Contribuyente')]
+        loaded = self.estado.put_many(self.ESPACIO, items, self.ttl_seconds)
+        self.evictions += self.estado.trim(self.ESPACIO, self.max_entries)
+        self.estado.put("estado", self.PRECARGA, time.time())
+        return loaded
+
+    @property
+    def last_warm_at(self):
+        # Lo precarga el líder; los demás workers lo leen de acá
+        return self.estado.get("estado", self.PRECARGA)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": self.estado.count(self.ESPACIO),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "last_warm_at": self.last_warm_at,
+            "compartido": True,
+        }
+
+
+class PreferenciasCache:
+    """Links de pago de MercadoPago ya creados, por (DNI, período, monto).
+
+    Cada entrada vence cuando vence la preferencia (fin del período). Si llegan
+    dos pedidos a la vez para la misma clave, se crea una sola preferencia.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (dni, periodo, monto) -> (vence_en, preferencia)
+        self._lock = threading.Lock()
+        self._in_flight = {}  # clave -> asyncio.Future de la creación en curso
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(dni, periodo, monto):
+        return (str(dni), periodo, round(float(monto), 2))
+
+    def get(self, dni, periodo, monto):
+        """Devuelve {"preference_id", "init_point", "expires_at"} o None."""
+        key = self.key(dni, periodo, monto)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, dni, periodo, monto, preference):
+        """`preference` debe traer "expires_at" como datetime con zona horaria."""
+        key = self.key(dni, periodo, monto)
+        with self._lock:
+            self._entries[key] = (preference["expires_at"].timestamp(), preference)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def get_or_create(self, dni, periodo, monto, create):
+        """Busca en memoria y si no está llama a `create()` (corrutina que devuelve la preferencia).
+
+        `create` puede devolver una preferencia persistida (no se cuenta como creada)
+        marcándola con "reused": True.
+        """
+        preference = self.get(dni, periodo, monto)
+        if preference is not None:
+            self.hits += 1
+            return preference
+        key = self.key(dni, periodo, monto)
+        if key in self._in_flight:
+            self.hits += 1
+            return await asyncio.shield(self._in_flight[key])
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            preference = await create()
+            if not preference.get("reused"):
+                self.created += 1
+            self.put(dni, periodo, monto, preference)
+            future.set_result(preference)
+            return preference
+        except Exception as e:
+            future.set_exception(e)
+            # Si nadie más esperaba, que el loop no avise "exception never retrieved"
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "created": self.created,
+            "evictions": self.evictions,
+            "in_flight": len(self._in_flight),
+        }
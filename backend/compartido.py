@@ -0,0 +1,290 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+# Estado compartido entre los procesos de la API cuando corre con varios workers
+# (WEB_CONCURRENCY > 1): un archivo SQLite en modo WAL, mapeado en memoria, que
+# abren a la vez todos los workers de la máquina. Guarda
+#
+#   cache    valores con vencimiento (registros de Contribuyentes por DNI): lo
+#            que consultó un worker no vuelve a ir a Airtable desde otro, y una
+#            invalidación después de una escritura vale para todos
+#   buckets  el token bucket de Airtable: la suma de los workers sigue debajo
+#            de los 5 req/s por base
+#   leases   quién es el líder (el único que drena la cola de webhooks, el
+#            outbox y la conciliación) y locks cortos entre procesos
+#
+# Es un archivo aparte de sql_app.db a propósito: SQLite tiene un solo escritor
+# por archivo y las transacciones de la cola y del outbox no tienen que frenar
+# al token bucket. Además funciona igual con DATABASE_URL apuntando a Postgres.
+
+DEFAULT_PATH = "./compartido.db"
+# Vencimiento "nunca" para las claves de estado (ej. cuándo se precargó el cache)
+SIN_VENCIMIENTO = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    espacio TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    expira_en REAL,
+    PRIMARY KEY (espacio, clave)
+);
+CREATE INDEX IF NOT EXISTS ix_cache_expira_en ON cache (espacio, expira_en);
+CREATE TABLE IF NOT EXISTS buckets (
+    nombre TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    pausado_hasta REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leases (
+    nombre TEXT PRIMARY KEY,
+    duenio TEXT NOT NULL,
+    vence_en REAL NOT NULL
+);
+"""
+
+
+class EstadoCompartido:
+    """Acceso al archivo compartido; una conexión sqlite3 por hilo (event loop y asyncio.to_thread)."""
+
+    def __init__(self, path=DEFAULT_PATH, mmap_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+        self.conexion().executescript(SCHEMA)
+
+    def conexion(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # isolation_level=None: las transacciones se abren a mano con BEGIN IMMEDIATE
+            db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def transaccion(self):
+        """Transacción con el lock de escritura tomado desde el principio (sin carreras entre leer y escribir)."""
+        db = self.conexion()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    # --- cache ---
+
+    def get(self, espacio, clave):
+        row = self.conexion().execute(
+            "SELECT valor FROM cache WHERE espacio = ? AND clave = ? AND (expira_en IS NULL OR expira_en > ?)",
+            (espacio, clave, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, espacio, items, ttl_seconds=SIN_VENCIMIENTO):
+        """Guarda [(clave, valor)] de una sola vez. Devuelve cuántos guardó."""
+        expira_en = None if ttl_seconds is None else time.time() + ttl_seconds
+        rows = [(espacio, str(clave), json.dumps(valor), expira_en) for clave, valor in items]
+        with self.transaccion() as db:
+            db.executemany("INSERT OR REPLACE INTO cache (espacio, clave, valor, expira_en) VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def put(self, espacio, clave, valor, ttl_seconds=SIN_VENCIMIENTO):
+        self.put_many(espacio, [(clave, valor)], ttl_seconds)
+
+    def delete(self, espacio, clave=None):
+        """Borra una clave, o todo el espacio sin `clave`. Devuelve cuántas filas borró."""
+        with self.transaccion() as db:
+            if clave is None:
+                return db.execute("DELETE FROM cache WHERE espacio = ?", (espacio,)).rowcount
+            return db.execute("DELETE FROM cache WHERE espacio = ? AND clave = ?", (espacio, clave)).rowcount
+
+    def count(self, espacio):
+        return self.conexion().execute(
+            "SELECT COUNT(*) FROM cache WHERE espacio = ? AND (expira_en IS NULL OR expira_en > ?)",
+            (espacio, time.time()),
+        ).fetchone()[0]
+
+    def trim(self, espacio, max_entries):
+        """Borra las vencidas y, si sobran, las que vencen primero. Devuelve cuántas desalojó por tamaño."""
+        with self.transaccion() as db:
+            db.execute("DELETE FROM cache WHERE espacio = ? AND expira_en <= ?", (espacio, time.time()))
+            sobran = db.execute("SELECT COUNT(*) FROM cache WHERE espacio = ?", (espacio,)).fetchone()[0] - max_entries
+            if sobran <= 0:
+                return 0
+            db.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE espacio = ? ORDER BY expira_en LIMIT ?)",
+                (espacio, sobran),
+            )
+            return sobran
+
+    # --- token bucket ---
+
+    def take_token(self, nombre, rate, capacity):
+        """Toma un permiso del bucket `nombre`. Devuelve 0.0 si lo tomó, o los segundos a esperar."""
+        with self.transaccion() as db:
+            now = time.time()
+            row = db.execute(
+                "SELECT tokens, actualizado, pausado_hasta FROM buckets WHERE nombre = ?", (nombre,)
+            ).fetchone()
+            tokens, actualizado, pausado_hasta = row if row else (capacity, now, 0.0)
+            if now < pausado_hasta:
+                return pausado_hasta - now
+            tokens = min(capacity, tokens + max(0.0, now - actualizado) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            db.execute(
+                "INSERT OR REPLACE INTO buckets (nombre, tokens, actualizado, pausado_hasta) VALUES (?, ?, ?, ?)",
+                (nombre, tokens, now, pausado_hasta),
+            )
+            return wait
+
+    def pause_bucket(self, nombre, seconds):
+        with self.transaccion() as db:
+            now = time.time()
+            row = db.execute("SELECT pausado_hasta FROM buckets WHERE nombre = ?", (nombre,)).fetchone()
+            pausado_hasta = max(row[0] if row else 0.0, now + seconds)
+            db.execute(
+                "INSERT OR REPLACE INTO buckets (nombre, tokens, actualizado, pausado_hasta) VALUES (?, 0, ?, ?)",
+                (nombre, now, pausado_hasta),
+            )
+
+    # --- leases ---
+
+    def acquire_lease(self, nombre, duenio, ttl_seconds):
+        """Toma o renueva el lease si está libre, vencido o ya es de `duenio`."""
+        with self.transaccion() as db:
+            now = time.time()
+            row = db.execute("SELECT duenio, vence_en FROM leases WHERE nombre = ?", (nombre,)).fetchone()
+            if row is not None and row[0] != duenio and row[1] > now:
+                return False
+            db.execute(
+                "INSERT OR REPLACE INTO leases (nombre, duenio, vence_en) VALUES (?, ?, ?)",
+                (nombre, duenio, now + ttl_seconds),
+            )
+            return True
+
+    def release_lease(self, nombre, duenio):
+        with self.transaccion() as db:
+            db.execute("DELETE FROM leases WHERE nombre = ? AND duenio = ?", (nombre, duenio))
+
+    def lease_owner(self, nombre):
+        """(dueño, segundos que le quedan) o None si no lo tiene nadie."""
+        row = self.conexion().execute(
+            "SELECT duenio, vence_en FROM leases WHERE nombre = ? AND vence_en > ?", (nombre, time.time()),
+        ).fetchone()
+        return (row[0], round(row[1] - time.time(), 2)) if row else None
+
+    @asynccontextmanager
+    async def lock(self, nombre, ttl_seconds=60.0, poll_seconds=0.02):
+        """Lock entre procesos sobre un lease corto (ej. una operación por DNI en todos los workers)."""
+        duenio = uuid.uuid4().hex
+        while not await asyncio.to_thread(self.acquire_lease, nombre, duenio, ttl_seconds):
+            await asyncio.sleep(poll_seconds)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.release_lease, nombre, duenio)
+
+
+class Lider:
+    """Elige un solo worker para las tareas de fondo con un lease que se renueva cada ttl/3.
+
+    `on_elected()` y `on_lost()` son corrutinas: arrancan y frenan las tareas del
+    líder. Si el líder se cae, otro worker toma el lease cuando vence; si
+    `on_elected()` falla, el worker renuncia y se vuelve a presentar en la
+    próxima vuelta.
+    """
+
+    NOMBRE = "tareas_de_fondo"
+
+    def __init__(self, estado, on_elected, on_lost, ttl_seconds=15.0):
+        self.estado = estado
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.ttl_seconds = ttl_seconds
+        self.id = f"{socket.gethostname()}:{os.getpid()}"
+        self.es_lider = False
+        self.elegido_veces = 0
+        self._task = None
+
+    async def elegir(self):
+        """Una vuelta de elección: toma o renueva el lease y avisa si cambió el rol."""
+        try:
+            ok = await asyncio.to_thread(self.estado.acquire_lease, self.NOMBRE, self.id, self.ttl_seconds)
+        except sqlite3.Error as e:
+            print(f"ADVERTENCIA: No se pudo renovar el lease de líder: {e}")
+            ok = False
+        if ok and not self.es_lider:
+            self.es_lider = True
+            self.elegido_veces += 1
+            print(f"Worker {self.id} elegido líder: corre la cola de webhooks, el outbox y la conciliación.")
+            try:
+                await self.on_elected()
+            except Exception as e:
+                # Un líder a medio arrancar no drena nada: suelta el lease para que lo tome otro
+                print(f"ERROR: Worker {self.id} no pudo arrancar las tareas de líder: {e}")
+                await self.renunciar()
+        elif not ok and self.es_lider:
+            self.es_lider = False
+            print(f"ADVERTENCIA: Worker {self.id} perdió el lease de líder.")
+            await self._frenar_tareas()
+
+    async def renunciar(self):
+        """Deja de ser líder: frena las tareas y libera el lease sin esperar a que venza."""
+        if not self.es_lider:
+            return
+        self.es_lider = False
+        await self._frenar_tareas()
+        try:
+            await asyncio.to_thread(self.estado.release_lease, self.NOMBRE, self.id)
+        except sqlite3.Error as e:
+            print(f"ADVERTENCIA: No se pudo liberar el lease de líder: {e}")
+
+    async def _frenar_tareas(self):
+        try:
+            await self.on_lost()
+        except Exception as e:
+            print(f"ERROR: Worker {self.id} no pudo frenar las tareas de líder: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Otro worker puede tomarlo enseguida, sin esperar a que venza
+        await self.renunciar()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.ttl_seconds / 3)
+            try:
+                await self.elegir()
+            except Exception as e:
+                # Si la tarea muere el worker queda con el rol que tenía para siempre
+                print(f"ERROR: Falló la elección de líder en {self.id}: {e}")
+
+    def stats(self):
+        return {
+            "worker": self.id,
+            "lider": self.es_lider,
+            "lider_actual": self.estado.lease_owner(self.NOMBRE),
+            "elegido_veces": self.elegido_veces,
+        }
@@ -0,0 +1,305 @@
+"""
+Conciliación de pagos: recorre /v1/payments/search de MercadoPago en orden de
+date_last_updated a partir de un cursor guardado y aplica solo los pagos que
+faltan en la tabla pagos o que cambiaron de estado (webhooks perdidos o que
+fallaron).
+
+Se procesa de a una página: memoria acotada al tamaño de página y, después de
+aplicar cada página, se guarda el cursor. Si la corrida se corta, la siguiente
+retoma desde la última página completa (los pagos repetidos no se reaplican
+porque el diff contra la tabla pagos los descarta).
+
+La tabla pagos local empieza vacía: con `known_upstream` los pagos que no están
+en ella se buscan también en Airtable, así la primera corrida no vuelve a
+aplicar los de los últimos 30 días. Un pago que falla en `max_attempts`
+corridas seguidas pasa a dead-letter (conciliacion_fallidos) y el cursor sigue.
+
+Uso (desde la raíz del proyecto, con el mismo .env que la API):
+    python -m backend.conciliacion
+    python -m backend.conciliacion --desde 2026-10-01T00:00:00.000-03:00
+"""
+import argparse
+import asyncio
+import time
+
+from backend.database import SessionLocal
+from backend.dedup import CHANGED, NEW, classify
+from backend.models import ConciliacionCursor, ConciliacionFallido, Pago
+from backend.webhook_queue import NonRetryableError, utcnow
+
+CURSOR_NAME = "mercadopago_pagos"
+# Sin cursor guardado se empieza por los últimos 30 días (fecha relativa de la API)
+DEFAULT_BEGIN_DATE = "NOW-30DAYS"
+
+PENDING = "pending"
+DEAD = "dead"
+
+
+def load_cursor(default_begin=DEFAULT_BEGIN_DATE):
+    db = SessionLocal()
+    try:
+        cursor = db.get(ConciliacionCursor, CURSOR_NAME)
+        if cursor is None:
+            return default_begin, 0
+        return cursor.begin_date, cursor.skip
+    finally:
+        db.close()
+
+
+def save_cursor(begin_date, skip):
+    db = SessionLocal()
+    try:
+        cursor = db.get(ConciliacionCursor, CURSOR_NAME)
+        if cursor is None:
+            cursor = ConciliacionCursor(name=CURSOR_NAME)
+            db.add(cursor)
+        cursor.begin_date = begin_date
+        cursor.skip = skip
+        cursor.updated_at = utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def known_statuses(payment_ids):
+    """Una consulta por página: id_transaccion_mp -> estado_pago ya registrado."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Pago.id_transaccion_mp, Pago.estado_pago)
+            .filter(Pago.id_transaccion_mp.in_(payment_ids))
+            .all()
+        )
+        return dict(rows)
+    finally:
+        db.close()
+
+
+def record_failures(errors, max_attempts):
+    """Suma un intento a cada pago de `errors` ({payment_id: error}). Devuelve los que pasaron a dead."""
+    dead = []
+    db = SessionLocal()
+    try:
+        for payment_id, error in errors.items():
+            row = db.get(ConciliacionFallido, payment_id)
+            if row is None:
+                row = ConciliacionFallido(payment_id=payment_id, status=PENDING, attempts=0)
+                db.add(row)
+            row.attempts += 1
+            row.last_error = str(error)[:2000]
+            row.updated_at = utcnow()
+            if row.attempts >= max_attempts:
+                row.status = DEAD
+                dead.append(payment_id)
+        db.commit()
+        return dead
+    finally:
+        db.close()
+
+
+def clear_failures(payment_ids):
+    """Borra los intentos fallidos de pagos que ya se aplicaron."""
+    db = SessionLocal()
+    try:
+        db.query(ConciliacionFallido).filter(ConciliacionFallido.payment_id.in_(payment_ids)).delete(
+            synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def dead_payments(limit=100):
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(ConciliacionFallido)
+            .filter(ConciliacionFallido.status == DEAD)
+            .order_by(ConciliacionFallido.updated_at.desc())
+            .limit(limit)
+            .all()
+        )
+        return [{"payment_id": r.payment_id, "attempts": r.attempts, "last_error": r.last_error} for r in rows]
+    finally:
+        db.close()
+
+
+def pending_changes(payments, known):
+    """Pagos de la página que faltan en la tabla o cambiaron a un estado posterior."""
+    changes = []
+    for payment in payments:
+        decision = classify(known.get(str(payment["id"])), payment.get("status"))
+        if decision in (NEW, CHANGED):
+            changes.append(payment)
+    return changes
+
+
+def advance(begin_date, skip, results):
+    """Próximo (begin_date, skip) después de procesar una página ordenada por date_last_updated.
+
+    begin_date es inclusivo en la API: los pagos con el mismo date_last_updated que
+    el último de la página se vuelven a recibir y hay que saltearlos con el offset.
+    """
+    last = results[-1]["date_last_updated"]
+    same = sum(1 for p in results if p["date_last_updated"] == last)
+    if same == len(results) and begin_date == last:
+        return begin_date, skip + same
+    return last, same
+
+
+class Conciliador:
+    """Recorre los pagos de MercadoPago y aplica los que faltan con `apply_payment`.
+
+    `apply_payment(payment)` es una corrutina que recibe el JSON del pago tal
+    como lo devuelve la API (ver registrar_pago en backend/main.py).
+    `known_upstream(payment_ids)` es una corrutina opcional que devuelve
+    {payment_id: estado} de los pagos que ya están registrados fuera de la
+    tabla pagos local (Airtable en modo airtable).
+    """
+
+    def __init__(self, mercadopago, apply_payment, page_size=100, concurrency=10,
+                 interval_seconds=0.0, default_begin=DEFAULT_BEGIN_DATE, known_upstream=None, max_attempts=5):
+        self.mercadopago = mercadopago
+        self.apply_payment = apply_payment
+        self.known_upstream = known_upstream
+        self.max_attempts = max_attempts
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.interval_seconds = interval_seconds
+        self.default_begin = default_begin
+        self._task = None
+        self._manual = None
+        self._lock = asyncio.Lock()
+        self.last_run = None
+        self.runs = 0
+
+    def start(self):
+        if self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [t for t in (self._task, self._manual) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._manual = None
+
+    @property
+    def running(self):
+        return self._lock.locked() or (self._manual is not None and not self._manual.done())
+
+    def trigger(self):
+        """Lanza una corrida ya, sin esperar a que termine (POST /conciliacion)."""
+        self._manual = asyncio.create_task(self._run_logged())
+
+    async def _run_logged(self):
+        try:
+            await self.run_once()
+        except Exception as e:
+            print(f"ERROR: Falló la conciliación de pagos: {e}")
+
+    async def _run(self):
+        while True:
+            await self._run_logged()
+            await asyncio.sleep(self.interval_seconds)
+
+    async def run_once(self, max_pages=None):
+        """Recorre desde el cursor hasta el final (o `max_pages` páginas). Devuelve el resumen."""
+        async with self._lock:
+            stats = {"pages": 0, "seen": 0, "applied": 0, "skipped": 0, "failed": 0, "dead": 0,
+                     "started_at": time.time(), "seconds": None, "cursor": None}
+            self.last_run = stats
+            self.runs += 1
+            begin_date, skip = await asyncio.to_thread(load_cursor, self.default_begin)
+            start = time.perf_counter()
+            while max_pages is None or stats["pages"] < max_pages:
+                results = await self._page(begin_date, skip)
+                if not results:
+                    break
+                stats["pages"] += 1
+                stats["seen"] += len(results)
+                await self._apply(results, stats)
+                begin_date, skip = advance(begin_date, skip, results)
+                await asyncio.to_thread(save_cursor, begin_date, skip)
+                stats["cursor"] = {"begin_date": begin_date, "skip": skip}
+                if len(results) < self.page_size:
+                    break
+            stats["seconds"] = round(time.perf_counter() - start, 2)
+            print(f"Conciliación de pagos: {stats['seen']} vistos, {stats['applied']} aplicados, "
+                  f"{stats['skipped']} sin contribuyente, {stats['failed']} con error "
+                  f"({stats['dead']} a dead-letter), {stats['pages']} páginas.")
+            return stats
+
+    async def _page(self, begin_date, skip):
+        response = await self.mercadopago.search_payments({
+            "sort": "date_last_updated",
+            "criteria": "asc",
+            "range": "date_last_updated",
+            "begin_date": begin_date,
+            "end_date": "NOW",
+            "limit": self.page_size,
+            "offset": skip,
+        })
+        if response["status"] >= 400:
+            raise Exception(f"MercadoPago respondió {response['status']} en payments/search: {response['response']}")
+        return response["response"].get("results", [])
+
+    async def _apply(self, results, stats):
+        known = await asyncio.to_thread(known_statuses, [str(p["id"]) for p in results])
+        changes = pending_changes(results, known)
+        nuevos = [str(p["id"]) for p in changes if str(p["id"]) not in known]
+        if self.known_upstream is not None and nuevos:
+            # Registrados antes de que existiera la tabla pagos local: no se reaplican
+            known.update(await self.known_upstream(nuevos))
+            changes = pending_changes(changes, known)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        applied = []
+        failed = {}
+
+        async def apply(payment):
+            payment_id = str(payment["id"])
+            async with semaphore:
+                try:
+                    await self.apply_payment(payment)
+                    stats["applied"] += 1
+                    applied.append(payment_id)
+                except NonRetryableError as e:
+                    stats["skipped"] += 1
+                    applied.append(payment_id)
+                    print(f"ADVERTENCIA: Conciliación: pago {payment_id} no aplicado: {e}")
+                except Exception as e:
+                    failed[payment_id] = e
+                    print(f"ERROR: Conciliación: pago {payment_id} falló: {e}")
+
+        await asyncio.gather(*(apply(p) for p in changes))
+        if applied:
+            await asyncio.to_thread(clear_failures, applied)
+        if not failed:
+            return
+        stats["failed"] += len(failed)
+        dead = await asyncio.to_thread(record_failures, failed, self.max_attempts)
+        stats["dead"] += len(dead)
+        for payment_id in dead:
+            print(f"ERROR: Conciliación: pago {payment_id} pasó a dead-letter tras {self.max_attempts} intentos.")
+        if len(dead) < len(failed):
+            # No se avanza el cursor: la próxima corrida vuelve a intentar esta página
+            raise Exception(f"{len(failed) - len(dead)} pagos de la página no se pudieron aplicar")
+
+    def stats(self):
+        return {"runs": self.runs, "running": self.running, "interval_seconds": self.interval_seconds,
+                "last_run": self.last_run}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--desde", default=None, help="begin_date inicial si no hay cursor guardado")
+    parser.add_argument("--paginas", type=int, default=None, help="Máximo de páginas en esta corrida")
+    args = parser.parse_args()
+
+    # La API configura los clientes, el writer y el modo de almacenamiento
+    from backend import main as api
+    print(asyncio.run(api.ejecutar_conciliacion(args.desde, args.paginas)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+
+# Base de datos local (SQLite por defecto, Postgres en producción vía DATABASE_URL)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+if IS_SQLITE:
+    # El engine se comparte entre el event loop y los hilos de asyncio.to_thread
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL permite lecturas concurrentes mientras un worker escribe
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_pre_ping=True,
+        pool_recycle=1800,
+    )
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base = declarative_base()
+
+
+def ping():
+    """SELECT 1 contra la base (lo usa /readyz)."""
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def migrate_columns(metadata, bind=None):
+    """Agrega las columnas nuevas de los modelos a tablas que ya existen.
+
+    create_all() solo crea tablas faltantes; no hay Alembic en el proyecto, así
+    que las columnas agregadas después (siempre nullable) se crean acá con
+    ALTER TABLE ... ADD COLUMN. Devuelve la lista de columnas agregadas.
+    """
+    bind = bind or engine
+    added = []
+    with bind.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                added.append(f"{table.name}.{column.name}")
+    if added:
+        print(f"Columnas agregadas a la base: {', '.join(added)}")
+    return added
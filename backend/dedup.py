@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend import agregados
+from backend.database import SessionLocal, engine
+from backend.models import Pago
+
+# De-duplicación de notificaciones de pago por ID_Transaccion_MP + estado.
+# La fuente de verdad es la tabla pagos (UNIQUE id_transaccion_mp); delante hay un
+# set en memoria con los últimos pagos vistos para no tocar la base en cada repetición.
+
+# Orden de los estados de MercadoPago: un estado de menor rango que el ya registrado
+# es una notificación vieja que llegó tarde y se ignora.
+STATUS_RANK = {
+    "pending": 1,
+    "in_process": 1,
+    "in_mediation": 1,
+    "authorized": 1,
+    "approved": 2,
+    "rejected": 2,
+    "cancelled": 2,
+    "refunded": 3,
+    "charged_back": 3,
+}
+
+NEW = "new"
+CHANGED = "changed"
+DUPLICATE = "duplicate"
+STALE = "stale"
+
+
+def classify(previous_status, status):
+    """Compara el estado recibido con el ya registrado para el mismo pago."""
+    if previous_status is None:
+        return NEW
+    if previous_status == status:
+        return DUPLICATE
+    if STATUS_RANK.get(status, 0) < STATUS_RANK.get(previous_status, 0):
+        return STALE
+    return CHANGED
+
+
+def pago_upsert(payment_id, status, dni, amount, paid_at, method):
+    """INSERT ... ON CONFLICT (id_transaccion_mp) DO UPDATE para la tabla pagos."""
+    values = {
+        "id_transaccion_mp": payment_id,
+        "contribuyente_dni": dni,
+        "monto_pagado": amount,
+        "estado_pago": status,
+        "fecha_pago_real": paid_at,
+        "metodo_registro": method,
+    }
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(Pago).values(**values)
+    return stmt.on_conflict_do_update(
+        index_elements=[Pago.id_transaccion_mp],
+        set_={k: stmt.excluded[k] for k in values if k != "id_transaccion_mp"},
+    )
+
+
+class PaymentDedup:
+    """Set en memoria (acotado) de payment_id -> último estado registrado."""
+
+    def __init__(self, max_entries=10_000):
+        self.max_entries = max_entries
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.stale = 0
+
+    def remember(self, payment_id, status):
+        with self._lock:
+            self._recent[payment_id] = status
+            self._recent.move_to_end(payment_id)
+            while len(self._recent) > self.max_entries:
+                self._recent.popitem(last=False)
+
+    def previous_status(self, payment_id):
+        """Último estado conocido del pago: primero en memoria, después en la tabla pagos."""
+        with self._lock:
+            if payment_id in self._recent:
+                return self._recent[payment_id]
+        db = SessionLocal()
+        try:
+            row = db.query(Pago.estado_pago).filter(Pago.id_transaccion_mp == payment_id).first()
+        finally:
+            db.close()
+        if row is not None:
+            self.remember(payment_id, row.estado_pago)
+            return row.estado_pago
+        return None
+
+    def check(self, payment_id, status):
+        decision = classify(self.previous_status(payment_id), status)
+        if decision == DUPLICATE:
+            self.duplicates += 1
+        elif decision == STALE:
+            self.stale += 1
+        return decision
+
+    def record(self, payment_id, status, dni, amount, paid_at, method):
+        """Inserta o actualiza el pago en la tabla pagos (upsert por id_transaccion_mp) y sus agregados."""
+        db = SessionLocal()
+        try:
+            agregados.aplicar_pago(db, payment_id, status, dni, amount, paid_at)
+            db.execute(pago_upsert(payment_id, status, dni, amount, paid_at, method))
+            db.commit()
+        finally:
+            db.close()
+        self.remember(payment_id, status)
+
+    def stats(self):
+        with self._lock:
+            return {"recent": len(self._recent), "duplicates": self.duplicates, "stale": self.stale}
@@ -0,0 +1,433 @@
+"""
+Facturación masiva: genera el link de pago (preferencia de MercadoPago) del mes
+para todos los contribuyentes con Monto_Mensual_Impuesto distinto de cero.
+
+Las preferencias se crean con un pool acotado de workers y un token bucket
+propio, así la corrida no se come el cupo de MercadoPago que usa /pagar. Cada
+resultado queda en la tabla facturacion (periodo + dni), que hace de checkpoint:
+si la corrida se corta, la siguiente retoma solo lo que falta. Los links quedan
+ahí por período (no en Enlace_Suscripcion_MP, que es del plan de suscripción).
+
+Uso (desde la raíz del proyecto, con el mismo .env que la API):
+    python -m backend.facturacion 2026-11
+    python -m backend.facturacion 2026-11 --concurrencia 20 --reintentar-fallidos
+"""
+import argparse
+import asyncio
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend import agregados, metrics
+from backend.database import SessionLocal, engine
+from backend.models import FacturacionItem
+from backend.ratelimit import TokenBucket
+from backend.webhook_queue import backoff_delay, utcnow
+
+PERIODO_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+# Los períodos se cuentan en hora argentina (sin horario de verano)
+ZONA_HORARIA = timezone(timedelta(hours=-3))
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+def validar_periodo(periodo):
+    if not PERIODO_RE.match(periodo or ""):
+        raise ValueError(f"Período inválido '{periodo}', se espera YYYY-MM")
+    return periodo
+
+
+def periodo_actual():
+    return datetime.now(ZONA_HORARIA).strftime("%Y-%m")
+
+
+def fin_de_periodo(periodo):
+    """Primer instante del mes siguiente: ahí vence la preferencia del período."""
+    anio, mes = map(int, validar_periodo(periodo).split("-"))
+    anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    return datetime(anio, mes, 1, tzinfo=ZONA_HORARIA)
+
+
+def idempotency_key(dni, periodo, monto):
+    """X-Idempotency-Key de la preferencia del período: la misma para /pagar, la facturación y sus reintentos.
+
+    Lleva el monto porque si cambia hace falta un link nuevo (ver seed_items).
+    """
+    return f"preferencia-{periodo}-{dni}-{float(monto):.2f}"
+
+
+def build_preference_data(dni, fields, monto, payer_email, public_url, periodo=None):
+    """Cuerpo de /checkout/preferences para un contribuyente (lo usan /pagar y la facturación).
+
+    Con `periodo` la preferencia vence a fin de ese mes.
+    """
+    titulo = f"Impuesto {fields.get('Tipo_Impuesto')} - DNI: {dni}"
+    vencimiento = {}
+    if periodo:
+        titulo = f"{titulo} - Período {periodo}"
+        vencimiento = {
+            "expires": True,
+            "expiration_date_to": fin_de_periodo(periodo).isoformat(timespec="milliseconds"),
+        }
+    return {
+        "items": [
+            {
+                "title": titulo,
+                "quantity": 1,
+                "unit_price": monto,
+                "currency_id": "ARS" # Asumimos ARS (Pesos Argentinos)
+            }
+        ],
+        "payer": {
+            "name": fields.get('Nombre_Contribuyente'),
+            "surname": fields.get('Nombre_Contribuyente'), # Asumir el mismo nombre si no hay apellido separado
+            "email": payer_email,
+            "identification": {
+                "type": "DNI",
+                "number": dni
+            }
+        },
+        "back_urls": {
+            "success": f"{public_url}/success",
+            "pending": f"{public_url}/pending",
+            "failure": f"{public_url}/failure",
+        },
+        "notification_url": f"{public_url}/webhook/mercadopago",
+        "external_reference": dni, # El webhook usa el DNI para encontrar al contribuyente
+        **vencimiento,
+    }
+
+
+def facturables(records):
+    """Registros (formato Airtable) con monto mensual distinto de cero."""
+    items = []
+    for record in records:
+        fields = record.get("fields", {})
+        dni = fields.get("ID_Contribuyente")
+        monto = fields.get("Monto_Mensual_Impuesto") or 0
+        if dni and monto:
+            items.append({"dni": str(dni), "record_id": record.get("id"), "monto": float(monto), "fields": fields})
+    return items
+
+
+def sumar_facturado(db, periodo, montos):
+    """Suma al agregado FACTURADO la diferencia que van a producir los upserts de `montos` ({dni: monto}).
+
+    Se llama antes del upsert, en la misma transacción (como agregados.aplicar_pago):
+    lee los montos anteriores y suma solo la diferencia. Devuelve los DNIs nuevos.
+    """
+    anteriores = {}
+    dnis = list(montos)
+    for i in range(0, len(dnis), 1000):
+        anteriores.update(db.query(FacturacionItem.dni, FacturacionItem.monto).filter(
+            FacturacionItem.periodo == periodo, FacturacionItem.dni.in_(dnis[i:i + 1000]),
+        ).with_for_update())
+    nuevos = [dni for dni in montos if dni not in anteriores]
+    total = sum(monto - (anteriores.get(dni) or 0.0) for dni, monto in montos.items())
+    agregados.sumar(db, agregados.FACTURADO, periodo, total, len(nuevos))
+    return nuevos
+
+
+def seed_items(periodo, items):
+    """Crea las filas de checkpoint que falten. Devuelve cuántas se agregaron.
+
+    Si el monto de un contribuyente cambió desde la corrida anterior, su fila
+    vuelve a pendiente con el monto nuevo (el link viejo cobra otro importe).
+    """
+    if not items:
+        return 0
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(FacturacionItem)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["periodo", "dni"],
+        set_={"monto": stmt.excluded.monto, "record_id": stmt.excluded.record_id, "status": PENDING,
+              "preference_id": None, "payment_link": None, "updated_at": stmt.excluded.updated_at},
+        where=FacturacionItem.monto != stmt.excluded.monto,
+    )
+    now = utcnow()
+    rows = [
+        {"periodo": periodo, "dni": i["dni"], "record_id": i["record_id"], "monto": i["monto"],
+         "status": PENDING, "attempts": 0, "updated_at": now}
+        for i in items
+    ]
+    db = SessionLocal()
+    try:
+        # Total facturado del período para /resumen/periodos/{periodo}
+        nuevos = sumar_facturado(db, periodo, {r["dni"]: r["monto"] for r in rows})
+        for i in range(0, len(rows), 1000):
+            db.execute(stmt, rows[i:i + 1000])
+        db.commit()
+        return len(nuevos)
+    finally:
+        db.close()
+
+
+def pending_dnis(periodo, retry_failed=False):
+    statuses = [PENDING, FAILED] if retry_failed else [PENDING]
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(FacturacionItem.dni)
+            .filter(FacturacionItem.periodo == periodo, FacturacionItem.status.in_(statuses))
+            .order_by(FacturacionItem.id)
+            .all()
+        )
+        return [dni for (dni,) in rows]
+    finally:
+        db.close()
+
+
+def save_checkpoints(periodo, results):
+    """Guarda en una transacción el resultado de un lote de preferencias."""
+    db = SessionLocal()
+    try:
+        now = utcnow()
+        for r in results:
+            db.execute(
+                update(FacturacionItem)
+                .where(FacturacionItem.periodo == periodo, FacturacionItem.dni == r["dni"])
+                .values(
+                    status=r["status"],
+                    preference_id=r.get("preference_id"),
+                    payment_link=r.get("payment_link"),
+                    attempts=FacturacionItem.attempts + r["attempts"],
+                    last_error=r.get("error"),
+                    updated_at=now,
+                )
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+def find_link(periodo, dni, monto):
+    """Link ya generado para el período y el mismo monto (por /pagar o por la facturación)."""
+    db = SessionLocal()
+    try:
+        item = (
+            db.query(FacturacionItem)
+            .filter(FacturacionItem.periodo == periodo, FacturacionItem.dni == dni, FacturacionItem.status == DONE)
+            .first()
+        )
+        if item is None or not item.payment_link or round(item.monto, 2) != round(float(monto), 2):
+            return None
+        return {"preference_id": item.preference_id, "init_point": item.payment_link}
+    finally:
+        db.close()
+
+
+def save_link(periodo, dni, record_id, monto, preference_id, payment_link):
+    """Guarda (o reemplaza, si cambió el monto) el link del período para el contribuyente."""
+    values = {"periodo": periodo, "dni": dni, "record_id": record_id, "monto": float(monto),
+              "status": DONE, "preference_id": preference_id, "payment_link": payment_link,
+              "attempts": 1, "last_error": None, "updated_at": utcnow()}
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(FacturacionItem).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["periodo", "dni"],
+        set_={k: stmt.excluded[k] for k in values if k not in ("periodo", "dni", "attempts")},
+    )
+    db = SessionLocal()
+    try:
+        sumar_facturado(db, periodo, {dni: float(monto)})
+        db.execute(stmt)
+        db.commit()
+    finally:
+        db.close()
+
+
+def progress(periodo):
+    """Conteo por estado de las filas de checkpoint del período."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(FacturacionItem.status, func.count(FacturacionItem.id))
+            .filter(FacturacionItem.periodo == periodo)
+            .group_by(FacturacionItem.status)
+            .all()
+        )
+        counts = {PENDING: 0, DONE: 0, FAILED: 0}
+        counts.update({status: count for status, count in rows})
+        counts["total"] = sum(counts.values())
+        return counts
+    finally:
+        db.close()
+
+
+class FacturacionRun:
+    """Una corrida de facturación para un período.
+
+    `write_links` es una corrutina que recibe una lista de resultados exitosos
+    ({"dni", "record_id", "payment_link", "preference_id"}) después de guardarlos
+    en el checkpoint (la API los deja en el cache de /pagar).
+    """
+
+    def __init__(self, periodo, mercadopago, build_preference, write_links, concurrency=10,
+                 rate=20.0, checkpoint_every=50, max_attempts=3, backoff_base_seconds=1.0,
+                 report_every_seconds=5.0):
+        self.periodo = validar_periodo(periodo)
+        self.mercadopago = mercadopago
+        self.build_preference = build_preference
+        self.write_links = write_links
+        self.concurrency = concurrency
+        self.rate_limiter = TokenBucket(rate)
+        self.checkpoint_every = checkpoint_every
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.report_every_seconds = report_every_seconds
+        self.total = 0
+        self.created = 0
+        self.failed = 0
+        self.retried = 0
+        self.written = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.task = None  # asyncio.Task cuando la lanza la API
+        self.publicador = None  # asyncio.Task que publica stats() con varios workers
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def running(self):
+        return self.started_at is not None and self.finished_at is None
+
+    async def run(self, records, retry_failed=False):
+        self.started_at = time.monotonic()
+        try:
+            items = {i["dni"]: i for i in facturables(records)}
+            nuevos = await asyncio.to_thread(seed_items, self.periodo, list(items.values()))
+            dnis = await asyncio.to_thread(pending_dnis, self.periodo, retry_failed)
+            # Un DNI con checkpoint pero que ya no está en el padrón no se factura
+            todo = [items[dni] for dni in dnis if dni in items]
+            self.total = len(todo)
+            print(f"Facturación {self.periodo}: {len(items)} facturables, {nuevos} nuevos, "
+                  f"{self.total} pendientes de generar.")
+
+            queue = asyncio.Queue()
+            for item in todo:
+                queue.put_nowait(item)
+            reporter = asyncio.create_task(self._report())
+            try:
+                await asyncio.gather(*(self._worker(queue) for _ in range(self.concurrency)))
+            finally:
+                reporter.cancel()
+                await asyncio.gather(reporter, return_exceptions=True)
+                # También si se cancela la corrida: lo ya creado queda en el checkpoint
+                await self._flush()
+        except Exception as e:
+            self.error = str(e)
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+            print(f"Facturación {self.periodo} terminada: {self.stats()}")
+        return self.stats()
+
+    async def _worker(self, queue):
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            result = await self._create(item)
+            self._buffer.append(result)
+            if len(self._buffer) >= self.checkpoint_every:
+                await self._flush()
+
+    async def _create(self, item):
+        preference_data = self.build_preference(item["dni"], item["fields"], item["monto"], self.periodo)
+        # Un timeout o 5xx con la preferencia ya creada, o una corrida cortada que se retoma,
+        # no dejan una preferencia repetida en MercadoPago
+        key = idempotency_key(item["dni"], self.periodo, item["monto"])
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await self.rate_limiter.acquire()
+            try:
+                response = await self.mercadopago.create_preference(preference_data, idempotency_key=key)
+                status = response.get("status", 200)
+                body = response.get("response") or {}
+                if status < 400 and body.get("init_point"):
+                    self.created += 1
+                    return {"dni": item["dni"], "record_id": item["record_id"], "monto": item["monto"], "status": DONE,
+                            "attempts": attempt, "preference_id": body.get("id"),
+                            "payment_link": body["init_point"]}
+                error = f"{status}: {body.get('message', body)}"
+                if status < 500 and status != 429:
+                    break  # Error del pedido: reintentar no cambia nada
+                if status == 429:
+                    self.rate_limiter.pause(self.backoff_base_seconds * attempt)
+            except Exception as e:
+                error = str(e)
+            if attempt < self.max_attempts:
+                self.retried += 1
+                metrics.upstream_retries.inc("mercadopago")
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base_seconds, 30.0))
+        self.failed += 1
+        return {"dni": item["dni"], "record_id": item["record_id"], "status": FAILED,
+                "attempts": self.max_attempts, "error": (error or "")[:2000]}
+
+    async def _flush(self):
+        async with self._flush_lock:
+            results, self._buffer = self._buffer, []
+            if not results:
+                return
+            # Primero el checkpoint: si falla la escritura del link, el link no se pierde
+            await asyncio.to_thread(save_checkpoints, self.periodo, results)
+            links = [r for r in results if r["status"] == DONE]
+            if links:
+                try:
+                    await self.write_links(links)
+                    self.written += len(links)
+                except Exception as e:
+                    print(f"ADVERTENCIA: No se pudieron escribir {len(links)} links de la facturación {self.periodo}: {e}")
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_every_seconds)
+            s = self.stats()
+            print(f"Facturación {self.periodo}: {s['procesados']}/{s['total']} "
+                  f"({s['creados']} creados, {s['fallidos']} fallidos) {s['por_segundo']}/s")
+
+    def stats(self):
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        procesados = self.created + self.failed
+        return {
+            "periodo": self.periodo,
+            "en_curso": self.running,
+            "total": self.total,
+            "procesados": procesados,
+            "creados": self.created,
+            "fallidos": self.failed,
+            "reintentos": self.retried,
+            "links_escritos": self.written,
+            "segundos": round(elapsed, 2),
+            "por_segundo": round(procesados / elapsed, 1) if elapsed else 0.0,
+            "error": self.error,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("periodo", help="Período a facturar (YYYY-MM)")
+    parser.add_argument("--concurrencia", type=int, default=None, help="Preferencias en vuelo a la vez")
+    parser.add_argument("--reintentar-fallidos", action="store_true", help="Volver a intentar los que fallaron")
+    args = parser.parse_args()
+    try:
+        validar_periodo(args.periodo)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # La API configura los clientes, el writer y el modo de almacenamiento
+    from backend import main as api
+    print(asyncio.run(api.ejecutar_facturacion(args.periodo, args.concurrencia, args.reintentar_fallidos)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+Importador de padrones (CSV o XLSX) hacia la tabla contribuyentes.
+
+Lee el archivo en streaming, normaliza montos y DNIs una sola vez, compara contra
+las claves existentes (precargadas con una sola consulta) y aplica solo las
+altas y modificaciones con INSERT ... ON CONFLICT en lotes. Es idempotente:
+volver a importar el mismo archivo no escribe nada.
+
+Uso (desde la raíz del proyecto):
+    python -m backend.importer retributivos.csv --dry-run
+    python -m backend.importer "CONTIBUYENTES Retributivos (1).xlsx" --columna-monto ENERO
+
+El encabezado se busca en las primeras filas y puede ocupar dos (en el XLSX
+municipal los meses están debajo de '2025'); las celdas numéricas del XLSX se
+leen como números, no como texto.
+"""
+import argparse
+import csv
+import os
+import time
+import zlib
+from itertools import chain, islice
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from backend import agregados, normalizacion
+from backend.database import engine
+from backend.models import Contribuyente
+from backend.normalizacion import normalize_header
+
+CHUNK_SIZE = 5000
+TIPO_IMPUESTO = "Tasa Retributiva"
+# Columnas de la tabla contribuyentes que escribe el importador (además de dni)
+IMPORTED_COLUMNS = ("nombre", "monto_mensual_impuesto", "tipo_impuesto", "dnis", "nomenclatura", "lote", "manzana",
+                    "deuda_padron")
+
+
+# Hasta qué fila se busca el encabezado (CONTRIBUYENTE, DNI, ...)
+HEADER_SEARCH_ROWS = 10
+
+
+def iter_csv(path):
+    with open(path, mode="r", encoding="utf-8", newline="") as file:
+        yield from csv.reader(file)
+
+
+def xlsx_value(value):
+    """Celda del XLSX: los números quedan numéricos (un DNI 28787934.0 pasa a int), None -> ''."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def iter_xlsx(path, sheet=None):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("Para importar archivos .xlsx hace falta instalar openpyxl (ver requirements.txt)")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        if sheet:
+            worksheet = workbook[sheet]
+        else:
+            # La primera hoja con encabezado de padrón (el XLSX municipal empieza con DEUDAS)
+            worksheet = next(
+                (ws for ws in workbook.worksheets if find_header(islice(ws.iter_rows(values_only=True), HEADER_SEARCH_ROWS))),
+                workbook.worksheets[0],
+            )
+        for row in worksheet.iter_rows(values_only=True):
+            yield [xlsx_value(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def find_header(rows):
+    """Posición de la fila de encabezado entre `rows`, o None."""
+    for position, row in enumerate(rows):
+        headers = [normalize_header(h) for h in row]
+        if "CONTRIBUYENTE" in headers and "DNI" in headers:
+            return position + 1
+    return None
+
+
+def read_header(rows):
+    """Encabezados normalizados y número de filas que ocupan.
+
+    Busca la fila del encabezado en las primeras HEADER_SEARCH_ROWS filas. Si la
+    fila siguiente es un sub-encabezado (sin nombre ni DNI, solo textos: los meses
+    debajo de '2025' en el XLSX, 'S/INTERES' debajo de 'DEUDA'), se combina:
+    '2025' + 'ENERO' -> 'ENERO', 'DEUDA' + 'S/INTERES' -> 'DEUDA S/INTERES'.
+    """
+    top = list(islice(rows, HEADER_SEARCH_ROWS))
+    position = find_header(top)
+    if position is None:
+        raise ValueError(f"No se encontró la fila de encabezado (CONTRIBUYENTE, DNI) en las primeras "
+                         f"{HEADER_SEARCH_ROWS} filas")
+    headers = [normalize_header(h) for h in top[position - 1]]
+    pending = top[position:]
+    sub = pending[0] if pending else None
+    idx_nombre, idx_dni = headers.index("CONTRIBUYENTE"), headers.index("DNI")
+    if sub is not None and is_sub_header(sub, idx_nombre, idx_dni):
+        pending = pending[1:]
+        position += 1
+        sub = [normalize_header(h) for h in sub] + [""] * (len(headers) - len(sub))
+        headers = [
+            (s if not h or h.isdigit() else f"{h} {s}") if s else h
+            for h, s in zip(headers, sub)
+        ] + sub[len(headers):]
+    return headers, position, chain(pending, rows)
+
+
+def is_sub_header(row, idx_nombre, idx_dni):
+    """Fila sin nombre ni DNI cuyas celdas no vacías son todas texto no numérico."""
+    cells = [c for c in row if str(c).strip()]
+    key_cells = [row[i] for i in (idx_nombre, idx_dni) if i < len(row)]
+    return (
+        bool(cells)
+        and not any(str(c).strip() for c in key_cells)
+        and all(isinstance(c, str) for c in cells)
+        and all(v is None for v in normalizacion.parse_amounts(cells))
+    )
+
+
+def iter_records(path, amount_column="DICIEMBRE", sheet=None, report=None):
+    """Genera dicts listos para la tabla contribuyentes a partir de las filas del archivo."""
+    rows = iter_xlsx(path, sheet) if path.lower().endswith((".xlsx", ".xlsm")) else iter_csv(path)
+    headers, line, rows = read_header(rows)
+    try:
+        idx_nombre = headers.index("CONTRIBUYENTE")
+        idx_dni = headers.index("DNI")
+        idx_nomenclatura = headers.index("NOMENCLATURA CATASTRAL")
+        idx_monto = headers.index(normalize_header(amount_column))
+    except ValueError as e:
+        raise ValueError(f"Falta una columna esperada en {path}: {e}")
+    # LOTE y MANZANA son opcionales: solo sirven para la búsqueda
+    idx_lote = headers.index("LOTE") if "LOTE" in headers else None
+    idx_manzana = headers.index("MANZANA") if "MANZANA" in headers else None
+    # Deuda acumulada informada en el padrón ("DEUDA a octubre- S/INTERES"), también opcional
+    idx_deuda = next((i for i, h in enumerate(headers) if h.startswith("DEUDA")), None)
+
+    # Se normaliza por bloques de filas, columna por columna (ver backend/normalizacion.py)
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return
+        width = len(headers)
+        chunk = [row + [""] * (width - len(row)) if len(row) < width else row for row in chunk]
+        nombres = normalizacion.normalize_texts(row[idx_nombre] for row in chunk)
+        nomenclaturas = normalizacion.parse_nomenclaturas(row[idx_nomenclatura] for row in chunk)
+        dnis = normalizacion.parse_dnis(row[idx_dni] for row in chunk)
+        keys = normalizacion.contribuyente_ids(dnis, nomenclaturas)
+        montos = normalizacion.parse_amounts(row[idx_monto] for row in chunk)
+        lotes = optional_texts(chunk, idx_lote)
+        manzanas = optional_texts(chunk, idx_manzana)
+        deudas = [None] * len(chunk) if idx_deuda is None else normalizacion.parse_amounts(row[idx_deuda] for row in chunk)
+
+        for row, nombre, key, monto, titulares, nomenclatura, lote, manzana, deuda in zip(
+            chunk, nombres, keys, montos, dnis, nomenclaturas, lotes, manzanas, deudas
+        ):
+            line += 1
+            if not key:
+                # Incluye filas vacías y sub-encabezados como 'S/INTERES'
+                report.skip(line, f"sin DNI ni nomenclatura válida ({nombre or 'sin nombre'})")
+                continue
+            if monto is None:
+                report.warn(line, f"monto '{row[idx_monto]}' inválido para {key}, se usa 0.0")
+                monto = 0.0
+            yield {
+                "dni": key,
+                "nombre": nombre,
+                "monto_mensual_impuesto": monto,
+                "tipo_impuesto": TIPO_IMPUESTO,
+                # Todos los titulares de la celda DNI, separados por espacio
+                "dnis": " ".join(titulares) or None,
+                "nomenclatura": nomenclatura,
+                "lote": lote or None,
+                "manzana": manzana or None,
+                "deuda_padron": deuda,
+                # Solo se usa al insertar; en las modificaciones ver upsert_statement
+                "deuda": deuda,
+            }
+
+
+def optional_texts(chunk, index):
+    if index is None:
+        return [None] * len(chunk)
+    return normalizacion.normalize_texts(row[index] for row in chunk)
+
+
+def fingerprint(record):
+    """Hash compacto de los campos importados, para comparar sin guardar las filas."""
+    return zlib.crc32("\x1f".join(repr(record[column]) for column in IMPORTED_COLUMNS).encode("utf-8"))
+
+
+def load_existing(connection):
+    """Una sola consulta: dni -> fingerprint de lo que ya está en la base."""
+    columns = [getattr(Contribuyente, column) for column in IMPORTED_COLUMNS]
+    result = connection.execute(select(Contribuyente.dni, *columns)).yield_per(CHUNK_SIZE)
+    return {row[0]: fingerprint(dict(zip(IMPORTED_COLUMNS, row[1:]))) for row in result}
+
+
+def upsert_statement(connection):
+    dialect_insert = postgresql.insert if connection.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(Contribuyente)
+    # La deuda actual ya descuenta los pagos registrados: se le aplica solo
+    # la diferencia entre la deuda del padrón nuevo y la del anterior (sin bajar de 0,
+    # como al registrar un pago en backend/agregados.py)
+    deuda = (
+        func.coalesce(Contribuyente.deuda, 0.0)
+        - func.coalesce(Contribuyente.deuda_padron, 0.0)
+        + func.coalesce(stmt.excluded.deuda_padron, 0.0)
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[Contribuyente.dni],
+        set_=dict(
+            {column: getattr(stmt.excluded, column) for column in IMPORTED_COLUMNS},
+            deuda=case((deuda > 0, deuda), else_=0.0),
+        ),
+    )
+
+
+class ImportReport:
+    MAX_DETAILS = 20
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.duplicated = 0
+        self.skipped = 0
+        self.warnings = 0
+        self.details = []
+        self.elapsed = 0.0
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        self._detail(f"línea {line}: ignorada, {reason}")
+
+    def warn(self, line, message):
+        self.warnings += 1
+        self._detail(f"línea {line}: {message}")
+
+    def _detail(self, message):
+        if len(self.details) < self.MAX_DETAILS:
+            self.details.append(message)
+
+    def summary(self):
+        modo = "SIMULACIÓN (dry-run)" if self.dry_run else "APLICADO"
+        lines = [
+            f"Importación {modo} en {self.elapsed:.2f} s",
+            f"  filas leídas:   {self.read}",
+            f"  altas:          {self.inserted}",
+            f"  modificaciones: {self.updated}",
+            f"  sin cambios:    {self.unchanged}",
+            f"  repetidas:      {self.duplicated}",
+            f"  ignoradas:      {self.skipped}",
+            f"  advertencias:   {self.warnings}",
+        ]
+        lines += [f"  - {d}" for d in self.details]
+        return "\n".join(lines)
+
+
+def import_file(path, dry_run=False, amount_column="DICIEMBRE", sheet=None, bind=None):
+    """Importa el padrón y devuelve un ImportReport."""
+    bind = bind or engine
+    report = ImportReport(dry_run)
+    start = time.perf_counter()
+    with bind.connect() as connection:
+        existing = load_existing(connection)
+        stmt = upsert_statement(connection)
+        seen = set()
+        batch = []
+
+        def flush():
+            if batch and not dry_run:
+                connection.execute(stmt, batch)
+                connection.commit()
+            batch.clear()
+
+        for record in iter_records(path, amount_column, sheet, report):
+            report.read += 1
+            dni = record["dni"]
+            if dni in seen:
+                # El mismo contribuyente aparece otra vez en el archivo: gana la primera fila
+                report.duplicated += 1
+                continue
+            seen.add(dni)
+            new_fp = fingerprint(record)
+            old_fp = existing.get(dni)
+            if old_fp == new_fp:
+                report.unchanged += 1
+                continue
+            if old_fp is None:
+                report.inserted += 1
+            else:
+                report.updated += 1
+            batch.append(record)
+            if len(batch) >= CHUNK_SIZE:
+                flush()
+        flush()
+    if not dry_run and (report.inserted or report.updated):
+        # Deuda total para /resumen (ver backend/agregados.py)
+        with Session(bind) as db:
+            agregados.recalcular_deuda(db)
+            db.commit()
+    report.elapsed = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archivo", help="Ruta al CSV o XLSX del padrón")
+    parser.add_argument("--dry-run", action="store_true", help="Calcular el diff sin escribir en la base")
+    parser.add_argument("--columna-monto", default="DICIEMBRE", help="Columna con el monto mensual")
+    parser.add_argument("--hoja", default=None,
+                        help="Hoja del XLSX (por defecto la primera con encabezado CONTRIBUYENTE/DNI)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.archivo):
+        parser.error(f"No se encontró el archivo {args.archivo}")
+
+    from backend import models
+    from backend.database import migrate_columns
+    models.Base.metadata.create_all(bind=engine)
+    migrate_columns(models.Base.metadata)
+    print(import_file(args.archivo, args.dry_run, args.columna_monto, args.hoja).summary())
+
+
+if __name__ == "__main__":
+    main()
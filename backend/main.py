@@ -1,31 +1,78 @@
-from fastapi import FastAPI, HTTPException
-import mercadopago # Importar la librería de MercadoPago
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio
+import hmac
 import os
+import time
+from contextlib import asynccontextmanager, nullcontext
 from dotenv import load_dotenv # Para cargar las variables de entorno
 from datetime import datetime # Para manejar fechas
 from fastapi.middleware.cors import CORSMiddleware # <<-- AÑADIR ESTA LÍNEA
-from airtable import Airtable # <<-- NUEVA IMPORTACIÓN DE AIRTABLE
+from backend import (
+    agregados, compartido, conciliacion, database, facturacion, metrics, models, notificaciones, snapshot, storage,
+    suscripciones, webhook_queue,
+)
+from backend.airtable_writer import AirtableWriter
+from backend.breaker import CLOSED, HALF_OPEN, CircuitBreaker, CircuitOpenError
+from backend.busqueda import ContribuyentesIndex
+from backend.cache import ContribuyentesCache, PreferenciasCache, SharedContribuyentesCache
+from backend.compartido import EstadoCompartido, Lider
+from backend.dedup import CHANGED, DUPLICATE, STALE, PaymentDedup
+from backend.outbox import RECORD_ID_KEY, SOCIO_DNI_KEY, OutboxReplicator, outbox_depth
+from backend.database import engine
+from backend.notificaciones import NotificacionesDispatcher
+from backend.ratelimit import SharedTokenBucket, TokenBucket
+from backend.upstream import (
+    AirtableClient, AIRTABLE_API_URL, MERCADOPAGO_API_URL, airtable_formula,
+    build_airtable_http, build_mercadopago_client, build_whatsapp_client,
+)
+from backend.webhook_queue import NonRetryableError, WebhookWorkerPool
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
-print(f"DEBUG: Ruta .env usada por load_dotenv: {os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')}")
 
 # Variables de entorno para MercadoPago
 MERCADOPAGO_ACCESS_TOKEN = os.getenv("MERCADOPAGO_ACCESS_TOKEN")
-print(f"DEBUG: MERCADOPAGO_ACCESS_TOKEN obtenido: {MERCADOPAGO_ACCESS_TOKEN}")
 if not MERCADOPAGO_ACCESS_TOKEN:
     raise ValueError("MERCADOPAGO_ACCESS_TOKEN no está configurado en el archivo .env")
 
 MERCADOPAGO_PAYER_EMAIL = os.getenv("MERCADOPAGO_PAYER_EMAIL")
 if not MERCADOPAGO_PAYER_EMAIL:
     raise ValueError("MERCADOPAGO_PAYER_EMAIL no está configurado en el archivo .env")
-print(f"DEBUG: MERCADOPAGO_PAYER_EMAIL obtenido: {MERCADOPAGO_PAYER_EMAIL}")
 
 # <<-- ELIMINAMOS NGROK_PUBLIC_URL Y USAMOS LA URL FIJA DEL BACKEND -->>
 BACKEND_PUBLIC_URL = "https://traful.onrender.com"
-print(f"DEBUG: BACKEND_PUBLIC_URL configurada: {BACKEND_PUBLIC_URL}")
 # <<-- FIN NGROK_PUBLIC_URL -->>
 
-sdk = mercadopago.SDK(MERCADOPAGO_ACCESS_TOKEN)
+# Límites de la capa de I/O hacia los servicios externos
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "10"))
+AIRTABLE_MAX_CONCURRENCY = int(os.getenv("AIRTABLE_MAX_CONCURRENCY", "5"))
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", "5"))  # requests por segundo por base
+AIRTABLE_WRITE_WINDOW_SECONDS = float(os.getenv("AIRTABLE_WRITE_WINDOW_SECONDS", "0.2"))
+MERCADOPAGO_MAX_CONCURRENCY = int(os.getenv("MERCADOPAGO_MAX_CONCURRENCY", "20"))
+# Facturación masiva: preferencias en vuelo y por segundo (deja cupo libre para /pagar)
+FACTURACION_CONCURRENCY = int(os.getenv("FACTURACION_CONCURRENCY", "10"))
+FACTURACION_RATE_LIMIT = float(os.getenv("FACTURACION_RATE_LIMIT", "20"))
+# Operaciones masivas de suscripciones: planes en vuelo y por segundo
+SUSCRIPCIONES_CONCURRENCY = int(os.getenv("SUSCRIPCIONES_CONCURRENCY", "10"))
+SUSCRIPCIONES_RATE_LIMIT = float(os.getenv("SUSCRIPCIONES_RATE_LIMIT", "20"))
+
+# Circuit breakers por upstream (ver backend/breaker.py): fallas seguidas para abrir,
+# segundos abierto antes de probar y duración a partir de la cual una llamada cuenta como falla
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "5"))
+# Espera máxima de una consulta de contribuyente a Airtable antes de servir la copia local
+CONTRIBUYENTE_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("CONTRIBUYENTE_LOOKUP_TIMEOUT_SECONDS", "3"))
+airtable_breaker = CircuitBreaker("airtable", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, CIRCUIT_SLOW_CALL_SECONDS)
+mercadopago_breaker = CircuitBreaker("mercadopago", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS, CIRCUIT_SLOW_CALL_SECONDS)
+
+mercadopago_client = build_mercadopago_client(
+    MERCADOPAGO_ACCESS_TOKEN,
+    base_url=os.getenv("MERCADOPAGO_API_URL", MERCADOPAGO_API_URL),
+    timeout_seconds=UPSTREAM_TIMEOUT_SECONDS,
+    max_concurrency=MERCADOPAGO_MAX_CONCURRENCY,
+    breaker=mercadopago_breaker,
+)
 
 # Variables de entorno para Airtable
 AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
@@ -42,43 +89,447 @@ if not AIRTABLE_CONTRIBUYENTES_TABLE_NAME:
 if not AIRTABLE_PAGOS_TABLE_NAME:
     raise ValueError("AIRTABLE_PAGOS_TABLE_NAME no está configurado en el archivo .env")
 
-# Inicializar clientes de Airtable
-airtable_contribuyentes = Airtable(AIRTABLE_BASE_ID, AIRTABLE_CONTRIBUYENTES_TABLE_NAME, api_key=AIRTABLE_API_KEY)
-airtable_pagos = Airtable(AIRTABLE_BASE_ID, AIRTABLE_PAGOS_TABLE_NAME, api_key=AIRTABLE_API_KEY)
+# Token de los endpoints administrativos (facturación y suscripciones masivas, cancelar planes,
+# recalcular el resumen), en el header X-Admin-Token. Sin ADMIN_TOKEN quedan deshabilitados.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Almacenamiento principal: "airtable" (por defecto) o "sql" (base local + réplica a Airtable)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "airtable").lower()
+if STORAGE_BACKEND not in ("airtable", "sql"):
+    raise ValueError("STORAGE_BACKEND debe ser 'airtable' o 'sql'")
+
+# Modo multi-worker (ver backend/compartido.py): con WEB_CONCURRENCY > 1 los procesos comparten
+# el cache de contribuyentes y el token bucket de Airtable, y uno solo (el líder) corre las
+# tareas de fondo. SHARED_STATE=1/0 lo fuerza aunque haya un solo worker.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+SHARED_STATE = os.getenv("SHARED_STATE", "1" if WEB_CONCURRENCY > 1 else "0") == "1"
+estado_compartido = EstadoCompartido(os.getenv("SHARED_STATE_PATH", compartido.DEFAULT_PATH)) if SHARED_STATE else None
+
+# Clientes de Airtable (comparten pool de conexiones y límite de concurrencia).
+# Los pools HTTP se arman en el primer request, no al importar (ver LazyHttpClient).
+airtable_http = build_airtable_http(
+    AIRTABLE_API_KEY,
+    base_url=os.getenv("AIRTABLE_API_URL", AIRTABLE_API_URL),
+    timeout_seconds=UPSTREAM_TIMEOUT_SECONDS,
+    max_connections=AIRTABLE_MAX_CONCURRENCY,
+)
+airtable_semaphore = asyncio.Semaphore(AIRTABLE_MAX_CONCURRENCY)
+if SHARED_STATE:
+    # El límite es por base: entre todos los workers
+    airtable_rate_limiter = SharedTokenBucket(estado_compartido, f"airtable:{AIRTABLE_BASE_ID}", AIRTABLE_RATE_LIMIT)
+else:
+    airtable_rate_limiter = TokenBucket(AIRTABLE_RATE_LIMIT)
+airtable_contribuyentes = AirtableClient(airtable_http, AIRTABLE_BASE_ID, AIRTABLE_CONTRIBUYENTES_TABLE_NAME, airtable_semaphore, rate_limiter=airtable_rate_limiter, breaker=airtable_breaker)
+airtable_pagos = AirtableClient(airtable_http, AIRTABLE_BASE_ID, AIRTABLE_PAGOS_TABLE_NAME, airtable_semaphore, rate_limiter=airtable_rate_limiter, breaker=airtable_breaker)
+
+
+def diferir_escrituras(table_name, merge_field):
+    """Escrituras del AirtableWriter que no se pudieron mandar -> outbox (las replica outbox_replicator)."""
+    async def defer(updates, inserts):
+        rows = [(record_id, dict(fields, **{RECORD_ID_KEY: record_id})) for record_id, fields in updates]
+        rows += [(fields.get(merge_field), fields) for fields in inserts]
+        await asyncio.to_thread(storage.add_outbox_rows, table_name, rows)
+        outbox_replicator.notify()
+        print(f"ADVERTENCIA: Airtable no disponible, {len(rows)} escrituras de {table_name} quedan en el outbox.")
+    return defer
+
+
+def diferir_ahora():
+    # Circuito abierto, o escrituras anteriores todavía en el outbox (no hay que adelantarse)
+    return not airtable_breaker.allows() or outbox_replicator.pending
+
+
+# Escrituras en lotes de 10 con combinación de updates (ver backend/airtable_writer.py)
+contribuyentes_writer = AirtableWriter(
+    airtable_contribuyentes, window_seconds=AIRTABLE_WRITE_WINDOW_SECONDS,
+    defer=diferir_escrituras(storage.AIRTABLE_TABLE_CONTRIBUYENTES, "ID_Contribuyente"), should_defer=diferir_ahora,
+)
+pagos_writer = AirtableWriter(
+    airtable_pagos, window_seconds=AIRTABLE_WRITE_WINDOW_SECONDS,
+    defer=diferir_escrituras(storage.AIRTABLE_TABLE_PAGOS, "ID_Transaccion_MP"), should_defer=diferir_ahora,
+    merge_on=["ID_Transaccion_MP"],
+)
+
+# Cache local de Contribuyentes indexado por DNI (ver backend/cache.py); con varios workers, compartido
+CONTRIBUYENTES_CACHE_TTL = int(os.getenv("CONTRIBUYENTES_CACHE_TTL", "900"))
+CONTRIBUYENTES_CACHE_MAX = int(os.getenv("CONTRIBUYENTES_CACHE_MAX", "50000"))
+if SHARED_STATE:
+    contribuyentes_cache = SharedContribuyentesCache(estado_compartido, CONTRIBUYENTES_CACHE_TTL, CONTRIBUYENTES_CACHE_MAX)
+else:
+    contribuyentes_cache = ContribuyentesCache(ttl_seconds=CONTRIBUYENTES_CACHE_TTL, max_entries=CONTRIBUYENTES_CACHE_MAX)
+
+# Links de pago ya creados por (DNI, período, monto); persistidos en la tabla facturacion
+preferencias_cache = PreferenciasCache()
+
+# Índice de búsqueda por nombre, DNIs, nomenclatura, lote y manzana (ver backend/busqueda.py).
+# Se arma con la precarga del cache y se resincroniza cada BUSQUEDA_REFRESH_SECONDS (0 = nunca)
+indice_contribuyentes = ContribuyentesIndex()
+BUSQUEDA_REFRESH_SECONDS = float(os.getenv("BUSQUEDA_REFRESH_SECONDS", "300"))
+
+# Consultas servidas desde el snapshot local con Airtable caído, y las que no tenían copia
+contribuyentes_stale = {"servidos": 0, "sin_copia": 0}
+
+
+async def buscar_contribuyente(dni: str):
+    """Devuelve el registro del contribuyente (formato Airtable), primero desde el cache local.
+
+    Si Airtable no responde a tiempo (o su circuito está abierto) devuelve la última
+    copia conocida del snapshot, con "stale": True; sin copia, levanta el error.
+    """
+    # En modo multi-worker el cache es un archivo SQLite: fuera del event loop
+    record = await asyncio.to_thread(contribuyentes_cache.get, dni)
+    if record is not None:
+        return record
+    if STORAGE_BACKEND == "sql":
+        record = await asyncio.to_thread(storage.get_contribuyente_record, dni)
+    else:
+        try:
+            records = await asyncio.wait_for(
+                airtable_contribuyentes.search('ID_Contribuyente', dni), CONTRIBUYENTE_LOOKUP_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            return await contribuyente_stale(dni, e)
+        record = records[0] if records else None
+        if record is not None:
+            await asyncio.to_thread(snapshot.guardar, [record])
+    if record is None:
+        return None
+    await asyncio.to_thread(contribuyentes_cache.put, dni, record)
+    indice_contribuyentes.upsert((await para_indice([record]))[0])
+    return record
+
+
+async def contribuyente_stale(dni, error):
+    guardado = await asyncio.to_thread(snapshot.leer, dni)
+    if guardado is None:
+        contribuyentes_stale["sin_copia"] += 1
+        raise error
+    record, guardado_en = guardado
+    contribuyentes_stale["servidos"] += 1
+    # No va al cache: la próxima consulta vuelve a probar Airtable (o el circuito la corta enseguida)
+    return dict(record, stale=True, stale_since=guardado_en.isoformat())
+
 
-app = FastAPI()
+def no_disponible(error):
+    """HTTPException 503 para un upstream caído, con Retry-After si el circuito está abierto."""
+    retry_after = error.retry_after if isinstance(error, CircuitOpenError) else CIRCUIT_RESET_SECONDS
+    return HTTPException(
+        status_code=503, detail=f"Servicio externo no disponible: {error}",
+        headers={"Retry-After": str(int(retry_after) + 1)},
+    )
 
-# <<-- AÑADIR ESTE BLOQUE DE CONFIGURACIÓN CORS -->>
+
+# Record IDs de Airtable por DNI, para enlazar 'Socio' al replicar pagos en modo sql
+airtable_record_ids = {}
+
+
+async def resolver_record_id_airtable(dni: str):
+    if dni not in airtable_record_ids:
+        records = await airtable_contribuyentes.search('ID_Contribuyente', dni)
+        if not records:
+            return None
+        airtable_record_ids[dni] = records[0]['id']
+    return airtable_record_ids[dni]
+
+
+# Réplica de la base local hacia Airtable (ver backend/outbox.py)
+outbox_replicator = OutboxReplicator(
+    {
+        storage.AIRTABLE_TABLE_CONTRIBUYENTES: (airtable_contribuyentes, "ID_Contribuyente"),
+        storage.AIRTABLE_TABLE_PAGOS: (airtable_pagos, "ID_Transaccion_MP"),
+    },
+    resolver_record_id_airtable,
+    breaker=airtable_breaker,
+)
+# Con Airtable de vuelta, el outbox se vacía enseguida
+airtable_breaker.on_close(outbox_replicator.notify)
+
+# Los endpoints se registran en el router; la app la arma create_app() al final del módulo
+router = APIRouter()
+
+
+async def requiere_admin(x_admin_token: str = Header(None)):
+    """Dependencia de los endpoints que operan sobre muchos contribuyentes o cancelan planes."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="ADMIN_TOKEN no está configurado")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="X-Admin-Token inválido")
+
+# <<-- CONFIGURACIÓN CORS -->>
 origins = [
     "http://localhost:5173",  # Origen de la aplicación React
     "http://127.0.0.1:5173",  # Posiblemente también se acceda por 127.0.0.1
     "https://trafulfrontend.onrender.com", # <<-- NUEVO: Origen del frontend desplegado
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],  # Permite todos los métodos (GET, POST, etc.)
-    allow_headers=["*"],  # Permite todos los encabezados
-)
-# <<-- FIN DEL BLOQUE CORS -->>
+# Estado del arranque, para /readyz
+arranque = {"iniciado_en": None, "listo_en": None, "cache_precargado_en": None, "cache_error": None}
+
+
+def preparar_base():
+    models.Base.metadata.create_all(bind=engine)
+    database.migrate_columns(models.Base.metadata)
+    if agregados.vacio():
+        # Primer arranque con la tabla agregados: se arman desde pagos, contribuyentes y facturacion
+        agregados.recalcular()
+
+
+async def iniciar_servicios():
+    # Con varios workers arrancando a la vez, de a uno (create_all en paralelo choca en SQLite)
+    async with bloqueo_entre_workers("esquema", ttl_seconds=600):
+        await asyncio.to_thread(preparar_base)
+    contribuyentes_writer.start()
+    pagos_writer.start()
+    if lider is None:
+        await iniciar_tareas_de_fondo()
+        return
+    # Los demás workers no replican, pero siguen si quedan escrituras en el outbox (ver diferir_ahora)
+    outbox_replicator.start(drain=False)
+    await lider.elegir()
+    lider.start()
+
+
+async def iniciar_tareas_de_fondo():
+    """Cola de webhooks, conciliación y outbox: en el único worker o en el líder."""
+    requeued = await asyncio.to_thread(webhook_queue.requeue_stuck)
+    if requeued:
+        print(f"Se reencolaron {requeued} notificaciones que quedaron en proceso.")
+    webhook_workers.start()
+    conciliador.start()
+    await outbox_replicator.stop()
+    # En modo sql replica la base local; en los dos modos manda las escrituras diferidas
+    outbox_replicator.start()
+    if notificaciones_dispatcher.canales:
+        requeued = await asyncio.to_thread(notificaciones.requeue_stuck)
+        if requeued:
+            print(f"Se reencolaron {requeued} avisos de pago que quedaron en proceso.")
+        notificaciones_dispatcher.start()
+
+
+async def dejar_de_ser_lider():
+    await conciliador.stop()
+    await webhook_workers.stop()
+    await notificaciones_dispatcher.stop()
+    await outbox_replicator.stop()
+    outbox_replicator.start(drain=False)
+
+
+# Con varios workers, el que tiene el lease corre las tareas de fondo (ver backend/compartido.py)
+lider = Lider(
+    estado_compartido, iniciar_tareas_de_fondo, dejar_de_ser_lider,
+    ttl_seconds=float(os.getenv("LEADER_LEASE_SECONDS", "15")),
+) if SHARED_STATE else None
+
+
+def es_lider():
+    return lider is None or lider.es_lider
+
+
+def bloqueo_entre_workers(nombre, ttl_seconds=60.0):
+    """Lock entre procesos con estado compartido; con un solo worker no hace falta."""
+    return estado_compartido.lock(nombre, ttl_seconds) if SHARED_STATE else nullcontext()
+
 
-@app.get("/")
+async def listar_para_indice():
+    """Tabla completa para el índice de búsqueda.
+
+    Un worker que no es líder no se la pide a Airtable: la lee de la copia local
+    que guarda el líder (en modo sql la tabla ya es local).
+    """
+    if STORAGE_BACKEND == "airtable" and not es_lider():
+        return await asyncio.to_thread(snapshot.todos)
+    return await listar_contribuyentes()
+
+
+async def para_indice(records):
+    """En modo airtable suma a los registros los campos de búsqueda de la tabla local.
+
+    DNIs, Nomenclatura_Catastral, Lote y Manzana los carga el importador en la
+    tabla contribuyentes y no existen en Airtable; se combinan por ID_Contribuyente.
+    """
+    if STORAGE_BACKEND != "airtable":
+        return records
+    # Un registro suelto (consulta por DNI) lee solo su fila; la tabla completa, todo de una
+    dnis = [r['fields'].get('ID_Contribuyente') for r in records] if len(records) == 1 else None
+    locales = await asyncio.to_thread(storage.get_campos_de_busqueda, dnis)
+    combinados = []
+    for record in records:
+        campos = locales.get(record['fields'].get('ID_Contribuyente'))
+        combinados.append(dict(record, fields={**campos, **record['fields']}) if campos else record)
+    return combinados
+
+
+async def warm_contribuyentes_cache():
+    # Lectura completa de la tabla (paginada de a 100 en Airtable) para precargar el cache
+    try:
+        while not es_lider() and contribuyentes_cache.last_warm_at is None:
+            # Con varios workers precarga solo el líder: una lectura de la tabla para todos
+            await asyncio.sleep(0.5)
+        if es_lider():
+            records = await listar_contribuyentes()
+            if STORAGE_BACKEND == "airtable":
+                # Copia local para servir consultas si después Airtable no responde
+                await asyncio.to_thread(snapshot.guardar, records)
+            loaded = await asyncio.to_thread(contribuyentes_cache.warm, records)
+            print(f"Cache de contribuyentes precargado con {loaded} registros.")
+        else:
+            records = await listar_para_indice()
+        arranque["cache_precargado_en"] = time.time()
+        indexados = await asyncio.to_thread(indice_contribuyentes.sync, await para_indice(records))
+        print(f"Índice de búsqueda armado: {indexados}")
+        if es_lider():
+            # Con la tabla completa en mano, se recuentan los estados de suscripción
+            await asyncio.to_thread(agregados.recalcular_suscripciones, records)
+    except Exception as e:
+        arranque["cache_error"] = str(e)
+        print(f"ADVERTENCIA: No se pudo precargar el cache de contribuyentes: {e}")
+
+
+async def refrescar_indice_contribuyentes():
+    # Relee la tabla y reindexa solo los registros que cambiaron (altas del importador, ediciones en Airtable)
+    while True:
+        await asyncio.sleep(BUSQUEDA_REFRESH_SECONDS)
+        try:
+            records = await listar_para_indice()
+            cambios = await asyncio.to_thread(indice_contribuyentes.sync, await para_indice(records))
+            if cambios["changed"] or cambios["removed"]:
+                print(f"Índice de búsqueda actualizado: {cambios}")
+            if not es_lider():
+                continue
+            if STORAGE_BACKEND == "airtable" and lider is not None:
+                # Los demás workers reindexan desde esta copia
+                await asyncio.to_thread(snapshot.guardar, records)
+            # Corrige cualquier desvío del conteo incremental de suscripciones
+            # (dos pagos simultáneos del mismo contribuyente leen el mismo estado anterior)
+            await asyncio.to_thread(agregados.recalcular_suscripciones, records)
+        except Exception as e:
+            print(f"ADVERTENCIA: No se pudo actualizar el índice de búsqueda: {e}")
+
+
+async def detener_servicios():
+    # Una facturación cortada se retoma desde los checkpoints en la próxima corrida
+    tasks = [run.task for run in facturacion_runs.values() if run.task is not None]
+    tasks += [op.task for op in operaciones_suscripciones.values() if op.task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Los publicadores dejan el estado final de las corridas cortadas
+    corridas = list(facturacion_runs.values()) + list(operaciones_suscripciones.values())
+    await asyncio.gather(*(c.publicador for c in corridas if c.publicador is not None), return_exceptions=True)
+    if lider is not None:
+        # Libera el lease: otro worker toma las tareas de fondo sin esperar a que venza
+        await lider.stop()
+    await conciliador.stop()
+    await webhook_workers.stop()
+    await notificaciones_dispatcher.stop()
+    await outbox_replicator.stop()
+    await contribuyentes_writer.stop()
+    await pagos_writer.stop()
+    await airtable_http.aclose()
+    await mercadopago_client.http.aclose()
+    if whatsapp_client is not None:
+        await whatsapp_client.http.aclose()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    arranque["iniciado_en"] = time.time()
+    await iniciar_servicios()
+    arranque["listo_en"] = time.time()
+    # El cache se precarga en segundo plano: la API atiende mientras tanto
+    # (un DNI que todavía no está en el cache se busca en el almacenamiento)
+    background = [asyncio.create_task(warm_contribuyentes_cache())]
+    if BUSQUEDA_REFRESH_SECONDS > 0:
+        background.append(asyncio.create_task(refrescar_indice_contribuyentes()))
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        arranque["listo_en"] = None
+        await detener_servicios()
+
+
+def create_app():
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],  # Permite todos los métodos (GET, POST, etc.)
+        allow_headers=["*"],  # Permite todos los encabezados
+    )
+    # Último en agregarse = más externo: mide también CORS y los errores
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(router)
+    return app
+
+
+@router.get("/healthz")
+async def healthz():
+    # Liveness: el proceso responde, sin tocar dependencias
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz():
+    # Readiness: arranque terminado y base de datos accesible
+    checks = {"arranque": arranque["listo_en"] is not None}
+    try:
+        await asyncio.to_thread(database.ping)
+        checks["base_de_datos"] = True
+    except Exception as e:
+        print(f"ADVERTENCIA: /readyz no pudo consultar la base de datos: {e}")
+        checks["base_de_datos"] = False
+    body = {
+        "status": "ready" if all(checks.values()) else "not_ready",
+        "checks": checks,
+        "cache_contribuyentes": {
+            "precargado": arranque["cache_precargado_en"] is not None,
+            "error": arranque["cache_error"],
+            "entries": contribuyentes_cache.stats()["entries"],
+        },
+        "arranque_segundos": round(arranque["listo_en"] - arranque["iniciado_en"], 3) if checks["arranque"] else None,
+        # Informativo: con un upstream caído la API sigue lista (snapshot, outbox y cola)
+        "circuitos": {breaker.name: breaker.state for breaker in (airtable_breaker, mercadopago_breaker)},
+        "workers": await asyncio.to_thread(lider.stats) if lider is not None else None,
+    }
+    return JSONResponse(body, status_code=200 if body["status"] == "ready" else 503)
+
+
+@router.get("/")
 async def read_root():
-    return {"message": "Welcome to the Contribuyentes API (Airtable Version)"}
+    return {"message": f"Welcome to the Contribuyentes API ({STORAGE_BACKEND.capitalize()} Version)"}
+
+# Búsqueda por nombre, cualquier DNI de los titulares, nomenclatura, lote o manzana.
+# Tiene que registrarse antes de /contribuyentes/{dni}
+@router.get("/contribuyentes/search")
+async def search_contribuyentes(q: str = "", lote: str = None, manzana: str = None, limit: int = 20, offset: int = 0):
+    if not q.strip() and not lote and not manzana:
+        raise HTTPException(status_code=400, detail="Indicar q, lote o manzana")
+    if limit < 1 or limit > 100 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit debe estar entre 1 y 100 y offset no puede ser negativo")
+    return indice_contribuyentes.search(q, lote, manzana, limit, offset)
+
 
 # Endpoint para obtener información del contribuyente por DNI desde Airtable
-@app.get("/contribuyentes/{dni}")
+@router.get("/contribuyentes/{dni}")
 async def get_contribuyente(dni: str):
-    # Buscar el contribuyente por DNI en Airtable
-    # Airtable search devuelve una lista de registros que coinciden
+    # Buscar el contribuyente por DNI (cache local y, si no está, Airtable)
     # Asumimos que DNI es un campo único en Airtable
-    records = airtable_contribuyentes.search('ID_Contribuyente', dni) # Buscar en el campo 'ID_Contribuyente'
+    try:
+        contribuyente_record = await buscar_contribuyente(dni)
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo consultar el contribuyente {dni}: {e}")
+        raise no_disponible(e)
 
-    if records:
-        contribuyente_record = records[0] # Tomar el primer registro encontrado
+    if contribuyente_record:
         fields = contribuyente_record['fields']
+        deuda = fields.get("Deuda")
+        if deuda is None and STORAGE_BACKEND == "airtable":
+            # Airtable no tiene la deuda: se toma de la base local (padrón menos pagos aprobados)
+            deuda = await asyncio.to_thread(agregados.deuda_de, dni)
         # Devolver un diccionario con los campos del contribuyente
         return {
             "id": contribuyente_record['id'], # El ID del registro de Airtable
@@ -86,63 +537,51 @@ async def get_contribuyente(dni: str):
             "nombre": fields.get("Nombre_Contribuyente"), # Usar Nombre_Contribuyente
             "monto_mensual_impuesto": fields.get("Monto_Mensual_Impuesto"),
             "tipo_impuesto": fields.get("Tipo_Impuesto"),
-            "deuda": None, # Este campo no existe en la tabla Contribuyentes
+            "deuda": deuda,
             "estado_suscripcion": fields.get("Estado_Suscripcion"),
             "id_suscripcion_mp": fields.get("ID_Suscripcion_MP"),
             "enlace_suscripcion_mp": fields.get("Enlace_Suscripcion_MP"),
             "fecha_creacion": contribuyente_record.get('createdTime'), # Airtable tiene 'createdTime'
-            "ultima_actualizacion": None # Este campo no existe en la tabla Contribuyentes
-
+            "ultima_actualizacion": None, # Este campo no existe en la tabla Contribuyentes
+            # Copia local servida con Airtable caído
+            "stale": contribuyente_record.get("stale", False),
+            "stale_since": contribuyente_record.get("stale_since"),
         }
     raise HTTPException(status_code=404, detail="Contribuyente no encontrado")
 
 
 # Endpoint para iniciar el pago con MercadoPago usando Airtable
-@app.post("/pagar")
+@router.post("/pagar")
 async def initiate_payment(dni: str, monto: float):
-    # Buscar el contribuyente por DNI en Airtable
-    records = airtable_contribuyentes.search('ID_Contribuyente', dni)
-    if not records:
+    # Buscar el contribuyente por DNI (cache local y, si no está, Airtable)
+    try:
+        contribuyente_record = await buscar_contribuyente(dni)
+    except Exception as e:
+        raise no_disponible(e)
+    if not contribuyente_record:
         raise HTTPException(status_code=404, detail="Contribuyente no encontrado")
 
-    contribuyente_record = records[0]
     fields = contribuyente_record['fields']
 
-    # Crear una preferencia de pago en MercadoPago
-    preference_data = {
-        "items": [
-            {
-                "title": f"Impuesto {fields.get('Tipo_Impuesto')} - DNI: {dni}", # Usar Tipo_Impuesto
-                "quantity": 1,
-                "unit_price": monto,
-                "currency_id": "ARS" # Asumimos ARS (Pesos Argentinos)
-            }
-        ],
-        "payer": {
-            "name": fields.get('Nombre_Contribuyente'), # Usar Nombre_Contribuyente
-            "surname": fields.get('Nombre_Contribuyente'), # Asumir el mismo nombre si no hay apellido separado
-            "email": MERCADOPAGO_PAYER_EMAIL, # Email de prueba configurado por variable de entorno
-            "identification": { # Añadir identificación del pagador
-                "type": "DNI", # O "CUIT", "CUIL", dependiendo de tu necesidad
-                "number": dni # Usamos el DNI del contribuyente como identificación del pagador
-            }
-        },
-        "back_urls": {
-            "success": f"{BACKEND_PUBLIC_URL}/success", # <<-- USAR BACKEND_PUBLIC_URL
-            "pending": f"{BACKEND_PUBLIC_URL}/pending",
-            "failure": f"{BACKEND_PUBLIC_URL}/failure",
-        },
-        "notification_url": f"{BACKEND_PUBLIC_URL}/webhook/mercadopago", # <<-- USAR BACKEND_PUBLIC_URL
-        "external_reference": dni # Usamos el DNI como referencia externa
-        }
-    print(f"DEBUG: preference_data FINAL enviada a MercadoPago: {preference_data}") # <<-- NUEVO PRINT
-    try:
-        preference_response = sdk.preference().create(preference_data)
-        print("MercadoPago API Full Response:", preference_response)
+    periodo = facturacion.periodo_actual()
+
+    async def crear_preferencia():
+        # Link ya generado este mes con el mismo monto (por /pagar o por la facturación masiva)
+        guardada = await asyncio.to_thread(facturacion.find_link, periodo, dni, monto)
+        if guardada:
+            return dict(guardada, expires_at=facturacion.fin_de_periodo(periodo), reused=True)
+
+        # Crear una preferencia de pago en MercadoPago (vence a fin de mes)
+        preference_data = facturacion.build_preference_data(
+            dni, fields, monto, MERCADOPAGO_PAYER_EMAIL, BACKEND_PUBLIC_URL, periodo,
+        )
+        preference_response = await mercadopago_client.create_preference(
+            preference_data, idempotency_key=facturacion.idempotency_key(dni, periodo, monto),
+        )
 
-        if "status_code" in preference_response and preference_response["status_code"] >= 400:
+        if preference_response.get("status", 200) >= 400:
             error_detail = preference_response.get("response", {}).get("message", "Error desconocido de MercadoPago")
-            raise HTTPException(status_code=preference_response["status_code"], detail=f"Error de MercadoPago: {error_detail}")
+            raise HTTPException(status_code=preference_response["status"], detail=f"Error de MercadoPago: {error_detail}")
 
         if "response" not in preference_response:
              raise HTTPException(status_code=500, detail=f"Respuesta inesperada de MercadoPago: {preference_response}")
@@ -150,107 +589,712 @@ async def initiate_payment(dni: str, monto: float):
         preference = preference_response["response"]
         payment_link = preference["init_point"]
 
-        # Opcional: Actualizar el contribuyente con el enlace de pago temporal en Airtable
-        # if payment_link:
-        #     airtable_contribuyentes.update(contribuyente_record['id'], {'enlace_suscripcion_mp': payment_link})
+        # El link queda guardado para el período (tabla facturacion). Enlace_Suscripcion_MP es
+        # solo del plan de suscripción (ver backend/suscripciones.py): no se pisa con links de un pago
+        await asyncio.to_thread(
+            facturacion.save_link, periodo, dni, contribuyente_record['id'], monto, preference.get("id"), payment_link,
+        )
+        return {"preference_id": preference.get("id"), "init_point": payment_link,
+                "expires_at": facturacion.fin_de_periodo(periodo)}
 
-        return {"message": f"Payment initiated for DNI: {dni}", "payment_link": payment_link}
+    try:
+        preference = await preferencias_cache.get_or_create(dni, periodo, monto, crear_preferencia)
+        return {"message": f"Payment initiated for DNI: {dni}", "payment_link": preference["init_point"]}
 
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise no_disponible(e)
     except Exception as e:
         print(f"Error detallado en initiate_payment: {e}")
         raise HTTPException(status_code=500, detail=f"Error al crear preferencia de pago: {e}")
 
 
-# Endpoint para el webhook de MercadoPago usando Airtable
-@app.post("/webhook/mercadopago")
+# Procesamiento de una notificación de MercadoPago (lo ejecutan los workers de la cola)
+async def procesar_notificacion_mp(payload: dict):
+    payment_id = str(payload["data"]["id"])
+    topic = payload.get("topic") or payload.get("type")
+
+    # Si es un ID de simulación, forzar los datos para probar la lógica de Airtable
+    if payment_id == "123456":
+        print("DEBUG: Webhook de simulación (ID 123456) recibido. Forzando datos para prueba de Airtable.")
+        payment_status = "approved"
+        # Si el payload de simulación no trae 'external_reference' usamos un DNI de ejemplo
+        external_reference = payload.get("external_reference", "16300465650")
+        transaction_amount = 111843.0 # Monto de prueba
+        date_approved = datetime.now()
+
+    # Si no es un ID de simulación, obtener los datos del pago real de MercadoPago
+    elif topic == "payment":
+        payment_info = await mercadopago_client.get_payment(payment_id)
+        if not (payment_info and payment_info["status"] < 400 and payment_info["response"]):
+            # Puede ser un pago recién creado que todavía no es visible: se reintenta
+            raise Exception(f"Detalles de pago para ID {payment_id} no encontrados.")
+        payment_status, external_reference, transaction_amount, date_approved = datos_del_pago(payment_info["response"])
+
+    else:
+        print(f"Notificación de MercadoPago con topic '{topic}' ignorada (ID {payment_id}).")
+        return
+
+    await registrar_pago(payment_id, payment_status, external_reference, transaction_amount, date_approved)
+
+
+def datos_del_pago(payment):
+    """(estado, external_reference, monto, fecha de aprobación) del JSON de un pago de MercadoPago."""
+    date_approved_str = payment.get("date_approved")
+    date_approved = datetime.fromisoformat(date_approved_str.replace("Z", "+00:00")) if date_approved_str else datetime.now()
+    return payment["status"], payment.get("external_reference"), payment.get("transaction_amount"), date_approved
+
+
+async def aplicar_pago_conciliado(payment: dict):
+    # Pago encontrado por la conciliación (ver backend/conciliacion.py)
+    await registrar_pago(str(payment["id"]), *datos_del_pago(payment), metodo="Conciliacion_MP")
+
+
+async def registrar_pago(payment_id, payment_status, external_reference, transaction_amount, date_approved,
+                         metodo="Webhook_MP"):
+    """Actualiza Estado_Suscripcion del contribuyente y registra el pago en Airtable."""
+    if not external_reference:
+        raise NonRetryableError(f"External reference no encontrada en pago {payment_id}.")
+
+    # MercadoPago manda varias notificaciones por pago: si el (pago, estado) ya se
+    # registró, o es un estado anterior que llegó tarde, no hay nada que escribir.
+    decision = await asyncio.to_thread(pagos_dedup.check, payment_id, payment_status)
+    if decision == DUPLICATE:
+        print(f"Pago {payment_id} ya registrado con estado {payment_status}. Notificación repetida ignorada.")
+        return
+    if decision == STALE:
+        print(f"Pago {payment_id}: estado {payment_status} es anterior al registrado. Notificación ignorada.")
+        return
+
+    contribuyente_record = await buscar_contribuyente(external_reference)
+    if not contribuyente_record:
+        raise NonRetryableError(f"Contribuyente con DNI {external_reference} no encontrado en Airtable.")
+    contribuyente_id = contribuyente_record['id']
+    fields = contribuyente_record['fields']
+
+    # Actualizar estado de suscripción del contribuyente en Airtable
+    updates = {}
+    if payment_status == "approved":
+        updates['Estado_Suscripcion'] = "Activa" # Usar el nombre de campo correcto
+        # La deuda se descuenta en la base local al registrar el pago (ver backend/agregados.py)
+    elif payment_status in ["rejected", "cancelled"]:
+        updates['Estado_Suscripcion'] = "Problema_Pago" # Usar el nombre de campo correcto
+
+    if updates:
+        if STORAGE_BACKEND == "sql":
+            await asyncio.to_thread(storage.update_contribuyente, external_reference, updates)
+        else:
+            await contribuyentes_writer.update(contribuyente_id, updates)
+        # El registro cacheado ya no refleja Estado_Suscripcion
+        await asyncio.to_thread(contribuyentes_cache.invalidate, external_reference)
+        await asyncio.to_thread(
+            agregados.cambiar_suscripcion, fields.get("Estado_Suscripcion"), updates['Estado_Suscripcion'],
+        )
+
+    # Registrar el pago en la tabla de pagos de Airtable
+    # Nota: El campo 'Socio' en Pagos_Mensuales es un linked record y espera un array de Record IDs.
+    # Para asociar un pago a un contribuyente, necesitamos el Record ID del contribuyente.
+    new_pago_fields = {
+        "ID_Pago": f"{external_reference}-{payment_id}", # ID estable: un pago es una sola fila
+        "Socio": [contribuyente_id], # Enlazar al contribuyente usando su Record ID de Airtable
+        "Año_Mes": date_approved.strftime('%Y-%m'),
+        "Fecha_Pago_Real": date_approved.isoformat(),
+        "Monto_Pagado": transaction_amount,
+        "ID_Transaccion_MP": payment_id,
+        "Estado_Pago": payment_status,
+        "Metodo_Registro": metodo,
+        "Fecha_Registro": datetime.now().isoformat()
+    }
+    aviso = aviso_de_pago(payment_id, payment_status, external_reference, fields, transaction_amount, date_approved, metodo)
+    if STORAGE_BACKEND == "sql":
+        # Pago + réplica + aviso en una sola transacción; 'Socio' se resuelve al replicar
+        new_pago_fields.pop("Socio")
+        new_pago_fields[SOCIO_DNI_KEY] = external_reference
+        avisos = await asyncio.to_thread(
+            storage.record_pago, payment_id, payment_status, external_reference,
+            transaction_amount, date_approved, metodo, new_pago_fields, aviso,
+        )
+        pagos_dedup.remember(payment_id, payment_status)
+        outbox_replicator.notify()
+        if avisos:
+            notificaciones_dispatcher.notify()
+        print(f"Pago {payment_id} procesado para DNI {external_reference}. Estado: {payment_status}")
+        return
+
+    # Upsert por ID_Transaccion_MP (igual que el outbox con Airtable caído): una notificación
+    # repetida, dos workers con el mismo pago o un pago registrado antes de la tabla pagos
+    # local actualizan la fila que ya está en Airtable en lugar de agregar otra
+    if decision == CHANGED:
+        # El alta original conserva cómo y cuándo se registró
+        new_pago_fields.pop("Metodo_Registro")
+        new_pago_fields.pop("Fecha_Registro")
+    await pagos_writer.upsert(new_pago_fields)
+
+    # El aviso se encola antes de marcar el pago como visto: si algo falla en el medio, el
+    # reintento de la notificación no lo da por registrado (y encolar dos veces no duplica)
+    await avisar_pago(aviso)
+    await asyncio.to_thread(
+        pagos_dedup.record, payment_id, payment_status, external_reference,
+        transaction_amount, date_approved, metodo,
+    )
+    print(f"Pago {payment_id} procesado para DNI {external_reference}. Estado: {payment_status}")
+
+
+def aviso_de_pago(payment_id, payment_status, dni, fields, transaction_amount, date_approved, metodo):
+    """Argumentos de notificaciones.encolar para avisar el pago, o None si no se avisa."""
+    evento = notificaciones.evento_de_pago(payment_status)
+    # La conciliación recupera pagos viejos: avisarlos ahora sería spam
+    if evento is None or metodo != "Webhook_MP" or not notificaciones_dispatcher.canales:
+        return None
+    texto = notificaciones.mensaje(
+        evento, fields.get("Nombre_Contribuyente"), transaction_amount, date_approved.strftime('%Y-%m'), payment_id,
+    )
+    return {
+        "canales": list(notificaciones_dispatcher.canales), "evento": evento, "payment_id": payment_id,
+        "dni": dni, "destino": fields.get(TELEFONO_FIELD), "texto": texto,
+    }
+
+
+async def avisar_pago(aviso):
+    """Deja el aviso del pago en la cola de notificaciones; lo manda el dispatcher, no este worker."""
+    if not aviso:
+        return
+    creados = await asyncio.to_thread(notificaciones.encolar, **aviso)
+    if creados:
+        notificaciones_dispatcher.notify()
+
+
+# De-duplicación por ID_Transaccion_MP + estado (ver backend/dedup.py)
+pagos_dedup = PaymentDedup()
+
+# Cola durable + workers para las notificaciones (ver backend/webhook_queue.py)
+webhook_workers = WebhookWorkerPool(
+    procesar_notificacion_mp,
+    workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+    max_attempts=int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8")),
+    backoff_base_seconds=float(os.getenv("WEBHOOK_BACKOFF_BASE_SECONDS", "2")),
+    backoff_max_seconds=float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "600")),
+)
+# Las notificaciones pospuestas por un circuito abierto se retoman apenas se cierra
+airtable_breaker.on_close(webhook_workers.notify)
+mercadopago_breaker.on_close(webhook_workers.notify)
+
+# Avisos de pago por WhatsApp (Evolution API, como el nodo "📱 API WhatsApp" de n8n).
+# Sin WHATSAPP_API_URL y WHATSAPP_API_KEY no se encola ni se manda nada.
+TELEFONO_FIELD = "Telefono"
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL")
+WHATSAPP_API_KEY = os.getenv("WHATSAPP_API_KEY")
+whatsapp_client = build_whatsapp_client(
+    WHATSAPP_API_URL,
+    WHATSAPP_API_KEY,
+    os.getenv("WHATSAPP_INSTANCE", "club-futbol"),
+    timeout_seconds=UPSTREAM_TIMEOUT_SECONDS,
+) if WHATSAPP_API_URL and WHATSAPP_API_KEY else None
+canales_de_notificacion = {}
+if whatsapp_client is not None:
+    canales_de_notificacion["whatsapp"] = (
+        whatsapp_client.send_text, TokenBucket(float(os.getenv("WHATSAPP_RATE_LIMIT", "5"))),
+    )
+notificaciones_dispatcher = NotificacionesDispatcher(
+    canales_de_notificacion,
+    batch_size=int(os.getenv("NOTIFICACIONES_BATCH_SIZE", "20")),
+    concurrency=int(os.getenv("NOTIFICACIONES_CONCURRENCY", "5")),
+    max_attempts=int(os.getenv("NOTIFICACIONES_MAX_ATTEMPTS", "8")),
+    backoff_base_seconds=float(os.getenv("NOTIFICACIONES_BACKOFF_BASE_SECONDS", "5")),
+    backoff_max_seconds=float(os.getenv("NOTIFICACIONES_BACKOFF_MAX_SECONDS", "1800")),
+)
+
+# Conciliación periódica contra /v1/payments/search (ver backend/conciliacion.py)
+async def pagos_en_airtable(payment_ids):
+    """{ID_Transaccion_MP: Estado_Pago} de los pagos que ya están en la tabla de pagos de Airtable."""
+    known = {}
+    # De a 50 por consulta: la fórmula va en la URL
+    for i in range(0, len(payment_ids), 50):
+        formula = "OR({})".format(",".join(
+            airtable_formula("ID_Transaccion_MP", str(payment_id)) for payment_id in payment_ids[i:i + 50]
+        ))
+        for record in await airtable_pagos.get_all(formula=formula, operation="search"):
+            fields = record.get("fields", {})
+            if fields.get("ID_Transaccion_MP") is not None:
+                known[str(fields["ID_Transaccion_MP"])] = fields.get("Estado_Pago")
+    return known
+
+
+conciliador = conciliacion.Conciliador(
+    mercadopago_client,
+    aplicar_pago_conciliado,
+    page_size=int(os.getenv("CONCILIACION_PAGE_SIZE", "100")),
+    concurrency=int(os.getenv("CONCILIACION_CONCURRENCY", "10")),
+    interval_seconds=float(os.getenv("CONCILIACION_INTERVAL_SECONDS", "3600")),  # 0 la desactiva
+    default_begin=os.getenv("CONCILIACION_DESDE", conciliacion.DEFAULT_BEGIN_DATE),
+    known_upstream=pagos_en_airtable if STORAGE_BACKEND == "airtable" else None,
+    max_attempts=int(os.getenv("CONCILIACION_MAX_ATTEMPTS", "5")),
+)
+
+
+# Endpoint para el webhook de MercadoPago: persiste la notificación y responde enseguida
+@router.post("/webhook/mercadopago")
 async def mercadopago_webhook(payload: dict):
-    print(f"DEBUG: Webhook Payload recibido: {payload}")
-
-    if "data" in payload and "id" in payload["data"]:
-        payment_id = payload["data"]["id"]
-        topic = payload.get("topic") or payload.get("type")
-
-        # Si es un ID de simulación, forzar los datos para probar la lógica de Airtable
-        if payment_id == "123456":
-            print("DEBUG: Webhook de simulación (ID 123456) recibido. Forzando datos para prueba de Airtable.")
-            payment_status = "approved"
-            # Asumiendo que el external_reference viene en el payload de simulación si se envían payloads de prueba más completos
-            # o podemos usar un DNI de prueba predefinido. Para esta simulación, asumiré que el payload puede tener 'external_reference'
-            # Si no viene, tendríamos que hardcodear uno aquí para la prueba.
-            external_reference = payload.get("external_reference", "16300465650") # Usar un DNI de ejemplo si no viene en el payload
-            transaction_amount = 111843.0 # Monto de prueba
-            date_approved = datetime.now()
-            # Continuar con el procesamiento como si fuera un pago real
-            # El resto del código del webhook ya procesa esto.
-
-        # Si no es un ID de simulación, obtener los datos del pago real de MercadoPago
-        elif topic == "payment": # Esto era un 'if' antes, ahora es 'elif' para no entrar si ya procesamos el '123456'
-            payment_info = sdk.payment().get(payment_id)
-            if payment_info and payment_info["response"]:
-                payment_status = payment_info["response"]["status"]
-                external_reference = payment_info["response"].get("external_reference")
-                transaction_amount = payment_info["response"].get("transaction_amount")
-                date_approved_str = payment_info["response"].get("date_approved")
-                date_approved = datetime.fromisoformat(date_approved_str.replace("Z", "+00:00")) if date_approved_str else datetime.now()
-
-                if external_reference:
-                    records = airtable_contribuyentes.search('ID_Contribuyente', external_reference)
-                    if records:
-                        contribuyente_record = records[0]
-                        contribuyente_id = contribuyente_record['id']
-                        fields = contribuyente_record['fields']
-
-                        # Actualizar estado de suscripción del contribuyente en Airtable
-                        updates = {}
-                        if payment_status == "approved":
-                            updates['Estado_Suscripcion'] = "Activa" # Usar el nombre de campo correcto
-                            # La deuda no está en la tabla Contribuyentes, por lo que no se actualiza aquí.
-                        elif payment_status in ["rejected", "cancelled"]:
-                            updates['Estado_Suscripcion'] = "Problema_Pago" # Usar el nombre de campo correcto
-                        
-                        if updates:
-                            airtable_contribuyentes.update(contribuyente_id, updates)
-
-                        # Registrar el pago en la tabla de pagos de Airtable
-                        # Nota: El campo 'Socio' en Pagos_Mensuales es un linked record y espera un array de Record IDs.
-                        # Para asociar un pago a un contribuyente, necesitamos el Record ID del contribuyente.
-                        new_pago_fields = {
-                            "ID_Pago": f"{external_reference}-{date_approved.strftime('%Y%m%d%H%M%S')}", # Generar un ID único para el pago
-                            "Socio": [contribuyente_id], # Enlazar al contribuyente usando su Record ID de Airtable
-                            "Año_Mes": date_approved.strftime('%Y-%m'),
-                            "Fecha_Pago_Real": date_approved.isoformat(),
-                            "Monto_Pagado": transaction_amount,
-                            "ID_Transaccion_MP": payment_id,
-                            "Estado_Pago": payment_status,
-                            "Metodo_Registro": "Webhook_MP",
-                            "Fecha_Registro": datetime.now().isoformat()
-                        }
-                        airtable_pagos.insert(new_pago_fields)
-
-                        print(f"Pago {payment_id} procesado para DNI {external_reference}. Estado: {payment_status}")
-                        return {"message": "Webhook processed successfully"}
-                    else:
-                        print(f"Contribuyente con DNI {external_reference} no encontrado en Airtable.")
-                        raise HTTPException(status_code=404, detail=f"Contribuyente con DNI {external_reference} no encontrado.")
-                else:
-                    print(f"External reference no encontrada en pago {payment_id}.")
-                    raise HTTPException(status_code=400, detail="External reference no encontrada en la notificación de pago.")
-            else:
-                print(f"Detalles de pago para ID {payment_id} no encontrados.")
-                raise HTTPException(status_code=400, detail="Detalles de pago no encontrados.")
+    if isinstance(payload.get("data"), dict) and "id" in payload["data"]:
+        queue_id, created = await asyncio.to_thread(webhook_queue.enqueue, payload)
+        if created:
+            # En un worker que no es líder no hay a quién despertar: el líder la toma en su próximo sondeo
+            webhook_workers.notify()
+        return {"message": "Webhook received", "queue_id": queue_id, "duplicate": not created}
 
-    print("MercadoPago Webhook recibido (sin data.id o topic conocido):", payload)
+    # Sin el payload: puede traer datos del pagador
+    print(f"MercadoPago Webhook recibido sin data.id (campos: {sorted(payload)}).")
     return {"message": "Webhook received successfully (no action taken)"}
 
 
-@app.get("/success")
+@router.get("/webhook/queue/metrics")
+async def webhook_queue_metrics():
+    metrics = await asyncio.to_thread(webhook_workers.metrics)
+    metrics["dedup"] = pagos_dedup.stats()
+    metrics["airtable_writers"] = {
+        "contribuyentes": contribuyentes_writer.stats(),
+        "pagos": pagos_writer.stats(),
+        "throttled_429": airtable_contribuyentes.throttled + airtable_pagos.throttled,
+    }
+    metrics["airtable_outbox"] = await asyncio.to_thread(outbox_replicator.metrics)
+    return metrics
+
+
+@router.get("/notificaciones/metrics")
+async def notificaciones_metrics():
+    return await asyncio.to_thread(notificaciones_dispatcher.metrics)
+
+
+# Facturación masiva del padrón (ver backend/facturacion.py)
+facturacion_runs = {}
+
+# Con varios workers, el estado de las corridas largas se publica en el estado compartido:
+# GET responde desde cualquier worker, y un lease evita dos facturaciones del mismo período
+CORRIDAS_TTL_SECONDS = 24 * 3600
+CORRIDA_LEASE_SECONDS = 10.0
+
+
+async def publicar_corrida(espacio, clave, stats, task):
+    """Publica stats() cada segundo mientras corre `task`, y al terminar libera su lease."""
+    if estado_compartido is None:
+        return
+    try:
+        while not task.done():
+            await asyncio.to_thread(estado_compartido.put, espacio, clave, stats(), CORRIDAS_TTL_SECONDS)
+            await asyncio.to_thread(estado_compartido.acquire_lease, f"{espacio}:{clave}", lider.id, CORRIDA_LEASE_SECONDS)
+            await asyncio.wait({task}, timeout=1.0)
+    finally:
+        await asyncio.to_thread(estado_compartido.put, espacio, clave, stats(), CORRIDAS_TTL_SECONDS)
+        await asyncio.to_thread(estado_compartido.release_lease, f"{espacio}:{clave}", lider.id)
+
+
+async def corrida_publicada(espacio, clave):
+    """Estado de una corrida de otro worker (None sin estado compartido o si no existe)."""
+    if estado_compartido is None:
+        return None
+    return await asyncio.to_thread(estado_compartido.get, espacio, clave)
+
+
+async def listar_contribuyentes():
+    if STORAGE_BACKEND == "sql":
+        return await asyncio.to_thread(storage.get_all_contribuyente_records)
+    return await airtable_contribuyentes.get_all()
+
+
+def nueva_facturacion(periodo, concurrency=None):
+    async def escribir_links(results):
+        # Los links ya quedaron en la tabla facturacion (checkpoint); acá solo se ofrecen a /pagar.
+        # No van a Enlace_Suscripcion_MP: ese campo es del plan de suscripción
+        for r in results:
+            preferencias_cache.put(r["dni"], periodo, r["monto"], {
+                "preference_id": r["preference_id"], "init_point": r["payment_link"],
+                "expires_at": facturacion.fin_de_periodo(periodo),
+            })
+
+    return facturacion.FacturacionRun(
+        periodo,
+        mercadopago_client,
+        lambda dni, fields, monto, periodo: facturacion.build_preference_data(
+            dni, fields, monto, MERCADOPAGO_PAYER_EMAIL, BACKEND_PUBLIC_URL, periodo,
+        ),
+        escribir_links,
+        concurrency=concurrency or FACTURACION_CONCURRENCY,
+        rate=FACTURACION_RATE_LIMIT,
+    )
+
+
+async def ejecutar_facturacion(periodo, concurrency=None, retry_failed=False):
+    """Corrida completa fuera de la API (la usa `python -m backend.facturacion`)."""
+    await asyncio.to_thread(models.Base.metadata.create_all, bind=engine)
+    contribuyentes_writer.start()
+    try:
+        run = nueva_facturacion(periodo, concurrency)
+        return await run.run(await listar_contribuyentes(), retry_failed)
+    finally:
+        await contribuyentes_writer.stop()
+        await airtable_http.aclose()
+        await mercadopago_client.http.aclose()
+
+
+@router.post("/facturacion/{periodo}", status_code=202, dependencies=[Depends(requiere_admin)])
+async def iniciar_facturacion(periodo: str, reintentar_fallidos: bool = False):
+    try:
+        facturacion.validar_periodo(periodo)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    current = facturacion_runs.get(periodo)
+    if current and current.task is not None and not current.task.done():
+        raise HTTPException(status_code=409, detail=f"La facturación {periodo} ya está en curso")
+    if estado_compartido is not None and not await asyncio.to_thread(
+        estado_compartido.acquire_lease, f"facturacion:{periodo}", lider.id, CORRIDA_LEASE_SECONDS,
+    ):
+        raise HTTPException(status_code=409, detail=f"La facturación {periodo} ya está en curso en otro worker")
+
+    run = nueva_facturacion(periodo)
+    facturacion_runs[periodo] = run
+
+    async def correr():
+        try:
+            await run.run(await listar_contribuyentes(), reintentar_fallidos)
+        except Exception as e:
+            print(f"ERROR: Falló la facturación {periodo}: {e}")
+
+    run.task = asyncio.create_task(correr())
+    run.publicador = asyncio.create_task(publicar_corrida("facturacion", periodo, run.stats, run.task))
+    return {"message": f"Facturación {periodo} iniciada", "estado": f"/facturacion/{periodo}"}
+
+
+@router.get("/facturacion/{periodo}")
+async def estado_facturacion(periodo: str):
+    try:
+        facturacion.validar_periodo(periodo)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    checkpoints = await asyncio.to_thread(facturacion.progress, periodo)
+    run = facturacion_runs.get(periodo)
+    corrida = run.stats() if run else await corrida_publicada("facturacion", periodo)
+    if not checkpoints["total"] and corrida is None:
+        raise HTTPException(status_code=404, detail=f"No hay facturación para {periodo}")
+    return {"checkpoints": checkpoints, "corrida": corrida}
+
+
+async def ejecutar_conciliacion(desde=None, max_pages=None):
+    """Una corrida de conciliación fuera de la API (la usa `python -m backend.conciliacion`)."""
+    await asyncio.to_thread(models.Base.metadata.create_all, bind=engine)
+    contribuyentes_writer.start()
+    pagos_writer.start()
+    if desde:
+        conciliador.default_begin = desde
+    try:
+        return await conciliador.run_once(max_pages)
+    finally:
+        await contribuyentes_writer.stop()
+        await pagos_writer.stop()
+        await airtable_http.aclose()
+        await mercadopago_client.http.aclose()
+
+
+@router.post("/conciliacion", status_code=202)
+async def iniciar_conciliacion():
+    if not es_lider():
+        # El conciliador corre solo en el líder: acá trigger() no lo despertaría nunca
+        lider_actual = await asyncio.to_thread(estado_compartido.lease_owner, Lider.NOMBRE)
+        raise HTTPException(
+            status_code=409,
+            detail=f"La conciliación corre en el worker líder ({lider_actual or 'sin líder'}); reintentá en unos segundos",
+        )
+    if conciliador.running:
+        raise HTTPException(status_code=409, detail="La conciliación ya está en curso")
+    conciliador.trigger()
+    return {"message": "Conciliación iniciada", "estado": "/conciliacion"}
+
+
+@router.get("/conciliacion")
+async def estado_conciliacion():
+    begin_date, skip = await asyncio.to_thread(conciliacion.load_cursor, conciliador.default_begin)
+    dead = await asyncio.to_thread(conciliacion.dead_payments)
+    return dict(conciliador.stats(), cursor={"begin_date": begin_date, "skip": skip}, dead_letter=dead)
+
+
+# Suscripciones con débito automático (ver backend/suscripciones.py)
+suscripciones_en_curso = suscripciones.PorContribuyente()
+operaciones_suscripciones = {}
+
+
+async def operar_suscripcion(accion, dni, monto=None, rate_limiter=None):
+    """Crea, actualiza o cancela el plan de un DNI. No escribe: devuelve los campos (ver guardar_suscripciones)."""
+    async with suscripciones_en_curso.lock(dni), bloqueo_entre_workers(f"suscripcion:{dni}"):
+        # Dentro del lock: un segundo click (en este u otro worker) ve el plan que dejó el primero
+        record = await buscar_contribuyente(dni)
+        if record is None:
+            result = {"dni": dni, "accion": accion, "resultado": suscripciones.NO_ENCONTRADO}
+        else:
+            result = await suscripciones.ejecutar(
+                mercadopago_client, accion, dni, record['fields'], f"{BACKEND_PUBLIC_URL}/success",
+                monto=monto, rate_limiter=rate_limiter,
+            )
+        if result["resultado"] == suscripciones.HECHO:
+            result["record_id"] = record['id']
+            result["estado_anterior"] = record['fields'].get("Estado_Suscripcion")
+            if record.get("stale"):
+                # Copia del snapshot (Airtable caído): el resto de los campos puede estar viejo,
+                # no se cachea como fresca; la próxima consulta la vuelve a leer
+                await asyncio.to_thread(contribuyentes_cache.invalidate, dni)
+            else:
+                # El cache queda con el estado nuevo ya, aunque la escritura vaya en un lote después
+                await asyncio.to_thread(
+                    contribuyentes_cache.put, dni, dict(record, fields=dict(record['fields'], **result["campos"])),
+                )
+    suscripciones.contadores[(accion, result["resultado"])] += 1
+    return result
+
+
+async def guardar_suscripciones(results):
+    """Escribe en lote los campos de suscripción (outbox o writer en lotes de 10) y ajusta los agregados."""
+    if STORAGE_BACKEND == "sql":
+        await asyncio.to_thread(storage.update_contribuyentes, {r["dni"]: r["campos"] for r in results})
+        outbox_replicator.notify()
+    else:
+        await asyncio.gather(*(contribuyentes_writer.update(r["record_id"], r["campos"]) for r in results))
+    await asyncio.to_thread(agregados.cambiar_suscripciones, [
+        (r["estado_anterior"], r["campos"]["Estado_Suscripcion"])
+        for r in results if "Estado_Suscripcion" in r["campos"]
+    ])
+
+
+async def suscripcion_de_un_contribuyente(accion, dni, monto=None):
+    result = await operar_suscripcion(accion, dni, monto)
+    if result["resultado"] == suscripciones.NO_ENCONTRADO:
+        raise HTTPException(status_code=404, detail="Contribuyente no encontrado")
+    if result["resultado"] == suscripciones.FALLIDO:
+        status = result.get("status") or 502
+        raise HTTPException(status_code=status if status < 500 else 502,
+                            detail=f"Error de MercadoPago: {result.get('detalle')}")
+    if result["resultado"] == suscripciones.HECHO:
+        await guardar_suscripciones([result])
+    elif accion != suscripciones.CREAR or not result.get("plan_id"):
+        # Cancelar o actualizar sin plan vigente, o crear sin monto
+        raise HTTPException(status_code=409, detail=result.get("detalle"))
+    return result
+
+
+# Operaciones masivas; se registran antes de /suscripciones/{dni}
+@router.post("/suscripciones/masivas", status_code=202, dependencies=[Depends(requiere_admin)])
+async def iniciar_suscripciones_masivas(payload: dict):
+    """{"accion": "crear" | "cancelar", "dnis": [...]}; para todo el padrón, {"todos": true} sin dnis."""
+    accion = payload.get("accion")
+    if accion not in suscripciones.ACCIONES_MASIVAS:
+        raise HTTPException(status_code=400, detail="accion debe ser 'crear' o 'cancelar'")
+    dnis = payload.get("dnis")
+    if dnis is not None and (not isinstance(dnis, list) or not dnis):
+        raise HTTPException(status_code=400, detail="dnis debe ser una lista no vacía")
+    if dnis is None and payload.get("todos") is not True:
+        # Que un body sin dnis no cancele todos los planes por error
+        raise HTTPException(status_code=400, detail='Sin dnis hay que confirmar con "todos": true')
+    if dnis is None:
+        records = await listar_contribuyentes()
+        await asyncio.to_thread(contribuyentes_cache.warm, records)
+        if accion == suscripciones.CREAR:
+            # Los que pagan algo y todavía no tienen plan
+            dnis = [i["dni"] for i in facturacion.facturables(records) if not suscripciones.plan_id(i["fields"])]
+        else:
+            dnis = [r['fields']['ID_Contribuyente'] for r in records
+                    if r['fields'].get('ID_Contribuyente') and suscripciones.plan_id(r['fields'])]
+
+    operacion = suscripciones.OperacionMasiva(
+        accion, [str(dni) for dni in dnis], operar_suscripcion, guardar_suscripciones,
+        concurrency=SUSCRIPCIONES_CONCURRENCY, rate=SUSCRIPCIONES_RATE_LIMIT,
+    )
+    operaciones_suscripciones[operacion.id] = operacion
+
+    async def correr():
+        try:
+            await operacion.run()
+        except Exception as e:
+            print(f"ERROR: Falló la operación de suscripciones {operacion.id}: {e}")
+
+    operacion.task = asyncio.create_task(correr())
+    operacion.publicador = asyncio.create_task(
+        publicar_corrida("suscripciones", operacion.id, operacion.stats, operacion.task),
+    )
+    return {"message": f"Operación '{accion}' iniciada para {len(operacion.dnis)} contribuyentes",
+            "id": operacion.id, "estado": f"/suscripciones/masivas/{operacion.id}"}
+
+
+@router.get("/suscripciones/masivas/{operacion_id}")
+async def estado_suscripciones_masivas(operacion_id: str):
+    operacion = operaciones_suscripciones.get(operacion_id)
+    if operacion is not None:
+        return operacion.stats()
+    publicada = await corrida_publicada("suscripciones", operacion_id)
+    if publicada is None:
+        raise HTTPException(status_code=404, detail="Operación no encontrada")
+    return publicada
+
+
+@router.post("/suscripciones/{dni}")
+async def crear_suscripcion(dni: str, monto: float = None):
+    # Reemplaza al botón de Airtable que disparaba "Crear Suscripción IMPUESTOS" en n8n
+    result = await suscripcion_de_un_contribuyente(suscripciones.CREAR, dni, monto)
+    return {"dni": dni, "plan_id": result.get("plan_id"), "init_point": result.get("init_point"),
+            "reused": result["resultado"] == suscripciones.OMITIDO}
+
+
+@router.put("/suscripciones/{dni}")
+async def actualizar_suscripcion(dni: str, monto: float):
+    if monto <= 0:
+        raise HTTPException(status_code=400, detail="El monto tiene que ser mayor a cero")
+    result = await suscripcion_de_un_contribuyente(suscripciones.ACTUALIZAR, dni, monto)
+    return {"dni": dni, "plan_id": result["plan_id"], "monto": result["monto"]}
+
+
+@router.delete("/suscripciones/{dni}", dependencies=[Depends(requiere_admin)])
+async def cancelar_suscripcion(dni: str):
+    # Reemplaza al flujo "Cancelacion de planes" de n8n
+    result = await suscripcion_de_un_contribuyente(suscripciones.CANCELAR, dni)
+    return {"dni": dni, "plan_id": result["plan_id"], "estado_suscripcion": suscripciones.CANCELADA}
+
+
+# Resúmenes a partir de los totales precalculados (ver backend/agregados.py)
+@router.get("/resumen")
+async def resumen():
+    return await asyncio.to_thread(agregados.resumen)
+
+
+@router.get("/resumen/recaudacion")
+async def resumen_recaudacion(desde: str = None, hasta: str = None):
+    for valor in (desde, hasta):
+        if valor is not None and not facturacion.PERIODO_RE.match(valor):
+            raise HTTPException(status_code=400, detail="desde y hasta tienen formato YYYY-MM")
+    return {"meses": await asyncio.to_thread(agregados.recaudacion, desde, hasta)}
+
+
+@router.get("/resumen/periodos/{periodo}")
+async def resumen_periodo(periodo: str):
+    if not facturacion.PERIODO_RE.match(periodo):
+        raise HTTPException(status_code=400, detail="El período tiene formato YYYY-MM")
+    return await asyncio.to_thread(agregados.periodo, periodo)
+
+
+@router.post("/resumen/recalcular", dependencies=[Depends(requiere_admin)])
+async def recalcular_resumen():
+    # Rearma todos los totales (por ejemplo después de corregir pagos a mano en la base)
+    records = await listar_contribuyentes()
+    await asyncio.to_thread(agregados.recalcular, records)
+    return await asyncio.to_thread(agregados.resumen)
+
+
+def metricas_de_la_app():
+    """Collector para /metrics: lee los contadores que ya llevan cache, writers y cola."""
+    cache = contribuyentes_cache.stats()
+    preferencias = preferencias_cache.stats()
+    samples = [
+        ("traful_cache_hits_total", "counter", "Aciertos de cache", {"cache": "contribuyentes"}, cache["hits"]),
+        ("traful_cache_hits_total", "counter", "Aciertos de cache", {"cache": "preferencias"}, preferencias["hits"]),
+        ("traful_cache_misses_total", "counter", "Fallos de cache", {"cache": "contribuyentes"}, cache["misses"]),
+        ("traful_cache_misses_total", "counter", "Fallos de cache", {"cache": "preferencias"}, preferencias["misses"]),
+        ("traful_cache_entries", "gauge", "Entradas en cache", {"cache": "contribuyentes"}, cache["entries"]),
+        ("traful_cache_entries", "gauge", "Entradas en cache", {"cache": "preferencias"}, preferencias["entries"]),
+        ("traful_cache_evictions_total", "counter", "Desalojos por tamaño", {"cache": "contribuyentes"}, cache["evictions"]),
+        ("traful_preferences_created_total", "counter", "Preferencias creadas por /pagar", {}, preferencias["created"]),
+        ("traful_search_index_documents", "gauge", "Contribuyentes en el índice de búsqueda", {}, len(indice_contribuyentes)),
+        ("traful_webhook_processed_total", "counter", "Notificaciones procesadas", {}, webhook_workers.processed),
+        ("traful_webhook_retried_total", "counter", "Notificaciones reintentadas", {}, webhook_workers.retried),
+        ("traful_webhook_dead_total", "counter", "Notificaciones en dead-letter", {}, webhook_workers.dead),
+        ("traful_rate_limiter_waits_total", "counter", "Esperas del token bucket de Airtable", {}, airtable_rate_limiter.waits),
+        ("traful_payment_dedup_duplicates_total", "counter", "Notificaciones de pago repetidas", {}, pagos_dedup.duplicates),
+        ("traful_webhook_postponed_total", "counter", "Notificaciones pospuestas por circuito abierto", {}, webhook_workers.postponed),
+        ("traful_stale_served_total", "counter", "Consultas servidas desde el snapshot local", {}, contribuyentes_stale["servidos"]),
+        ("traful_leader", "gauge", "1 si este worker corre las tareas de fondo", {"pid": str(os.getpid())}, int(es_lider())),
+    ]
+    for breaker in (airtable_breaker, mercadopago_breaker):
+        stats = breaker.stats()
+        labels = {"upstream": breaker.name}
+        samples.append(("traful_circuit_state", "gauge", "Estado del circuito (0 cerrado, 1 semiabierto, 2 abierto)",
+                        labels, {CLOSED: 0, HALF_OPEN: 1}.get(stats["state"], 2)))
+        samples.append(("traful_circuit_opened_total", "counter", "Veces que se abrió el circuito", labels, stats["opened_total"]))
+        samples.append(("traful_circuit_rejected_total", "counter", "Llamadas cortadas por circuito abierto", labels, stats["rejected_total"]))
+    for (accion, resultado), count in suscripciones.contadores.items():
+        samples.append(("traful_subscription_operations_total", "counter", "Operaciones de suscripción",
+                        {"action": accion, "result": resultado}, count))
+    for status, count in webhook_queue.queue_depth().items():
+        samples.append(("traful_webhook_queue_depth", "gauge", "Filas de la cola de webhooks por estado",
+                        {"status": status}, count))
+    for tabla, writer in (("contribuyentes", contribuyentes_writer), ("pagos", pagos_writer)):
+        stats = writer.stats()
+        samples.append(("traful_airtable_writer_pending", "gauge", "Escrituras esperando lote", {"table": tabla}, stats["pending"]))
+        samples.append(("traful_airtable_writer_requests_total", "counter", "Requests del writer", {"table": tabla}, stats["requests"]))
+        samples.append(("traful_airtable_writer_coalesced_total", "counter", "Updates combinados", {"table": tabla}, stats["coalesced"]))
+        samples.append(("traful_airtable_writer_deferred_total", "counter", "Escrituras diferidas al outbox", {"table": tabla}, stats["deferred"]))
+    for status, count in outbox_depth().items():
+        samples.append(("traful_airtable_outbox_depth", "gauge", "Filas del outbox por estado", {"status": status}, count))
+    for canal, contadores in notificaciones_dispatcher.contadores.items():
+        labels = {"channel": canal}
+        samples.append(("traful_notifications_sent_total", "counter", "Avisos de pago enviados", labels, contadores["sent"]))
+        samples.append(("traful_notifications_retried_total", "counter", "Avisos reintentados", labels, contadores["retried"]))
+        samples.append(("traful_notifications_dead_total", "counter", "Avisos en dead-letter", labels, contadores["dead"]))
+    for canal, estados in notificaciones.depth().items():
+        for status, count in estados.items():
+            samples.append(("traful_notification_queue_depth", "gauge", "Avisos de pago por canal y estado",
+                            {"channel": canal, "status": status}, count))
+    return samples
+
+
+metrics.REGISTRY.add_collector(metricas_de_la_app)
+
+
+@router.get("/metrics")
+async def prometheus_metrics():
+    # Los collectors consultan la base: se arma el texto fuera del event loop
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@router.get("/metrics/profiles")
+async def slow_request_profiles():
+    # Perfiles de requests lentos (PROFILE_SAMPLE_RATE > 0)
+    return {
+        "enabled": metrics.profiler.enabled,
+        "sample_rate": metrics.profiler.sample_rate,
+        "slow_ms": metrics.profiler.slow_seconds * 1000,
+        "profiles": list(metrics.profiler.profiles),
+    }
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    stats = contribuyentes_cache.stats()
+    stats["preferencias"] = preferencias_cache.stats()
+    stats["busqueda"] = indice_contribuyentes.stats()
+    stats["stale"] = dict(contribuyentes_stale)
+    return stats
+
+
+@router.get("/circuitos")
+async def circuitos():
+    # Estado de los circuit breakers y de lo que quedó esperando a que vuelvan los upstreams
+    return {
+        "airtable": airtable_breaker.stats(),
+        "mercadopago": mercadopago_breaker.stats(),
+        "contribuyentes_stale": dict(contribuyentes_stale),
+        "escrituras_diferidas": {"contribuyentes": contribuyentes_writer.deferred, "pagos": pagos_writer.deferred},
+        "outbox": await asyncio.to_thread(outbox_depth),
+        "webhooks_pospuestos": webhook_workers.postponed,
+    }
+
+
+@router.get("/success")
 async def payment_success():
     return {"message": "Payment successful! Thank you for your payment."}
 
-@app.get("/pending")
+@router.get("/pending")
 async def payment_pending():
     return {"message": "Your payment is pending. We will notify you once it's processed."}
 
-@app.get("/failure")
+@router.get("/failure")
 async def payment_failure():
-    return {"message": "Payment failed. Please try again or contact support."}
\ No newline at end of file
+    return {"message": "Payment failed. Please try again or contact support."}
+
+
+app = create_app()
@@ -0,0 +1,231 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+
+# Métricas en memoria del proceso, expuestas en formato de texto de Prometheus
+# en /metrics. Sin dependencias: contadores e histogramas con etiquetas, más
+# "collectors" que leen al vuelo los contadores que ya llevan el cache, los
+# writers y la cola de webhooks.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labelvalues, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._series = {}  # etiquetas -> [conteos por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labelvalues, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+                labels = _labels(self.labelnames, labelvalues)
+                lines.append(f"{self.name}_sum{labels} {_number(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """`collector()` devuelve [(nombre, tipo, ayuda, {etiquetas}, valor)] al momento de exponer."""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        # Las muestras de una misma métrica tienen que quedar juntas en el texto
+        grouped = {}
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"ADVERTENCIA: Falló un collector de métricas: {e}")
+                continue
+            for name, kind, documentation, labels, value in samples:
+                if name not in grouped:
+                    grouped[name] = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+                grouped[name].append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        for group in grouped.values():
+            lines.extend(group)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_duration = REGISTRY.register(Histogram(
+    "traful_http_request_duration_seconds", "Duración de los requests HTTP por ruta",
+    ("method", "route", "status"),
+))
+upstream_request_duration = REGISTRY.register(Histogram(
+    "traful_upstream_request_duration_seconds", "Duración de cada llamada a Airtable o MercadoPago",
+    ("upstream", "operation", "status"),
+))
+upstream_retries = REGISTRY.register(Counter(
+    "traful_upstream_retries_total", "Reintentos de llamadas a servicios externos", ("upstream",),
+))
+upstream_throttled = REGISTRY.register(Counter(
+    "traful_upstream_throttled_total", "Respuestas 429 de servicios externos", ("upstream",),
+))
+profiles_captured = REGISTRY.register(Counter(
+    "traful_profiles_captured_total", "Perfiles de requests lentos capturados", ("route",),
+))
+
+
+def route_label(scope):
+    """Plantilla de la ruta (/contribuyentes/{dni}), no el path, para no explotar la cardinalidad."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "sin_ruta"
+
+
+class SlowRequestProfiler:
+    """Perfila con cProfile una muestra de los requests y guarda los que resultan lentos.
+
+    cProfile mide todo el hilo: con el event loop compartido, el perfil incluye
+    también lo que hicieron otros requests mientras tanto. Se perfila un
+    request a la vez.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_ms=500.0, keep=20, top=25):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_ms / 1000
+        self.top = top
+        self.profiles = deque(maxlen=keep)
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    def start(self):
+        """Devuelve un cProfile.Profile activo, o None si este request no entra en la muestra."""
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, profiler, route, method, elapsed):
+        profiler.disable()
+        try:
+            if elapsed < self.slow_seconds:
+                return
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(self.top)
+            self.profiles.append({
+                "route": route,
+                "method": method,
+                "elapsed_ms": round(elapsed * 1000, 1),
+                "at": time.time(),
+                "stats": out.getvalue(),
+            })
+            profiles_captured.inc(route)
+            print(f"ADVERTENCIA: Request lento {method} {route} ({elapsed * 1000:.0f} ms), perfil guardado.")
+        finally:
+            self._busy.release()
+
+
+profiler = SlowRequestProfiler(
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    slow_ms=float(os.getenv("PROFILE_SLOW_MS", "500")),
+)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: histograma de duración por método, ruta y código de respuesta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        sampled = profiler.start() if profiler.enabled else None
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = route_label(scope)
+            http_request_duration.observe(elapsed, scope["method"], route, str(status["code"]))
+            if sampled is not None:
+                profiler.finish(sampled, route, scope["method"], elapsed)
@@ -0,0 +1,171 @@
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, Text, UniqueConstraint
+from sqlalchemy.sql import func
+
+from backend.database import Base
+
+
+class Contribuyente(Base):
+    __tablename__ = "contribuyentes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    dni = Column(String, unique=True, index=True)
+    nombre = Column(String)
+    monto_mensual_impuesto = Column(Float)
+    tipo_impuesto = Column(String)
+    deuda = Column(Float)  # deuda actual: la del padrón menos los pagos aprobados
+    deuda_padron = Column(Float)  # deuda informada en el último padrón importado
+    saldo_a_favor = Column(Float)  # lo pagado de más sobre la deuda (la deuda no baja de 0)
+    estado_suscripcion = Column(String)
+    id_suscripcion_mp = Column(String)
+    enlace_suscripcion_mp = Column(String)
+    # Datos del padrón para la búsqueda (/contribuyentes/search)
+    dnis = Column(String)  # todos los titulares, separados por espacio
+    nomenclatura = Column(String)
+    lote = Column(String)
+    manzana = Column(String)
+    telefono = Column(String)  # número de WhatsApp para los avisos de pago (campo Telefono)
+    fecha_creacion = Column(DateTime, server_default=func.now())
+    ultima_actualizacion = Column(DateTime)
+
+
+class Pago(Base):
+    __tablename__ = "pagos"
+
+    id = Column(Integer, primary_key=True, index=True)
+    contribuyente_dni = Column(String, index=True)
+    monto_pagado = Column(Float)
+    id_transaccion_mp = Column(String, unique=True)
+    estado_pago = Column(String)
+    fecha_pago_real = Column(DateTime)
+    metodo_registro = Column(String)
+    notas_pago = Column(String)
+    fecha_registro = Column(DateTime, server_default=func.now())
+
+
+class WebhookEvent(Base):
+    """Notificación de MercadoPago recibida y pendiente de procesar (cola durable)."""
+    __tablename__ = "webhook_queue"
+
+    id = Column(Integer, primary_key=True)
+    payment_id = Column(String, index=True)
+    topic = Column(String)
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | processing | done | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text)
+    received_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime)
+    processed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_webhook_queue_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class AirtableOutbox(Base):
+    """Cambio hecho en la base local pendiente de replicar en Airtable."""
+    __tablename__ = "airtable_outbox"
+
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)  # contribuyentes | pagos
+    merge_key = Column(String, nullable=False)  # valor del campo por el que se hace upsert en Airtable
+    fields = Column(Text, nullable=False)  # JSON con los campos de Airtable
+    status = Column(String, nullable=False, default="pending")  # pending | done | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    processed_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_airtable_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class Notificacion(Base):
+    """Aviso de un pago pendiente de mandar por un canal (cola durable, ver backend/notificaciones.py)."""
+    __tablename__ = "notificaciones"
+
+    id = Column(Integer, primary_key=True)
+    canal = Column(String, nullable=False)  # whatsapp
+    evento = Column(String, nullable=False)  # pago_aprobado | pago_rechazado
+    payment_id = Column(String, nullable=False)
+    dni = Column(String)
+    destino = Column(String)  # número de teléfono
+    mensaje = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | processing | sent | dead | sin_destino
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        # Un aviso por pago y evento en cada canal, aunque MercadoPago repita la notificación
+        UniqueConstraint("canal", "payment_id", "evento", name="uq_notificaciones_canal_pago_evento"),
+        Index("ix_notificaciones_canal_status_next_attempt", "canal", "status", "next_attempt_at"),
+    )
+
+
+class FacturacionItem(Base):
+    """Checkpoint de la facturación masiva: un link de pago por contribuyente y período."""
+    __tablename__ = "facturacion"
+
+    id = Column(Integer, primary_key=True)
+    periodo = Column(String, nullable=False)  # YYYY-MM
+    dni = Column(String, nullable=False)
+    record_id = Column(String)  # ID del registro en Airtable (o en la base local)
+    monto = Column(Float, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | done | failed
+    preference_id = Column(String)
+    payment_link = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint("periodo", "dni", name="uq_facturacion_periodo_dni"),
+        Index("ix_facturacion_periodo_status", "periodo", "status"),
+    )
+
+
+class ConciliacionCursor(Base):
+    """Hasta dónde se recorrió la búsqueda de pagos de MercadoPago (por date_last_updated)."""
+    __tablename__ = "conciliacion_cursor"
+
+    name = Column(String, primary_key=True)
+    begin_date = Column(String, nullable=False)  # date_last_updated tal como lo devuelve MercadoPago
+    skip = Column(Integer, nullable=False, default=0)  # pagos ya vistos con ese mismo date_last_updated
+    updated_at = Column(DateTime)
+
+
+class ConciliacionFallido(Base):
+    """Pago que la conciliación no pudo aplicar; después de varias corridas queda 'dead' y el cursor sigue."""
+    __tablename__ = "conciliacion_fallidos"
+
+    payment_id = Column(String, primary_key=True)
+    status = Column(String, nullable=False)  # pending | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    updated_at = Column(DateTime)
+
+
+class Agregado(Base):
+    """Totales que se mantienen de forma incremental (ver backend/agregados.py)."""
+    __tablename__ = "agregados"
+
+    nombre = Column(String, primary_key=True)  # recaudado | facturado | deuda | suscripciones
+    clave = Column(String, primary_key=True)  # Año_Mes, período, estado de suscripción o "total"
+    total = Column(Float, nullable=False, default=0.0)
+    cantidad = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+
+class ContribuyenteSnapshot(Base):
+    """Última copia conocida de cada registro de Airtable, para servirla si Airtable no responde."""
+    __tablename__ = "contribuyentes_snapshot"
+
+    dni = Column(String, primary_key=True)
+    record = Column(Text, nullable=False)  # JSON del registro con formato Airtable
+    updated_at = Column(DateTime, nullable=False)
@@ -0,0 +1,126 @@
+"""
+Normalización de montos, DNIs y datos catastrales de los padrones municipales.
+
+Todas las funciones trabajan sobre columnas completas (listas de celdas): la
+limpieza de caracteres se hace con una sola pasada de str.translate sobre la
+columna unida y las conversiones con map() sobre la columna, en lugar de un
+bucle Python con varias operaciones por celda. Es la única implementación que
+usan los importadores (main.py de la raíz y backend/importer.py).
+"""
+import re
+
+# Separador de celdas al unir una columna; se elimina de las celdas antes de unir.
+_SEP = "\n"
+
+# Montos en texto: se quitan '$' y espacios; los puntos de miles se sacan con las
+# expresiones de abajo y recién después la ',' decimal pasa a ser '.'
+_AMOUNT_TABLE = str.maketrans({"$": None, " ": None, "\t": None, "\xa0": None})
+_DECIMAL_COMMA_TABLE = str.maketrans({",": "."})
+# Puntos de una celda que tiene ',' decimal: '37.200,00' -> '37200,00'
+_DOTS_BEFORE_COMMA_RE = re.compile(r"\.(?=[\d.]*,)")
+# Celda sin ',' que solo tiene puntos de miles: '37.200', '1.234.567' (pero no '37200.0' ni '1.5')
+_THOUSANDS_ONLY_RE = re.compile(r"^-?\d{1,3}(?:\.\d{3})+$", re.MULTILINE)
+# DNIs: se quitan los puntos y cualquier separador entre titulares pasa a ser espacio
+_DNI_TABLE = str.maketrans({".": None, "-": " ", "/": " ", ",": " ", ";": " ", "\xa0": " "})
+
+# Cualquier token que no sea un DNI de 7 u 8 dígitos (ya sin puntos)
+_NOT_DNI_RE = re.compile(r"(?<!\S)(?!\d{7,8}(?!\S))\S+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+SIN_MENSURA = "sin mensura"
+
+
+def _join(values):
+    """Une la columna en un solo string, una celda por línea."""
+    try:
+        text = _SEP.join(values)
+        if text.count(_SEP) == len(values) - 1:
+            return text
+    except TypeError:
+        pass
+    # Hay celdas que no son str (None, números del XLSX) o que traen saltos de línea
+    return _SEP.join("" if v is None else str(v).replace(_SEP, " ") for v in values)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_amounts(values):
+    """Montos en formato argentino -> floats.
+
+    '$  37.200,00 ' -> 37200.0, '37.200' -> 37200.0, '37200.5' -> 37200.5,
+    '$  -   ', '-' y vacío -> 0.0, valores ilegibles -> None. Las celdas que ya
+    son números (XLSX) se convierten directo, sin pasar por texto.
+    """
+    values = list(values)
+    if not values:
+        return []
+    numeric = list(map(_is_number, values))
+    if not any(numeric):
+        return _parse_amount_texts(values)
+    texts = iter(_parse_amount_texts([v for v, n in zip(values, numeric) if not n]))
+    return [float(v) if n else next(texts) for v, n in zip(values, numeric)]
+
+
+def _parse_amount_texts(values):
+    if not values:
+        return []
+    text = _DOTS_BEFORE_COMMA_RE.sub("", _join(values).translate(_AMOUNT_TABLE))
+    text = _THOUSANDS_ONLY_RE.sub(lambda m: m.group().replace(".", ""), text)
+    prepared = ["0" if c in ("", "-") else c for c in text.translate(_DECIMAL_COMMA_TABLE).split(_SEP)]
+    try:
+        return list(map(float, prepared))
+    except ValueError:
+        # Hay al menos una celda ilegible: se resuelve celda por celda solo en este caso
+        return [_to_float(c) for c in prepared]
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_amount(value):
+    """Versión escalar de parse_amounts, para usos puntuales."""
+    return parse_amounts([value])[0]
+
+
+def parse_dnis(values):
+    """Celdas de DNI -> lista de DNIs (solo dígitos) por celda.
+
+    '24.017.675  33.043.380' -> ['24017675', '33043380']; vacío -> [].
+    """
+    values = list(values)
+    if not values:
+        return []
+    cells = _NOT_DNI_RE.sub("", _join(values).translate(_DNI_TABLE)).split(_SEP)
+    return list(map(str.split, cells))
+
+
+def parse_nomenclaturas(values):
+    """Nomenclatura catastral limpia, o None si falta o es 'sin mensura'."""
+    values = list(values)
+    if not values:
+        return []
+    cells = _WHITESPACE_RE.sub(" ", _join(values).replace(_SEP, "\x00")).split("\x00")
+    return [None if c.strip().lower() in ("", SIN_MENSURA) else c.strip() for c in cells]
+
+
+def normalize_texts(values):
+    """Colapsa espacios y recorta (nombres, lotes, manzanas)."""
+    values = list(values)
+    if not values:
+        return []
+    return [c.strip() for c in _WHITESPACE_RE.sub(" ", _join(values).replace(_SEP, "\x00")).split("\x00")]
+
+
+def contribuyente_ids(dnis_column, nomenclaturas_column):
+    """Regla de ID_Contribuyente: primer DNI o, si no hay, la nomenclatura catastral."""
+    return [dnis[0] if dnis else nomenclatura for dnis, nomenclatura in zip(dnis_column, nomenclaturas_column)]
+
+
+def normalize_header(header):
+    return " ".join(str(header or "").split()).upper()
@@ -0,0 +1,320 @@
+import asyncio
+from datetime import timedelta
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend.database import SessionLocal, engine
+from backend.models import Notificacion
+from backend.upstream import UpstreamError
+from backend.webhook_queue import backoff_delay, utcnow
+
+# Avisos de pago a los contribuyentes (tabla notificaciones en sql_app.db).
+# En n8n el nodo "📱 API WhatsApp" mandaba el mensaje en el medio del flujo del
+# pago, así que un WhatsApp lento frenaba la sincronización. Acá el procesamiento
+# del webhook solo deja una fila en la cola y un dispatcher la manda después:
+# por canal, en lotes, con token bucket, reintentos con backoff y estado "dead".
+# La restricción única (canal, payment_id, evento) hace que cada pago se avise
+# una sola vez aunque MercadoPago repita la notificación.
+
+PENDING = "pending"
+PROCESSING = "processing"
+SENT = "sent"
+DEAD = "dead"
+# El contribuyente no tiene teléfono cargado: queda registrado pero no se manda
+SIN_DESTINO = "sin_destino"
+
+PAGO_APROBADO = "pago_aprobado"
+PAGO_RECHAZADO = "pago_rechazado"
+
+EVENTOS_POR_ESTADO = {
+    "approved": PAGO_APROBADO,
+    "rejected": PAGO_RECHAZADO,
+    "cancelled": PAGO_RECHAZADO,
+}
+
+
+def evento_de_pago(payment_status):
+    """Evento a avisar para un estado de MercadoPago, o None si no se avisa."""
+    return EVENTOS_POR_ESTADO.get(payment_status)
+
+
+def mensaje(evento, nombre, monto, periodo, payment_id):
+    saludo = f"Hola {nombre}," if nombre else "Hola,"
+    monto_texto = f"${float(monto or 0):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    if evento == PAGO_APROBADO:
+        return (f"{saludo} recibimos tu pago de {monto_texto} del período {periodo}. "
+                f"¡Gracias! Operación N° {payment_id}.")
+    return (f"{saludo} tu pago de {monto_texto} del período {periodo} fue rechazado. "
+            f"Podés volver a intentarlo desde el link de pago. Operación N° {payment_id}.")
+
+
+def encolar(canales, evento, payment_id, dni, destino, texto):
+    """Un aviso por canal. Devuelve cuántos se agregaron (0 si el pago ya se había avisado)."""
+    db = SessionLocal()
+    try:
+        created = agregar(db, canales, evento, payment_id, dni, destino, texto)
+        db.commit()
+        return created
+    finally:
+        db.close()
+
+
+def agregar(db, canales, evento, payment_id, dni, destino, texto):
+    """Como encolar, pero en la transacción de `db` (la que registra el pago en modo sql)."""
+    now = utcnow()
+    rows = [
+        {
+            "canal": canal,
+            "evento": evento,
+            "payment_id": str(payment_id),
+            "dni": dni,
+            "destino": destino,
+            "mensaje": texto,
+            "status": PENDING if destino else SIN_DESTINO,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        }
+        for canal in canales
+    ]
+    if not rows:
+        return 0
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(Notificacion).values(rows).on_conflict_do_nothing(
+        index_elements=[Notificacion.canal, Notificacion.payment_id, Notificacion.evento],
+    )
+    return db.execute(stmt).rowcount
+
+
+def claim_batch(canal, limit):
+    """Toma hasta `limit` avisos listos del canal y los marca como 'processing'."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Notificacion)
+            .filter(Notificacion.canal == canal, Notificacion.status == PENDING,
+                    Notificacion.next_attempt_at <= utcnow())
+            .order_by(Notificacion.next_attempt_at, Notificacion.id)
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            return []
+        db.execute(
+            update(Notificacion)
+            .where(Notificacion.id.in_([r.id for r in rows]), Notificacion.status == PENDING)
+            .values(status=PROCESSING)
+        )
+        db.commit()
+        return [
+            {"id": r.id, "payment_id": r.payment_id, "destino": r.destino, "mensaje": r.mensaje, "attempts": r.attempts}
+            for r in rows
+        ]
+    finally:
+        db.close()
+
+
+def mark_sent(ids):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Notificacion)
+            .where(Notificacion.id.in_(ids))
+            .values(status=SENT, sent_at=utcnow(), last_error=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def mark_failed(fallos, max_attempts, base_seconds, max_seconds):
+    """`fallos` es [(id, error, reintentable)]. Reprograma con backoff o pasa a 'dead'.
+
+    Devuelve la lista de ids que quedaron en 'dead'.
+    """
+    errores = {row_id: (error, retryable) for row_id, error, retryable in fallos}
+    dead = []
+    db = SessionLocal()
+    try:
+        for row in db.query(Notificacion).filter(Notificacion.id.in_(list(errores))):
+            error, retryable = errores[row.id]
+            row.attempts += 1
+            row.last_error = str(error)[:2000]
+            if not retryable or row.attempts >= max_attempts:
+                row.status = DEAD
+                dead.append(row.id)
+            else:
+                row.status = PENDING
+                row.next_attempt_at = utcnow() + timedelta(
+                    seconds=backoff_delay(row.attempts, base_seconds, max_seconds)
+                )
+        db.commit()
+        return dead
+    finally:
+        db.close()
+
+
+def postpone(ids, seconds, error):
+    """Vuelve a 'pending' sin contar un intento (el canal respondió 429)."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Notificacion)
+            .where(Notificacion.id.in_(ids))
+            .values(status=PENDING, last_error=str(error)[:2000],
+                    next_attempt_at=utcnow() + timedelta(seconds=seconds))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def requeue_stuck():
+    """Al arrancar, devuelve a 'pending' lo que quedó en 'processing' por un reinicio."""
+    db = SessionLocal()
+    try:
+        count = db.execute(
+            update(Notificacion).where(Notificacion.status == PROCESSING).values(status=PENDING)
+        ).rowcount
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def depth():
+    """{canal: {estado: cantidad}}."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Notificacion.canal, Notificacion.status, func.count(Notificacion.id))
+            .group_by(Notificacion.canal, Notificacion.status)
+            .all()
+        )
+        result = {}
+        for canal, status, count in rows:
+            result.setdefault(canal, {PENDING: 0, PROCESSING: 0, SENT: 0, DEAD: 0, SIN_DESTINO: 0})[status] = count
+        return result
+    finally:
+        db.close()
+
+
+def es_reintentable(error):
+    # Un 4xx (número inválido, instancia desconectada) no se arregla reintentando; un 429 sí
+    if isinstance(error, UpstreamError) and 400 <= error.status_code < 500:
+        return error.status_code in (408, 429)
+    return True
+
+
+class NotificacionesDispatcher:
+    """Manda los avisos de la cola, una tarea por canal.
+
+    `canales` mapea el nombre del canal a (enviar, rate_limiter): `enviar(destino,
+    mensaje)` es una corrutina y `rate_limiter` un TokenBucket con el límite del
+    proveedor. Cada vuelta toma un lote, lo manda con hasta `concurrency` envíos
+    en vuelo y actualiza los estados del lote de una sola vez.
+    """
+
+    def __init__(self, canales, batch_size=20, concurrency=5, max_attempts=8, backoff_base_seconds=5.0,
+                 backoff_max_seconds=1800.0, poll_interval=1.0):
+        self.canales = canales
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._wakeup = {}
+        # Métricas en memoria del proceso, por canal
+        self.contadores = {canal: {"sent": 0, "retried": 0, "dead": 0, "throttled": 0, "batches": 0} for canal in canales}
+
+    def start(self):
+        self._wakeup = {canal: asyncio.Event() for canal in self.canales}
+        self._tasks = [asyncio.create_task(self._run(canal)) for canal in self.canales]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Despierta a los canales cuando se encola un aviso nuevo."""
+        for wakeup in self._wakeup.values():
+            wakeup.set()
+
+    async def _run(self, canal):
+        wakeup = self._wakeup[canal]
+        while True:
+            try:
+                sent = await self.drain_once(canal)
+            except Exception as e:
+                print(f"ERROR: Falló el envío de notificaciones por {canal}: {e}")
+                sent = 0
+            if sent:
+                continue
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self, canal):
+        """Manda un lote del canal. Devuelve cuántos avisos procesó."""
+        rows = await asyncio.to_thread(claim_batch, canal, self.batch_size)
+        if not rows:
+            return 0
+        enviar, rate_limiter = self.canales[canal]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(row):
+            async with semaphore:
+                await rate_limiter.acquire()
+                try:
+                    await enviar(row["destino"], row["mensaje"])
+                    return None
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    return e
+
+        errores = await asyncio.gather(*(send(row) for row in rows))
+        contadores = self.contadores[canal]
+        contadores["batches"] += 1
+        sent = [row["id"] for row, error in zip(rows, errores) if error is None]
+        throttled = [(row, error) for row, error in zip(rows, errores)
+                     if isinstance(error, UpstreamError) and error.status_code == 429]
+        fallos = [(row["id"], error, es_reintentable(error)) for row, error in zip(rows, errores)
+                  if error is not None and not (isinstance(error, UpstreamError) and error.status_code == 429)]
+        if sent:
+            await asyncio.to_thread(mark_sent, sent)
+            contadores["sent"] += len(sent)
+        if throttled:
+            wait = max(error.retry_after or 0.0 for _, error in throttled)
+            # El proveedor pidió frenar: todo el canal espera, y estos avisos no gastan un intento
+            rate_limiter.pause(wait)
+            await asyncio.to_thread(postpone, [row["id"] for row, _ in throttled], wait, throttled[0][1])
+            contadores["throttled"] += len(throttled)
+            print(f"ADVERTENCIA: {canal} respondió 429, {len(throttled)} avisos se reintentan en {wait:.1f} s.")
+        if fallos:
+            dead = await asyncio.to_thread(
+                mark_failed, fallos, self.max_attempts, self.backoff_base_seconds, self.backoff_max_seconds,
+            )
+            contadores["dead"] += len(dead)
+            contadores["retried"] += len(fallos) - len(dead)
+            for row_id, error, _ in fallos:
+                if row_id in dead:
+                    print(f"ERROR: Aviso {row_id} por {canal} pasó a dead-letter: {error}")
+            print(f"ADVERTENCIA: {len(fallos)} avisos por {canal} fallaron, {len(fallos) - len(dead)} se reintentarán.")
+        return len(rows)
+
+    def metrics(self):
+        return {
+            "canales": list(self.canales),
+            "depth": depth(),
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "contadores": self.contadores,
+        }
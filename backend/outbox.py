@@ -0,0 +1,249 @@
+import asyncio
+import json
+from datetime import timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import aliased
+
+from backend.breaker import CircuitOpenError
+from backend.database import SessionLocal
+from backend.models import AirtableOutbox
+from backend.upstream import AIRTABLE_BATCH_SIZE
+from backend.webhook_queue import backoff_delay, utcnow
+
+# Replicador de la tabla airtable_outbox hacia Airtable (modo STORAGE_BACKEND=sql,
+# y en los dos modos para las escrituras diferidas mientras Airtable está caído).
+# Toma los cambios pendientes, combina los que apuntan al mismo registro y los
+# manda como upserts de 10 registros (performUpsert) a través del AirtableClient,
+# que ya respeta el límite de 5 req/s y los 429.
+
+# Clave interna en los campos de un pago: DNI del contribuyente a enlazar en 'Socio'
+SOCIO_DNI_KEY = "_socio_dni"
+# Clave interna de una escritura diferida por el AirtableWriter: PATCH por record id en lugar de upsert
+RECORD_ID_KEY = "_record_id"
+
+
+def claim_batch(limit):
+    """Filas listas para replicar, en orden de encolado.
+
+    Una fila no se toma mientras haya otra anterior del mismo registro esperando
+    su backoff: si no, el cambio nuevo llegaría a Airtable antes que el viejo y
+    el reintento del viejo lo pisaría.
+    """
+    now = utcnow()
+    anterior = aliased(AirtableOutbox)
+    en_espera = (
+        select(anterior.id)
+        .where(anterior.status == "pending", anterior.next_attempt_at > now,
+               anterior.table_name == AirtableOutbox.table_name, anterior.merge_key == AirtableOutbox.merge_key,
+               anterior.id < AirtableOutbox.id)
+        .exists()
+    )
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(AirtableOutbox)
+            .filter(AirtableOutbox.status == "pending", AirtableOutbox.next_attempt_at <= now, ~en_espera)
+            .order_by(AirtableOutbox.id)
+            .limit(limit)
+            .all()
+        )
+        return [
+            {"id": r.id, "table_name": r.table_name, "merge_key": r.merge_key, "fields": json.loads(r.fields)}
+            for r in rows
+        ]
+    finally:
+        db.close()
+
+
+def mark_done(ids):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(AirtableOutbox)
+            .where(AirtableOutbox.id.in_(ids))
+            .values(status="done", processed_at=utcnow(), last_error=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def mark_failed(ids, error, max_attempts, base_seconds, max_seconds):
+    db = SessionLocal()
+    try:
+        for row in db.query(AirtableOutbox).filter(AirtableOutbox.id.in_(ids)):
+            row.attempts += 1
+            row.last_error = str(error)[:2000]
+            if row.attempts >= max_attempts:
+                row.status = "dead"
+                row.processed_at = utcnow()
+            else:
+                row.next_attempt_at = utcnow() + timedelta(
+                    seconds=backoff_delay(row.attempts, base_seconds, max_seconds)
+                )
+        db.commit()
+    finally:
+        db.close()
+
+
+def postpone(ids, seconds):
+    """Vuelve a programar filas sin contar un intento (el circuito de Airtable estaba abierto)."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(AirtableOutbox)
+            .where(AirtableOutbox.id.in_(ids))
+            .values(next_attempt_at=utcnow() + timedelta(seconds=seconds))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def has_pending():
+    db = SessionLocal()
+    try:
+        return db.query(AirtableOutbox.id).filter(AirtableOutbox.status == "pending").first() is not None
+    finally:
+        db.close()
+
+
+def outbox_depth():
+    db = SessionLocal()
+    try:
+        rows = db.query(AirtableOutbox.status, func.count(AirtableOutbox.id)).group_by(AirtableOutbox.status).all()
+        depth = {"pending": 0, "done": 0, "dead": 0}
+        depth.update({status: count for status, count in rows})
+        return depth
+    finally:
+        db.close()
+
+
+def coalesce(rows):
+    """Agrupa por (tabla, clave) combinando los campos en el orden en que se encolaron."""
+    merged = {}
+    for row in rows:
+        key = (row["table_name"], row["merge_key"])
+        if key not in merged:
+            merged[key] = {"ids": [], "fields": {}}
+        merged[key]["ids"].append(row["id"])
+        merged[key]["fields"].update(row["fields"])
+    return merged
+
+
+class OutboxReplicator:
+    """Copia a Airtable los cambios de la base local.
+
+    `targets` mapea el nombre lógico de la tabla a (AirtableClient, campo de merge).
+    `resolve_socio` es una corrutina dni -> record id de Airtable, para el campo 'Socio'.
+    Con `breaker` no se intenta nada mientras el circuito de Airtable está abierto.
+    """
+
+    def __init__(self, targets, resolve_socio, max_attempts=10, backoff_base_seconds=2.0,
+                 backoff_max_seconds=600.0, poll_interval=1.0, claim_limit=100, breaker=None):
+        self.targets = targets
+        self.resolve_socio = resolve_socio
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.poll_interval = poll_interval
+        self.claim_limit = claim_limit
+        self._task = None
+        self._wakeup = None
+        self.replicated = 0
+        self.failed = 0
+        # Si quedan filas pendientes; el AirtableWriter difiere mientras tanto para no adelantarse
+        self.pending = False
+        self.drain = True
+
+    def start(self, drain=True):
+        """Con drain=False (un worker que no es líder) no replica: solo sigue si quedan filas pendientes."""
+        self.drain = drain
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self):
+        self.pending = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                drained = await self.drain_once() if self.drain else 0
+            except Exception as e:
+                print(f"ERROR: Falló la réplica a Airtable: {e}")
+                drained = 0
+            if drained:
+                continue
+            if self.pending:
+                self.pending = await asyncio.to_thread(has_pending)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self):
+        """Replica un lote de filas pendientes. Devuelve cuántas filas procesó."""
+        if self.breaker is not None and not self.breaker.allows():
+            return 0
+        rows = await asyncio.to_thread(claim_batch, self.claim_limit)
+        if not rows:
+            return 0
+        by_table = {}
+        for (table_name, _), item in coalesce(rows).items():
+            by_table.setdefault(table_name, []).append(item)
+        sends = []
+        for table_name, items in by_table.items():
+            for i in range(0, len(items), AIRTABLE_BATCH_SIZE):
+                sends.append(self._send(table_name, items[i:i + AIRTABLE_BATCH_SIZE]))
+        await asyncio.gather(*sends)
+        return len(rows)
+
+    async def _send(self, table_name, items):
+        ids = [row_id for item in items for row_id in item["ids"]]
+        try:
+            client, merge_field = self.targets[table_name]
+            fields_list = []
+            by_record_id = []
+            for item in items:
+                fields = dict(item["fields"])
+                socio_dni = fields.pop(SOCIO_DNI_KEY, None)
+                if socio_dni:
+                    record_id = await self.resolve_socio(socio_dni)
+                    if record_id:
+                        fields["Socio"] = [record_id]
+                record_id = fields.pop(RECORD_ID_KEY, None)
+                if record_id:
+                    by_record_id.append({"id": record_id, "fields": fields})
+                else:
+                    fields_list.append(fields)
+            if fields_list:
+                await client.batch_upsert(fields_list, [merge_field])
+            if by_record_id:
+                await client.batch_update(by_record_id)
+        except CircuitOpenError as e:
+            # Airtable cayó en el medio: sin gastar intentos, se retoma cuando se cierre el circuito
+            await asyncio.to_thread(postpone, ids, e.retry_after)
+            return
+        except Exception as e:
+            self.failed += len(ids)
+            await asyncio.to_thread(
+                mark_failed, ids, e, self.max_attempts, self.backoff_base_seconds, self.backoff_max_seconds
+            )
+            print(f"ADVERTENCIA: No se pudieron replicar {len(ids)} cambios a Airtable ({table_name}): {e}")
+            return
+        await asyncio.to_thread(mark_done, ids)
+        self.replicated += len(ids)
+
+    def metrics(self):
+        return {"depth": outbox_depth(), "replicated": self.replicated, "failed": self.failed}
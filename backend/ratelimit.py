@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+# Limitador de tasa tipo token bucket, compartido por todas las llamadas a un mismo
+# upstream (Airtable limita a 5 requests por segundo por base).
+
+
+class TokenBucket:
+    """Entrega hasta `rate` permisos por segundo con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waits = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self.waits += 1
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                self.waits += 1
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Frena a todos los que comparten el bucket (ej. tras un 429 con Retry-After)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+
+
+class SharedTokenBucket:
+    """TokenBucket compartido entre procesos (backend/compartido.py), con la misma interfaz.
+
+    Con varios workers cada uno tendría su propio bucket de 5 req/s y entre todos
+    se pasarían del límite de Airtable: acá el saldo vive en el archivo compartido.
+    """
+
+    def __init__(self, estado, nombre, rate, capacity=None):
+        self.estado = estado
+        self.nombre = nombre
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._lock = asyncio.Lock()  # dentro del proceso, de a uno contra el archivo
+        self._paused_until = 0.0
+        self._pausas = set()
+        self.waits = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                # La pausa de este proceso vale aunque todavía no haya llegado al archivo
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self.waits += 1
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                wait = await asyncio.to_thread(self.estado.take_token, self.nombre, self.rate, self.capacity)
+                if not wait:
+                    return
+                self.waits += 1
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Frena a todos los workers (ej. tras un 429 con Retry-After).
+
+        Se llama desde el event loop: la escritura en el archivo compartido (que
+        puede esperar el lock de otro worker) va en un hilo aparte.
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        task = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(self.estado.pause_bucket, self.nombre, seconds)
+        )
+        self._pausas.add(task)
+        task.add_done_callback(self._pausa_escrita)
+
+    def _pausa_escrita(self, task):
+        self._pausas.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"ADVERTENCIA: No se pudo pausar el bucket compartido {self.nombre}: {task.exception()}")
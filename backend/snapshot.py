@@ -0,0 +1,56 @@
+import json
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend.database import SessionLocal, engine
+from backend.models import ContribuyenteSnapshot
+from backend.webhook_queue import utcnow
+
+# Copia local de los registros de Contribuyentes leídos de Airtable (tabla
+# contribuyentes_snapshot). Se actualiza con la precarga del cache y con cada
+# consulta que va a Airtable; si Airtable no responde (o su circuito está
+# abierto) la API sirve desde acá la última versión conocida, marcada como stale.
+
+
+def guardar(records):
+    """Upsert de registros con formato Airtable. Devuelve cuántos se guardaron."""
+    now = utcnow()
+    rows = [
+        {"dni": r["fields"]["ID_Contribuyente"], "record": json.dumps(r), "updated_at": now}
+        for r in records if r.get("fields", {}).get("ID_Contribuyente")
+    ]
+    if not rows:
+        return 0
+    dialect_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(ContribuyenteSnapshot)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ContribuyenteSnapshot.dni],
+        set_={"record": stmt.excluded.record, "updated_at": stmt.excluded.updated_at},
+    )
+    db = SessionLocal()
+    try:
+        for i in range(0, len(rows), 500):
+            db.execute(stmt, rows[i:i + 500])
+        db.commit()
+        return len(rows)
+    finally:
+        db.close()
+
+
+def leer(dni):
+    """(registro, guardado_en) de la última versión conocida, o None."""
+    db = SessionLocal()
+    try:
+        row = db.get(ContribuyenteSnapshot, dni)
+        return (json.loads(row.record), row.updated_at) if row else None
+    finally:
+        db.close()
+
+
+def todos():
+    """Todos los registros guardados (los workers que no son líder arman el índice desde acá)."""
+    db = SessionLocal()
+    try:
+        return [json.loads(record) for (record,) in db.query(ContribuyenteSnapshot.record)]
+    finally:
+        db.close()
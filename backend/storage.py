@@ -0,0 +1,168 @@
+import json
+
+from backend import agregados, notificaciones
+from backend.database import SessionLocal
+from backend.dedup import pago_upsert
+from backend.models import AirtableOutbox, Contribuyente
+from backend.webhook_queue import utcnow
+
+# Almacenamiento principal en la base SQL (STORAGE_BACKEND=sql).
+# Las lecturas y escrituras de la API van a la base local; cada cambio deja una
+# fila en airtable_outbox en la misma transacción y el replicador
+# (backend/outbox.py) la copia a Airtable en segundo plano.
+# Los registros se devuelven con el mismo formato que Airtable
+# ({"id", "createdTime", "fields"}) para que los endpoints no cambien.
+
+AIRTABLE_TABLE_CONTRIBUYENTES = "contribuyentes"
+AIRTABLE_TABLE_PAGOS = "pagos"
+
+# Campo de Airtable -> columna de la tabla contribuyentes
+CONTRIBUYENTE_FIELDS = {
+    "ID_Contribuyente": "dni",
+    "Nombre_Contribuyente": "nombre",
+    "Monto_Mensual_Impuesto": "monto_mensual_impuesto",
+    "Tipo_Impuesto": "tipo_impuesto",
+    "Estado_Suscripcion": "estado_suscripcion",
+    "ID_Suscripcion_MP": "id_suscripcion_mp",
+    "Enlace_Suscripcion_MP": "enlace_suscripcion_mp",
+    "DNIs": "dnis",
+    "Nomenclatura_Catastral": "nomenclatura",
+    "Lote": "lote",
+    "Manzana": "manzana",
+    "Telefono": "telefono",
+}
+# Campos del índice de búsqueda que carga el importador en la tabla local y no están en Airtable
+CAMPOS_DE_BUSQUEDA = ("DNIs", "Nomenclatura_Catastral", "Lote", "Manzana")
+
+
+def contribuyente_to_record(contribuyente):
+    fields = {
+        field: getattr(contribuyente, column)
+        for field, column in CONTRIBUYENTE_FIELDS.items()
+        if getattr(contribuyente, column) is not None
+    }
+    fields["Deuda"] = contribuyente.deuda
+    return {
+        "id": str(contribuyente.id),
+        "createdTime": contribuyente.fecha_creacion.isoformat() if contribuyente.fecha_creacion else None,
+        "fields": fields,
+    }
+
+
+def get_contribuyente_record(dni):
+    db = SessionLocal()
+    try:
+        contribuyente = db.query(Contribuyente).filter(Contribuyente.dni == dni).first()
+        return contribuyente_to_record(contribuyente) if contribuyente else None
+    finally:
+        db.close()
+
+
+def get_all_contribuyente_records():
+    db = SessionLocal()
+    try:
+        return [contribuyente_to_record(c) for c in db.query(Contribuyente).yield_per(1000)]
+    finally:
+        db.close()
+
+
+def get_campos_de_busqueda(dnis=None):
+    """{dni: campos de CAMPOS_DE_BUSQUEDA} de la tabla local (todos, o solo `dnis`)."""
+    columns = [getattr(Contribuyente, CONTRIBUYENTE_FIELDS[field]) for field in CAMPOS_DE_BUSQUEDA]
+    db = SessionLocal()
+    try:
+        query = db.query(Contribuyente.dni, *columns)
+        if dnis is not None:
+            query = query.filter(Contribuyente.dni.in_(list(dnis)))
+        result = {}
+        for dni, *values in query.yield_per(1000):
+            fields = {field: value for field, value in zip(CAMPOS_DE_BUSQUEDA, values) if value is not None}
+            if fields:
+                result[dni] = fields
+        return result
+    finally:
+        db.close()
+
+
+def add_outbox(db, table_name, merge_key, fields):
+    now = utcnow()
+    db.add(AirtableOutbox(
+        table_name=table_name,
+        merge_key=merge_key,
+        fields=json.dumps(fields, default=str),
+        status="pending",
+        attempts=0,
+        next_attempt_at=now,
+        created_at=now,
+    ))
+
+
+def add_outbox_rows(table_name, rows):
+    """Encola [(merge_key, campos)] en una transacción (escrituras a Airtable diferidas)."""
+    db = SessionLocal()
+    try:
+        for merge_key, fields in rows:
+            add_outbox(db, table_name, merge_key, fields)
+        db.commit()
+    finally:
+        db.close()
+
+
+def update_contribuyente(dni, fields):
+    """Actualiza campos (con nombres de Airtable) y encola la réplica."""
+    db = SessionLocal()
+    try:
+        contribuyente = db.query(Contribuyente).filter(Contribuyente.dni == dni).first()
+        if contribuyente is None:
+            return None
+        for field, value in fields.items():
+            column = CONTRIBUYENTE_FIELDS.get(field)
+            if column and column != "dni":
+                setattr(contribuyente, column, value)
+        contribuyente.ultima_actualizacion = utcnow()
+        add_outbox(db, AIRTABLE_TABLE_CONTRIBUYENTES, dni, dict(fields, ID_Contribuyente=dni))
+        db.commit()
+        return contribuyente_to_record(contribuyente)
+    finally:
+        db.close()
+
+
+def update_contribuyentes(changes):
+    """Versión en lote de update_contribuyente: {dni: campos} en una sola transacción."""
+    db = SessionLocal()
+    try:
+        now = utcnow()
+        updated = 0
+        for contribuyente in db.query(Contribuyente).filter(Contribuyente.dni.in_(list(changes))):
+            fields = changes[contribuyente.dni]
+            for field, value in fields.items():
+                column = CONTRIBUYENTE_FIELDS.get(field)
+                if column and column != "dni":
+                    setattr(contribuyente, column, value)
+            contribuyente.ultima_actualizacion = now
+            add_outbox(db, AIRTABLE_TABLE_CONTRIBUYENTES, contribuyente.dni,
+                       dict(fields, ID_Contribuyente=contribuyente.dni))
+            updated += 1
+        db.commit()
+        return updated
+    finally:
+        db.close()
+
+
+def record_pago(payment_id, status, dni, amount, paid_at, method, airtable_fields, aviso=None):
+    """Guarda el pago en la tabla pagos (con sus agregados) y encola su réplica en la misma transacción.
+
+    `aviso` son los argumentos de notificaciones.agregar: el aviso al contribuyente
+    entra en la misma transacción, así un pago registrado nunca queda sin avisar.
+    Devuelve cuántos avisos se agregaron.
+    """
+    db = SessionLocal()
+    try:
+        agregados.aplicar_pago(db, payment_id, status, dni, amount, paid_at)
+        db.execute(pago_upsert(payment_id, status, dni, amount, paid_at, method))
+        add_outbox(db, AIRTABLE_TABLE_PAGOS, payment_id, airtable_fields)
+        avisos = notificaciones.agregar(db, **aviso) if aviso else 0
+        db.commit()
+        return avisos
+    finally:
+        db.close()
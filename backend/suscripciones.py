@@ -0,0 +1,285 @@
+"""
+Suscripciones con débito automático (preapproval_plan de MercadoPago) desde la
+API, en lugar de los flujos de n8n "Crear Suscripción IMPUESTOS v1.0" y
+"Cancelacion de planes" (un webhook, un GET a Airtable, la llamada a
+MercadoPago y un update a Airtable por cada click, cada uno un salto HTTP).
+
+Acá cada operación es una sola llamada a MercadoPago con el pool de conexiones
+de la API; el registro del contribuyente sale del cache y los campos que
+cambian se escriben en lotes (AirtableWriter u outbox, según STORAGE_BACKEND).
+Las operaciones masivas corren sobre muchos contribuyentes con un pool acotado
+de workers y un token bucket propio, igual que la facturación.
+
+Campos del contribuyente, como los dejaban los flujos de n8n:
+    crear     ID_Suscripcion_MP, Enlace_Suscripcion_MP y Estado_Suscripcion = Pendiente
+    cancelar  Estado_Suscripcion = Cancelada e ID/Enlace en "-"
+"""
+import asyncio
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from backend import metrics
+from backend.ratelimit import TokenBucket
+from backend.webhook_queue import backoff_delay
+
+CREAR = "crear"
+ACTUALIZAR = "actualizar"
+CANCELAR = "cancelar"
+ACCIONES_MASIVAS = (CREAR, CANCELAR)
+
+PENDIENTE = "Pendiente"
+CANCELADA = "Cancelada"
+# Lo que escribe la cancelación en ID_Suscripcion_MP y Enlace_Suscripcion_MP
+SIN_PLAN = "-"
+
+# Resultado de cada operación
+HECHO = "hecho"
+OMITIDO = "omitido"  # no había nada que hacer (ya tiene plan, o no tiene para cancelar)
+FALLIDO = "fallido"
+NO_ENCONTRADO = "no_encontrado"
+
+# Operaciones por (acción, resultado), para /metrics
+contadores = Counter()
+
+
+def plan_id(fields):
+    """ID del plan vigente del contribuyente, o None si no tiene (o está cancelado)."""
+    value = fields.get("ID_Suscripcion_MP")
+    if not value or value == SIN_PLAN or fields.get("Estado_Suscripcion") == CANCELADA:
+        return None
+    return value
+
+
+def build_plan_data(dni, fields, monto, back_url):
+    """Cuerpo de POST /preapproval_plan (el mismo que mandaba "Crear Plan MP" en n8n)."""
+    return {
+        "reason": fields.get("Tipo_Impuesto") or f"Impuesto - DNI: {dni}",
+        "auto_recurring": {
+            "frequency": 1,
+            "frequency_type": "months",
+            "transaction_amount": monto,
+            "currency_id": "ARS",
+        },
+        "back_url": back_url,
+        "external_reference": dni,  # El webhook usa el DNI para encontrar al contribuyente
+    }
+
+
+def idempotency_key(dni):
+    """X-Idempotency-Key del alta del plan de un DNI."""
+    return f"plan-{dni}-{uuid.uuid4().hex}"
+
+
+def monto_del_plan(fields, monto=None):
+    monto = monto if monto is not None else fields.get("Monto_Mensual_Impuesto")
+    return float(monto) if monto else None
+
+
+async def llamar(request, rate_limiter=None, max_attempts=3, backoff_base_seconds=1.0):
+    """Llama a MercadoPago con reintentos ante 429, 5xx y errores de red.
+
+    Devuelve (status, body); un error del pedido (4xx) no se reintenta.
+    """
+    status, body = None, {}
+    for attempt in range(1, max_attempts + 1):
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        try:
+            response = await request()
+            status, body = response.get("status", 200), response.get("response") or {}
+            if status < 400 or (status < 500 and status != 429):
+                return status, body
+            if status == 429 and rate_limiter is not None:
+                rate_limiter.pause(backoff_base_seconds * attempt)
+        except Exception as e:
+            status, body = None, {"message": str(e)}
+        if attempt < max_attempts:
+            metrics.upstream_retries.inc("mercadopago")
+            await asyncio.sleep(backoff_delay(attempt, backoff_base_seconds, 30.0))
+    return status, body
+
+
+async def ejecutar(mercadopago, accion, dni, fields, back_url, monto=None, rate_limiter=None,
+                   max_attempts=3, backoff_base_seconds=1.0):
+    """Crea, actualiza o cancela el plan de un contribuyente.
+
+    Devuelve {"dni", "accion", "resultado", ...}; con resultado HECHO trae en
+    "campos" lo que hay que escribir en el contribuyente (nombres de Airtable).
+    """
+    result = {"dni": dni, "accion": accion}
+    actual = plan_id(fields)
+    if accion == CREAR:
+        if actual:
+            # Doble click o reintento: el plan ya existe y se devuelve el mismo link
+            result.update(resultado=OMITIDO, plan_id=actual, init_point=fields.get("Enlace_Suscripcion_MP"),
+                          detalle="El contribuyente ya tiene una suscripción")
+            return result
+        monto = monto_del_plan(fields, monto)
+        if not monto:
+            result.update(resultado=OMITIDO, detalle="El contribuyente no tiene Monto_Mensual_Impuesto")
+            return result
+        data = build_plan_data(dni, fields, monto, back_url)
+        # La misma clave en todos los reintentos de este alta (timeout o 5xx): si MercadoPago
+        # llegó a crear el plan, devuelve ese en lugar de otro. Nueva por alta, porque después
+        # de cancelar el contribuyente puede volver a suscribirse con el mismo monto.
+        key = idempotency_key(dni)
+        request = lambda: mercadopago.create_preapproval_plan(data, idempotency_key=key)
+    elif not actual:
+        result.update(resultado=OMITIDO, detalle="El contribuyente no tiene una suscripción vigente")
+        return result
+    elif accion == ACTUALIZAR:
+        monto = monto_del_plan(fields, monto)
+        if not monto:
+            result.update(resultado=OMITIDO, detalle="Falta el monto del plan")
+            return result
+        data = {"auto_recurring": {"transaction_amount": monto, "currency_id": "ARS"}}
+        request = lambda: mercadopago.update_preapproval_plan(actual, data)
+    elif accion == CANCELAR:
+        request = lambda: mercadopago.update_preapproval_plan(actual, {"status": "cancelled"})
+    else:
+        raise ValueError(f"Acción de suscripción desconocida: {accion}")
+
+    status, body = await llamar(request, rate_limiter, max_attempts, backoff_base_seconds)
+    if status is None or status >= 400:
+        result.update(resultado=FALLIDO, status=status, detalle=str(body.get("message", body))[:500])
+        return result
+
+    if accion == CREAR:
+        campos = {"ID_Suscripcion_MP": body.get("id"), "Enlace_Suscripcion_MP": body.get("init_point"),
+                  "Estado_Suscripcion": PENDIENTE}
+        result.update(plan_id=body.get("id"), init_point=body.get("init_point"))
+    elif accion == ACTUALIZAR:
+        # El monto del padrón sigue al del plan
+        campos = {"Monto_Mensual_Impuesto": monto}
+        result.update(plan_id=actual, monto=monto)
+    else:
+        campos = {"Estado_Suscripcion": CANCELADA, "ID_Suscripcion_MP": SIN_PLAN, "Enlace_Suscripcion_MP": SIN_PLAN}
+        result.update(plan_id=actual)
+    result.update(resultado=HECHO, campos=campos)
+    return result
+
+
+class PorContribuyente:
+    """Una operación de suscripción a la vez por DNI: un doble click no crea dos planes."""
+
+    def __init__(self):
+        self._locks = {}
+        self._waiting = Counter()
+
+    @asynccontextmanager
+    async def lock(self, dni):
+        lock = self._locks.setdefault(dni, asyncio.Lock())
+        self._waiting[dni] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiting[dni] -= 1
+            if not self._waiting[dni]:
+                del self._waiting[dni]
+                del self._locks[dni]
+
+
+class OperacionMasiva:
+    """Crear o cancelar suscripciones de muchos contribuyentes.
+
+    `operar(accion, dni, rate_limiter=...)` es una corrutina que hace la operación de un
+    DNI (devuelve el resultado de ejecutar()); `guardar(resultados)` escribe en lote
+    los campos de los que salieron bien.
+    """
+
+    def __init__(self, accion, dnis, operar, guardar, concurrency=10, rate=20.0, flush_every=50):
+        if accion not in ACCIONES_MASIVAS:
+            raise ValueError(f"Acción masiva inválida '{accion}', se espera {' o '.join(ACCIONES_MASIVAS)}")
+        self.id = uuid.uuid4().hex[:12]
+        self.accion = accion
+        self.dnis = list(dict.fromkeys(dnis))
+        self.operar = operar
+        self.guardar = guardar
+        self.concurrency = concurrency
+        self.rate_limiter = TokenBucket(rate)
+        self.flush_every = flush_every
+        self.resultados = Counter()
+        self.fallidos = []
+        self.escritos = 0
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.task = None  # asyncio.Task cuando la lanza la API
+        self.publicador = None  # asyncio.Task que publica stats() con varios workers
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def running(self):
+        return self.started_at is not None and self.finished_at is None
+
+    async def run(self):
+        self.started_at = time.monotonic()
+        print(f"Suscripciones ({self.accion}) {self.id}: {len(self.dnis)} contribuyentes.")
+        try:
+            queue = asyncio.Queue()
+            for dni in self.dnis:
+                queue.put_nowait(dni)
+            try:
+                await asyncio.gather(*(self._worker(queue) for _ in range(self.concurrency)))
+            finally:
+                # También si se cancela: lo ya creado en MercadoPago queda escrito
+                await self._flush()
+        except Exception as e:
+            self.error = str(e)
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+            print(f"Suscripciones ({self.accion}) {self.id} terminada: {self.stats()}")
+        return self.stats()
+
+    async def _worker(self, queue):
+        while True:
+            try:
+                dni = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                result = await self.operar(self.accion, dni, rate_limiter=self.rate_limiter)
+            except Exception as e:
+                result = {"dni": dni, "accion": self.accion, "resultado": FALLIDO, "detalle": str(e)[:500]}
+            self.resultados[result["resultado"]] += 1
+            if result["resultado"] == FALLIDO:
+                self.fallidos.append({"dni": dni, "status": result.get("status"), "detalle": result.get("detalle")})
+            elif result["resultado"] == HECHO:
+                self._buffer.append(result)
+                if len(self._buffer) >= self.flush_every:
+                    await self._flush()
+
+    async def _flush(self):
+        async with self._flush_lock:
+            results, self._buffer = self._buffer, []
+            if not results:
+                return
+            try:
+                await self.guardar(results)
+                self.escritos += len(results)
+            except Exception as e:
+                print(f"ADVERTENCIA: No se pudieron escribir {len(results)} suscripciones de {self.id}: {e}")
+
+    def stats(self):
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        procesados = sum(self.resultados.values())
+        return {
+            "id": self.id,
+            "accion": self.accion,
+            "en_curso": self.running,
+            "total": len(self.dnis),
+            "procesados": procesados,
+            "resultados": {r: self.resultados[r] for r in (HECHO, OMITIDO, FALLIDO, NO_ENCONTRADO)},
+            "escritos": self.escritos,
+            "fallidos": self.fallidos[:100],
+            "segundos": round(elapsed, 2),
+            "por_segundo": round(procesados / elapsed, 1) if elapsed else 0.0,
+            "error": self.error,
+        }
@@ -0,0 +1,325 @@
+import asyncio
+import re
+import time
+from urllib.parse import quote
+
+from backend import metrics
+
+# Capa de I/O asíncrona hacia Airtable y MercadoPago.
+# Reemplaza a los clientes bloqueantes (airtable-python-wrapper y mercadopago.SDK,
+# ambos basados en requests) para no congelar el event loop de uvicorn.
+# Cada upstream usa un httpx.AsyncClient con conexiones keep-alive, un semáforo
+# que acota la concurrencia y timeouts por llamada. httpx se importa y el pool se
+# arma recién en el primer request (ver LazyHttpClient), no al importar la API.
+
+AIRTABLE_API_URL = "https://api.airtable.com/v0"
+MERCADOPAGO_API_URL = "https://api.mercadopago.com"
+
+# Airtable no siempre manda Retry-After; su documentación pide esperar 30 s tras un 429
+AIRTABLE_429_WAIT_SECONDS = 30.0
+AIRTABLE_BATCH_SIZE = 10
+# Evolution API (WhatsApp): espera ante un 429 sin Retry-After
+WHATSAPP_429_WAIT_SECONDS = 5.0
+
+
+class UpstreamError(Exception):
+    """Error HTTP devuelto por un servicio externo."""
+
+    def __init__(self, upstream, status_code, detail, retry_after=None):
+        super().__init__(f"{upstream} respondió {status_code}: {detail}")
+        self.upstream = upstream
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(response, default):
+    """Lee el header Retry-After (en segundos); si no viene usa `default`."""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return default
+
+
+def build_http_client(base_url, headers, timeout_seconds=10.0, max_connections=20):
+    """Cliente HTTP con pool de conexiones keep-alive para un upstream."""
+    import httpx
+
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        timeout=httpx.Timeout(timeout_seconds, connect=min(timeout_seconds, 5.0)),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+class LazyHttpClient:
+    """Mismo uso que httpx.AsyncClient (request/aclose), pero el cliente se construye
+    en el primer request. Armar el pool (contexto SSL incluido) cuesta decenas de ms
+    por upstream y no tiene sentido pagarlo al importar la aplicación.
+    """
+
+    def __init__(self, base_url, headers, timeout_seconds=10.0, max_connections=20):
+        self.base_url = base_url
+        self._options = (headers, timeout_seconds, max_connections)
+        self._client = None
+
+    @property
+    def started(self):
+        return self._client is not None
+
+    def client(self):
+        if self._client is None:
+            headers, timeout_seconds, max_connections = self._options
+            self._client = build_http_client(self.base_url, headers, timeout_seconds, max_connections)
+        return self._client
+
+    async def request(self, method, url, **kwargs):
+        return await self.client().request(method, url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+async def timed_request(http, upstream, operation, method, path, **kwargs):
+    """http.request() midiendo la duración por upstream, operación y código de respuesta."""
+    start = time.perf_counter()
+    status = "error"
+    try:
+        response = await http.request(method, path, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.upstream_request_duration.observe(time.perf_counter() - start, upstream, operation, status)
+
+
+async def guarded_request(breaker, http, upstream, operation, method, path, **kwargs):
+    """timed_request() que le informa el resultado al circuit breaker del upstream (si hay).
+
+    Llamar a breaker.before() antes: acá solo se registra si la llamada salió bien.
+    Si la llamada se cancela no hay resultado: se libera la prueba del semiabierto,
+    si no el circuito quedaría rechazando todo.
+    """
+    if breaker is None:
+        return await timed_request(http, upstream, operation, method, path, **kwargs)
+    start = time.perf_counter()
+    try:
+        response = await timed_request(http, upstream, operation, method, path, **kwargs)
+    except asyncio.CancelledError:
+        breaker.cancel()
+        raise
+    except BaseException:
+        breaker.record(False, time.perf_counter() - start)
+        raise
+    breaker.record(response.status_code < 500 and response.status_code != 429, time.perf_counter() - start)
+    return response
+
+
+def airtable_formula(field_name, field_value):
+    """Misma fórmula que usaba airtable-python-wrapper para search()."""
+    if isinstance(field_value, str):
+        field_value = re.sub("(?<!\\\\)'", "\\'", field_value)
+        field_value = "'{}'".format(field_value)
+    return "{{{name}}}={value}".format(name=field_name, value=field_value)
+
+
+class AirtableClient:
+    """Cliente asíncrono para una tabla de Airtable (search/get_all/update/insert).
+
+    Si recibe un `rate_limiter` (TokenBucket compartido por la base) cada request
+    espera su turno; ante un 429 frena el bucket según Retry-After y reintenta.
+    Con un `breaker` (backend/breaker.py) las llamadas fallan enseguida con
+    CircuitOpenError mientras Airtable está marcado como caído.
+    """
+
+    def __init__(self, http, base_id, table_name, semaphore, rate_limiter=None, max_retries=3, breaker=None):
+        self.http = http
+        self.path = f"/{base_id}/{quote(table_name, safe='')}"
+        self.semaphore = semaphore
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.breaker = breaker
+        self.throttled = 0
+
+    async def _request(self, operation, method, path, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            if self.breaker is not None:
+                self.breaker.check()
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+            async with self.semaphore:
+                # La prueba del semiabierto se toma recién acá: cancelar la espera no la deja tomada
+                if self.breaker is not None:
+                    self.breaker.before()
+                response = await guarded_request(self.breaker, self.http, "airtable", operation, method, path, **kwargs)
+            if response.status_code != 429:
+                break
+            self.throttled += 1
+            metrics.upstream_throttled.inc("airtable")
+            wait = retry_after_seconds(response, AIRTABLE_429_WAIT_SECONDS)
+            if attempt == self.max_retries:
+                raise UpstreamError("airtable", 429, response.text, retry_after=wait)
+            metrics.upstream_retries.inc("airtable")
+            print(f"ADVERTENCIA: Airtable respondió 429, reintentando en {wait:.1f} s.")
+            if self.rate_limiter is not None:
+                self.rate_limiter.pause(wait)
+            else:
+                await asyncio.sleep(wait)
+        if response.status_code >= 400:
+            raise UpstreamError("airtable", response.status_code, response.text)
+        return response.json()
+
+    async def get_all(self, formula=None, page_size=100, operation="get_all"):
+        records = []
+        params = {"pageSize": page_size}
+        if formula:
+            params["filterByFormula"] = formula
+        while True:
+            data = await self._request(operation, "GET", self.path, params=params)
+            records.extend(data.get("records", []))
+            offset = data.get("offset")
+            if not offset:
+                return records
+            params["offset"] = offset
+
+    async def search(self, field_name, field_value):
+        return await self.get_all(formula=airtable_formula(field_name, field_value), operation="search")
+
+    async def update(self, record_id, fields, typecast=False):
+        return await self._request(
+            "update", "PATCH", f"{self.path}/{record_id}", json={"fields": fields, "typecast": typecast}
+        )
+
+    async def insert(self, fields, typecast=False):
+        return await self._request("insert", "POST", self.path, json={"fields": fields, "typecast": typecast})
+
+    async def batch_update(self, records, typecast=False):
+        """PATCH de hasta 10 registros [{"id": ..., "fields": {...}}] en una sola llamada."""
+        data = await self._request("batch_update", "PATCH", self.path, json={"records": records, "typecast": typecast})
+        return data.get("records", [])
+
+    async def batch_insert(self, fields_list, typecast=False):
+        """POST de hasta 10 registros nuevos en una sola llamada."""
+        records = [{"fields": fields} for fields in fields_list]
+        data = await self._request("batch_insert", "POST", self.path, json={"records": records, "typecast": typecast})
+        return data.get("records", [])
+
+    async def batch_upsert(self, fields_list, merge_on, typecast=False):
+        """Upsert de hasta 10 registros por los campos `merge_on` (performUpsert de la API)."""
+        records = [{"fields": fields} for fields in fields_list]
+        data = await self._request("batch_upsert", "PATCH", self.path, json={
+            "performUpsert": {"fieldsToMergeOn": merge_on},
+            "records": records,
+            "typecast": typecast,
+        })
+        return data.get("records", [])
+
+
+class MercadoPagoClient:
+    """Cliente asíncrono de MercadoPago.
+
+    Devuelve el mismo formato que mercadopago.SDK: {"status": <código>, "response": <json>}.
+    Con un `breaker`, mientras MercadoPago está marcado como caído levanta CircuitOpenError.
+    """
+
+    def __init__(self, http, semaphore, breaker=None):
+        self.http = http
+        self.semaphore = semaphore
+        self.breaker = breaker
+
+    async def _request(self, operation, method, path, **kwargs):
+        if self.breaker is not None:
+            self.breaker.check()
+        async with self.semaphore:
+            if self.breaker is not None:
+                self.breaker.before()
+            response = await guarded_request(self.breaker, self.http, "mercadopago", operation, method, path, **kwargs)
+        if response.status_code == 429:
+            metrics.upstream_throttled.inc("mercadopago")
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"message": response.text}
+        return {"status": response.status_code, "response": body}
+
+    async def create_preference(self, preference_data, idempotency_key=None):
+        """POST de la preferencia; con `idempotency_key`, un reintento devuelve la misma preferencia."""
+        headers = {"X-Idempotency-Key": idempotency_key} if idempotency_key else None
+        return await self._request("create_preference", "POST", "/checkout/preferences", json=preference_data,
+                                   headers=headers)
+
+    async def get_payment(self, payment_id):
+        return await self._request("get_payment", "GET", f"/v1/payments/{payment_id}")
+
+    async def search_payments(self, params):
+        return await self._request("search_payments", "GET", "/v1/payments/search", params=params)
+
+    async def create_preapproval_plan(self, plan_data, idempotency_key=None):
+        """POST del plan; con `idempotency_key`, un reintento del mismo alta no crea un segundo plan."""
+        headers = {"X-Idempotency-Key": idempotency_key} if idempotency_key else None
+        return await self._request("create_preapproval_plan", "POST", "/preapproval_plan", json=plan_data,
+                                   headers=headers)
+
+    async def update_preapproval_plan(self, plan_id, plan_data):
+        """PUT del plan: cambia el monto o lo cancela con {"status": "cancelled"}."""
+        return await self._request(
+            "update_preapproval_plan", "PUT", f"/preapproval_plan/{quote(str(plan_id), safe='')}", json=plan_data,
+        )
+
+
+class WhatsAppClient:
+    """Cliente de Evolution API para WhatsApp: el mismo POST que hacía el nodo "📱 API WhatsApp" de n8n.
+
+    No reintenta: ante un 429 o un error levanta UpstreamError y la cola de
+    notificaciones (backend/notificaciones.py) decide cuándo volver a probar.
+    """
+
+    def __init__(self, http, instance):
+        self.http = http
+        self.path = f"/message/sendText/{quote(instance, safe='')}"
+
+    async def send_text(self, number, text):
+        response = await timed_request(self.http, "whatsapp", "send_text", "POST", self.path,
+                                       json={"number": number, "text": text})
+        if response.status_code == 429:
+            metrics.upstream_throttled.inc("whatsapp")
+            raise UpstreamError("whatsapp", 429, response.text,
+                                retry_after=retry_after_seconds(response, WHATSAPP_429_WAIT_SECONDS))
+        if response.status_code >= 400:
+            raise UpstreamError("whatsapp", response.status_code, response.text)
+        try:
+            return response.json()
+        except ValueError:
+            return {}
+
+
+def build_whatsapp_client(api_url, api_key, instance, timeout_seconds=10.0, max_connections=5):
+    http = LazyHttpClient(
+        api_url.rstrip("/"),
+        {"apikey": api_key, "Content-Type": "application/json"},
+        timeout_seconds=timeout_seconds,
+        max_connections=max_connections,
+    )
+    return WhatsAppClient(http, instance)
+
+
+def build_airtable_http(api_key, base_url=AIRTABLE_API_URL, timeout_seconds=10.0, max_connections=10):
+    return LazyHttpClient(
+        base_url,
+        {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        timeout_seconds=timeout_seconds,
+        max_connections=max_connections,
+    )
+
+
+def build_mercadopago_client(access_token, base_url=MERCADOPAGO_API_URL, timeout_seconds=10.0,
+                             max_concurrency=20, breaker=None):
+    http = LazyHttpClient(
+        base_url,
+        {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
+        timeout_seconds=timeout_seconds,
+        max_connections=max_concurrency,
+    )
+    return MercadoPagoClient(http, asyncio.Semaphore(max_concurrency), breaker=breaker)
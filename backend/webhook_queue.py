@@ -0,0 +1,289 @@
+import asyncio
+import json
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import aliased
+
+from backend.breaker import CircuitOpenError
+from backend.database import SessionLocal
+from backend.models import WebhookEvent
+
+# Cola durable de notificaciones de MercadoPago (tabla webhook_queue en sql_app.db).
+# El endpoint solo persiste la notificación y responde 200; un pool de workers
+# la procesa en segundo plano con reintentos, backoff exponencial y estado "dead".
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+DEAD = "dead"
+
+
+class NonRetryableError(Exception):
+    """Error que no se resuelve reintentando (ej. contribuyente inexistente)."""
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def backoff_delay(attempts, base_seconds, max_seconds):
+    return min(max_seconds, base_seconds * (2 ** (attempts - 1)))
+
+
+def enqueue(payload):
+    """Guarda la notificación cruda. Devuelve (id de la fila, si se creó una nueva).
+
+    Si ya hay una notificación pendiente para el mismo pago no se agrega otra:
+    el worker consulta el estado actual del pago, así que una sola alcanza.
+    """
+    data = payload.get("data") or {}
+    payment_id = str(data.get("id")) if data.get("id") is not None else None
+    now = utcnow()
+    db = SessionLocal()
+    try:
+        if payment_id is not None:
+            pending = (
+                db.query(WebhookEvent.id)
+                .filter(WebhookEvent.payment_id == payment_id, WebhookEvent.status == PENDING)
+                .first()
+            )
+            if pending is not None:
+                return pending.id, False
+        event = WebhookEvent(
+            payment_id=payment_id,
+            topic=payload.get("topic") or payload.get("type"),
+            payload=json.dumps(payload),
+            status=PENDING,
+            attempts=0,
+            next_attempt_at=now,
+            received_at=now,
+        )
+        db.add(event)
+        db.commit()
+        return event.id, True
+    finally:
+        db.close()
+
+
+def claim_next():
+    """Toma la próxima notificación lista y la marca como 'processing'.
+
+    El UPDATE condicionado al estado evita que dos workers tomen la misma fila, y
+    no se toma un pago que otro worker está procesando: una notificación repetida
+    que llegó durante el proceso espera a que termine (enqueue solo la junta con
+    una pendiente).
+    """
+    en_proceso = aliased(WebhookEvent)
+    otro_en_proceso = (
+        select(en_proceso.id)
+        .where(en_proceso.status == PROCESSING, en_proceso.payment_id == WebhookEvent.payment_id)
+        .exists()
+    )
+    db = SessionLocal()
+    try:
+        while True:
+            event = (
+                db.query(WebhookEvent)
+                .filter(WebhookEvent.status == PENDING, WebhookEvent.next_attempt_at <= utcnow(), ~otro_en_proceso)
+                .order_by(WebhookEvent.next_attempt_at, WebhookEvent.id)
+                .first()
+            )
+            if event is None:
+                return None
+            claimed = db.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id == event.id, WebhookEvent.status == PENDING, ~otro_en_proceso)
+                .values(status=PROCESSING, started_at=utcnow())
+            ).rowcount
+            db.commit()
+            if claimed:
+                return {
+                    "id": event.id,
+                    "payload": json.loads(event.payload),
+                    "attempts": event.attempts,
+                    "received_at": event.received_at,
+                }
+    finally:
+        db.close()
+
+
+def mark_done(event_id):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id == event_id)
+            .values(status=DONE, processed_at=utcnow(), last_error=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def mark_failed(event_id, error, retryable, max_attempts, base_seconds, max_seconds):
+    """Registra el fallo y reprograma con backoff, o pasa a 'dead'. Devuelve el nuevo estado."""
+    db = SessionLocal()
+    try:
+        event = db.get(WebhookEvent, event_id)
+        event.attempts += 1
+        event.last_error = str(error)[:2000]
+        if not retryable or event.attempts >= max_attempts:
+            event.status = DEAD
+            event.processed_at = utcnow()
+        else:
+            event.status = PENDING
+            event.next_attempt_at = utcnow() + timedelta(
+                seconds=backoff_delay(event.attempts, base_seconds, max_seconds)
+            )
+        db.commit()
+        return event.status
+    finally:
+        db.close()
+
+
+def postpone(event_id, seconds, error):
+    """Vuelve a 'pending' sin contar un intento: el upstream tenía el circuito abierto."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id == event_id)
+            .values(status=PENDING, last_error=str(error)[:2000],
+                    next_attempt_at=utcnow() + timedelta(seconds=seconds))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def requeue_stuck():
+    """Al arrancar, devuelve a 'pending' lo que quedó en 'processing' por un reinicio."""
+    db = SessionLocal()
+    try:
+        count = db.execute(
+            update(WebhookEvent).where(WebhookEvent.status == PROCESSING).values(status=PENDING)
+        ).rowcount
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def queue_depth():
+    db = SessionLocal()
+    try:
+        rows = db.query(WebhookEvent.status, func.count(WebhookEvent.id)).group_by(WebhookEvent.status).all()
+        depth = {PENDING: 0, PROCESSING: 0, DONE: 0, DEAD: 0}
+        depth.update({status: count for status, count in rows})
+        return depth
+    finally:
+        db.close()
+
+
+class WebhookWorkerPool:
+    """Pool de workers asyncio que consume la cola y ejecuta el handler por notificación."""
+
+    def __init__(self, handler, workers=4, max_attempts=8, backoff_base_seconds=2.0,
+                 backoff_max_seconds=600.0, poll_interval=1.0):
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._wakeup = None
+        # Métricas en memoria del proceso
+        self.processed = 0
+        self.retried = 0
+        self.dead = 0
+        self.postponed = 0
+        self._latencies = deque(maxlen=1000)  # recepción -> fin de procesamiento (s)
+        self._durations = deque(maxlen=1000)  # duración del handler (s)
+        self._completed_at = deque(maxlen=10000)
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Despierta a los workers cuando entra una notificación nueva."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            event = await asyncio.to_thread(claim_next)
+            if event is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(event)
+
+    async def _process(self, event):
+        start = time.perf_counter()
+        try:
+            await self.handler(event["payload"])
+        except asyncio.CancelledError:
+            raise
+        except CircuitOpenError as e:
+            # No es culpa de la notificación: se pospone hasta que el circuito pueda probar de nuevo
+            await asyncio.to_thread(postpone, event["id"], e.retry_after, e)
+            self.postponed += 1
+            return
+        except Exception as e:
+            retryable = not isinstance(e, NonRetryableError)
+            status = await asyncio.to_thread(
+                mark_failed, event["id"], e, retryable, self.max_attempts,
+                self.backoff_base_seconds, self.backoff_max_seconds,
+            )
+            if status == DEAD:
+                self.dead += 1
+                print(f"ERROR: Notificación {event['id']} pasó a dead-letter: {e}")
+            else:
+                self.retried += 1
+                print(f"ADVERTENCIA: Notificación {event['id']} falló (intento {event['attempts'] + 1}), se reintentará: {e}")
+            return
+        await asyncio.to_thread(mark_done, event["id"])
+        self._durations.append(time.perf_counter() - start)
+        self._latencies.append((utcnow() - event["received_at"]).total_seconds())
+        self._completed_at.append(time.monotonic())
+        self.processed += 1
+
+    def metrics(self):
+        now = time.monotonic()
+        last_minute = sum(1 for t in self._completed_at if now - t <= 60)
+        return {
+            "depth": queue_depth(),
+            "workers": self.workers,
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead": self.dead,
+            "postponed": self.postponed,
+            "throughput_per_minute": last_minute,
+            "latency_seconds": _summary(self._latencies),
+            "processing_seconds": _summary(self._durations),
+        }
+
+
+def _summary(values):
+    if not values:
+        return {"avg": None, "p50": None, "p95": None, "max": None}
+    ordered = sorted(values)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p * (len(ordered) - 1)))], 4)
+
+    return {"avg": round(sum(ordered) / len(ordered), 4), "p50": pct(0.5), "p95": pct(0.95), "max": round(ordered[-1], 4)}
@@ -0,0 +1,239 @@
+"""
+Agregados incrementales (backend/agregados.py) contra los stubs locales.
+
+Registra una secuencia de notificaciones de pago (altas, repetidas, estados
+viejos que llegan tarde y reversiones approved -> refunded) por el mismo camino
+que los webhooks y compara los totales mantenidos de forma incremental con los
+calculados desde cero. Después mide /resumen contra recorrer todas las tablas
+con una base de muchos pagos. Sale con código 1 si algún total no coincide.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.agregados
+    python -m benchmarks.agregados --almacenamiento airtable --pagos 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from benchmarks.carga import seed_database
+from benchmarks.stubs import ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes, sample_payments
+
+DEUDA_INICIAL = 100000.0
+
+
+def eventos(payments, rng):
+    """Notificaciones en el orden en que llegarían, con repeticiones, atrasadas y reversiones."""
+    secuencia = []
+    for p in payments:
+        secuencia.append(p)
+        if rng.random() < 0.1:
+            secuencia.append(p)  # repetida
+        if p["status"] == "approved" and rng.random() < 0.05:
+            secuencia.append(dict(p, status="pending"))  # vieja, llega tarde
+        if p["status"] == "approved" and rng.random() < 0.05:
+            secuencia.append(dict(p, status="refunded"))
+    return secuencia
+
+
+def esperado(secuencia):
+    """Totales calculados a mano a partir del estado final de cada pago."""
+    from backend.dedup import STALE, classify
+
+    final = {}
+    for p in secuencia:
+        previous = final.get(p["id"], {}).get("status")
+        if classify(previous, p["status"]) != STALE:
+            final[p["id"]] = p
+    recaudado = defaultdict(lambda: [0.0, 0])
+    pagado = defaultdict(float)
+    for p in final.values():
+        if p["status"] == "approved":
+            mes = datetime.fromisoformat(p["date_approved"]).strftime("%Y-%m")
+            recaudado[mes][0] += p["transaction_amount"]
+            recaudado[mes][1] += 1
+            pagado[p["external_reference"]] += p["transaction_amount"]
+    return recaudado, pagado
+
+
+def seed_deuda():
+    from sqlalchemy import update
+
+    from backend import agregados
+    from backend.database import SessionLocal
+    from backend.models import Contribuyente
+
+    db = SessionLocal()
+    try:
+        db.execute(update(Contribuyente).values(deuda=DEUDA_INICIAL, deuda_padron=DEUDA_INICIAL))
+        db.commit()
+    finally:
+        db.close()
+    agregados.recalcular()
+
+
+async def registrar(api, secuencia):
+    await asyncio.to_thread(api.models.Base.metadata.create_all, bind=api.engine)
+    api.contribuyentes_writer.start()
+    api.pagos_writer.start()
+    try:
+        start = time.perf_counter()
+        for p in secuencia:
+            await api.aplicar_pago_conciliado(p)
+        segundos = time.perf_counter() - start
+        records = await api.listar_contribuyentes()
+        return segundos, records
+    finally:
+        await api.contribuyentes_writer.stop()
+        await api.pagos_writer.stop()
+        await api.airtable_http.aclose()
+        await api.mercadopago_client.http.aclose()
+
+
+def comparar(secuencia, records, contribuyentes):
+    from collections import Counter
+
+    from backend import agregados
+
+    errores = []
+    recaudado, pagado = esperado(secuencia)
+    incremental = agregados.recaudacion()
+    if {m["anio_mes"]: (round(m["total"], 2), m["pagos"]) for m in incremental} != \
+            {k: (round(t, 2), n) for k, (t, n) in recaudado.items()}:
+        errores.append(f"recaudación incremental {incremental} distinta de la esperada {dict(recaudado)}")
+    deuda = agregados.resumen()["deuda"]
+    # La deuda no baja de 0: lo pagado de más queda como saldo a favor
+    deuda_esperada = round((contribuyentes - len(pagado)) * DEUDA_INICIAL
+                           + sum(max(DEUDA_INICIAL - monto, 0.0) for monto in pagado.values()), 2)
+    if deuda["total"] != deuda_esperada:
+        errores.append(f"deuda total {deuda['total']} en lugar de {deuda_esperada}")
+    for dni, monto in list(pagado.items())[:20]:
+        if round(agregados.deuda_de(dni), 2) != round(max(DEUDA_INICIAL - monto, 0.0), 2):
+            errores.append(f"deuda de {dni}: {agregados.deuda_de(dni)} en lugar de {max(DEUDA_INICIAL - monto, 0.0)}")
+    suscripciones = agregados.resumen()["suscripciones"]
+    reales = Counter(r["fields"].get("Estado_Suscripcion") or agregados.SIN_ESTADO for r in records)
+    if {k: v for k, v in suscripciones.items() if v} != dict(reales):
+        errores.append(f"suscripciones {suscripciones} en lugar de {dict(reales)}")
+
+    # Recalcular desde cero tiene que dar lo mismo que lo incremental
+    antes = agregados.resumen()
+    agregados.recalcular(records)
+    if agregados.resumen() != antes:
+        errores.append(f"recalcular cambió los totales: {antes} -> {agregados.resumen()}")
+    return errores
+
+
+def escaneo_completo():
+    """Lo que costaría cada /resumen sin agregados: recorrer pagos y contribuyentes."""
+    from sqlalchemy import select
+
+    from backend.database import SessionLocal
+    from backend.models import Contribuyente, Pago
+
+    db = SessionLocal()
+    try:
+        recaudado = defaultdict(float)
+        for monto, fecha, estado in db.execute(select(Pago.monto_pagado, Pago.fecha_pago_real, Pago.estado_pago)):
+            if estado == "approved":
+                recaudado[fecha.strftime("%Y-%m")] += monto
+        deuda = sum(d or 0.0 for (d,) in db.execute(select(Contribuyente.deuda)))
+        return recaudado, deuda
+    finally:
+        db.close()
+
+
+def latencias(pagos_historicos):
+    from sqlalchemy import insert
+
+    from backend import agregados
+    from backend.database import SessionLocal
+    from backend.models import Pago
+
+    base = datetime(2024, 1, 1)
+    db = SessionLocal()
+    try:
+        rows = [
+            {"id_transaccion_mp": f"h{i}", "contribuyente_dni": str(20000000 + i % 500), "monto_pagado": 18600.0,
+             "estado_pago": "approved", "fecha_pago_real": base + timedelta(hours=i % 20000),
+             "metodo_registro": "Webhook_MP"}
+            for i in range(pagos_historicos)
+        ]
+        for i in range(0, len(rows), 10000):
+            db.execute(insert(Pago), rows[i:i + 10000])
+        db.commit()
+    finally:
+        db.close()
+    agregados.recalcular()
+
+    def medir(fn, veces):
+        tiempos = []
+        for _ in range(veces):
+            start = time.perf_counter()
+            fn()
+            tiempos.append((time.perf_counter() - start) * 1000)
+        return statistics.median(tiempos)
+
+    return medir(agregados.resumen, 200), medir(escaneo_completo, 5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pagos", type=int, default=2000)
+    parser.add_argument("--contribuyentes", type=int, default=300)
+    parser.add_argument("--historicos", type=int, default=200000, help="Pagos en la base para medir /resumen")
+    parser.add_argument("--puerto", type=int, default=18500)
+    parser.add_argument("--almacenamiento", choices=["airtable", "sql"], default="sql")
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(args.contribuyentes)
+    payments = sample_payments(args.pagos, args.contribuyentes)
+    secuencia = eventos(payments, random.Random(5))
+    airtable = ServerThread(airtable_stub(records), args.puerto + 1)
+    mercadopago = ServerThread(mercadopago_stub(payments=payments), args.puerto + 2)
+
+    with airtable, mercadopago:
+        os.environ.update({
+            "AIRTABLE_API_URL": f"{airtable.url}/v0",
+            "MERCADOPAGO_API_URL": mercadopago.url,
+            "AIRTABLE_API_KEY": "stub",
+            "AIRTABLE_BASE_ID": "appStub",
+            "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+            "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+            "MERCADOPAGO_ACCESS_TOKEN": "stub",
+            "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+            "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+            "STORAGE_BACKEND": args.almacenamiento,
+            "CONCILIACION_INTERVAL_SECONDS": "0",
+            # El stub no limita: el writer puede ir más rápido que los 5 req/s reales
+            "AIRTABLE_RATE_LIMIT": "500",
+        })
+        from backend import main as api
+
+        # La deuda vive en la base local en los dos modos (la carga el importador)
+        seed_database(records)
+        seed_deuda()
+        segundos, finales = asyncio.run(registrar(api, secuencia))
+
+    errores = comparar(secuencia, finales, args.contribuyentes)
+    print(f"pagos={args.pagos} notificaciones={len(secuencia)} contribuyentes={args.contribuyentes} "
+          f"almacenamiento={args.almacenamiento}")
+    print(f"notificaciones registradas en {segundos:.1f}s ({len(secuencia) / segundos:.0f}/s) con agregados incrementales")
+
+    resumen_ms, escaneo_ms = latencias(args.historicos)
+    print(f"con {args.historicos} pagos en la base: /resumen desde agregados {resumen_ms:.2f} ms, "
+          f"recorriendo las tablas {escaneo_ms:.0f} ms")
+
+    for error in errores:
+        print(f"FALLÓ: {error}")
+    print("OK" if not errores else f"{len(errores)} errores")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
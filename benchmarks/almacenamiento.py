@@ -0,0 +1,41 @@
+"""
+Compara los dos modos de almacenamiento (STORAGE_BACKEND=airtable vs sql) con el
+mismo escenario de benchmarks.carga. Cada modo corre en un proceso aparte porque
+backend.main lee la configuración al importarse.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.almacenamiento --clientes 100 --requests 1000 --latencia 0.05
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+
+def run(almacenamiento, args):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.carga", "--json", "--almacenamiento", almacenamiento,
+         "--clientes", str(args.clientes), "--requests", str(args.requests),
+         "--latencia", str(args.latencia)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    # backend.main todavía imprime logs por stdout: el JSON es la última línea
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--latencia", type=float, default=0.05)
+    args = parser.parse_args()
+
+    results = {modo: run(modo, args)["resultados"] for modo in ("airtable", "sql")}
+    print(f"clientes={args.clientes} requests={args.requests} latencia_upstream={args.latencia}s")
+    for endpoint in results["airtable"]:
+        for modo, result in results.items():
+            print(f"{endpoint:16} {modo:9} {result[endpoint]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Presupuesto de arranque de la API: tiempo de import de backend.main (python -X importtime)
+y tiempo hasta que uvicorn responde /healthz y /readyz.
+
+Sale con código 1 si el import supera el presupuesto o si al importar se carga
+alguno de los módulos que deben quedar diferidos hasta el primer request (httpx).
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.arranque
+    python -m benchmarks.arranque --presupuesto-ms 1200 --repeticiones 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# Módulos que backend.main no debe importar al arrancar
+DIFERIDOS = ["httpx", "httpcore", "openpyxl"]
+
+
+def entorno():
+    env = dict(os.environ)
+    env.update({
+        "AIRTABLE_API_KEY": "stub",
+        "AIRTABLE_BASE_ID": "appStub",
+        "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+        "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+        "MERCADOPAGO_ACCESS_TOKEN": "stub",
+        "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/arranque.db",
+        # Sin upstream real: la precarga del cache falla rápido y no debe frenar el arranque
+        "AIRTABLE_API_URL": "http://127.0.0.1:9/v0",
+        "PYTHONPATH": ROOT,
+    })
+    return env
+
+
+def importtime(env):
+    """Devuelve ({módulo: (propio_us, acumulado_us)}, total_us de backend.main)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules, modules["backend.main"][1]
+
+
+def hasta_responder(env, port):
+    """Segundos desde que se lanza uvicorn hasta el primer 200 de /healthz y de /readyz."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    tiempos = {}
+    try:
+        for path in ("/healthz", "/readyz"):
+            while path not in tiempos:
+                if time.perf_counter() - start > 30:
+                    raise RuntimeError(f"{path} no respondió en 30 s")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=1) as response:
+                        if response.status == 200:
+                            tiempos[path] = time.perf_counter() - start
+                except OSError:
+                    time.sleep(0.01)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--presupuesto-ms", type=float, default=1200.0, help="Máximo para importar backend.main")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--puerto", type=int, default=18300)
+    args = parser.parse_args()
+
+    env = entorno()
+    corridas = [importtime(env) for _ in range(args.repeticiones)]
+    mediana_ms = statistics.median(total for _, total in corridas) / 1000
+    modules = corridas[-1][0]
+
+    print(f"import backend.main: mediana {mediana_ms:.0f} ms en {args.repeticiones} corridas "
+          f"(presupuesto {args.presupuesto_ms:.0f} ms)")
+    print("módulos con más tiempo propio:")
+    for name, (own, _) in sorted(modules.items(), key=lambda m: -m[1][0])[:10]:
+        print(f"  {own / 1000:7.1f} ms  {name}")
+    for name in ("fastapi", "sqlalchemy", "backend.models", "backend.upstream"):
+        if name in modules:
+            print(f"  acumulado {name}: {modules[name][1] / 1000:.0f} ms")
+
+    tiempos = hasta_responder(env, args.puerto)
+    print(f"uvicorn: /healthz a los {tiempos['/healthz'] * 1000:.0f} ms, /readyz a los {tiempos['/readyz'] * 1000:.0f} ms")
+
+    errores = []
+    if mediana_ms > args.presupuesto_ms:
+        errores.append(f"el import tardó {mediana_ms:.0f} ms, más que el presupuesto de {args.presupuesto_ms:.0f} ms")
+    cargados = [name for name in DIFERIDOS if name in modules]
+    if cargados:
+        errores.append(f"se importaron al arrancar módulos que deben ser diferidos: {', '.join(cargados)}")
+    for error in errores:
+        print(f"FALLÓ: {error}")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Índice de búsqueda de contribuyentes (backend/busqueda.py).
+
+Propiedades sobre los padrones reales del repo (cada DNI de una celda con
+varios titulares, la nomenclatura y el nombre con un error de tipeo encuentran
+al registro; los filtros de lote y manzana se respetan), latencia sobre un
+padrón sintético grande y actualización incremental (resincronizar sin
+cambios no reindexa nada). Sale con código 1 si falla alguna propiedad o si el
+p99 supera el presupuesto.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.busqueda
+    python -m benchmarks.busqueda --contribuyentes 50000 --presupuesto-ms 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from backend.busqueda import ContribuyentesIndex, tokenize
+from backend.importer import ImportReport, iter_records
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PADRONES = ["retributivos.csv", "CONTIBUYENTES Retributivos (1) - Hoja 1.csv"]
+
+APELLIDOS = ["Alvarado", "Gonzalez", "Rodriguez", "Fernandez", "Lopez", "Martinez", "Sanchez", "Perez", "Gomez",
+             "Diaz", "Avila", "Arienti", "Alarcon", "Quiroga", "Muñoz", "Sepúlveda", "Ñancucheo", "Painemil"]
+NOMBRES = ["Luis", "Ingrid", "Mirta", "Eneas", "Fabiana", "Jose", "Maria", "Carlos", "Ana", "Jorge", "Lucia"]
+
+
+def to_airtable(record):
+    """Fila del importador -> registro con los campos que usa la API (storage.CONTRIBUYENTE_FIELDS)."""
+    fields = {
+        "ID_Contribuyente": record["dni"],
+        "Nombre_Contribuyente": record["nombre"],
+        "Monto_Mensual_Impuesto": record["monto_mensual_impuesto"],
+        "DNIs": record["dnis"],
+        "Nomenclatura_Catastral": record["nomenclatura"],
+        "Lote": record["lote"],
+        "Manzana": record["manzana"],
+    }
+    return {"id": f"rec{record['dni']}", "fields": {k: v for k, v in fields.items() if v is not None}}
+
+
+def padrones_reales():
+    records = {}
+    for name in PADRONES:
+        for record in iter_records(os.path.join(ROOT, name), report=ImportReport(dry_run=True)):
+            records.setdefault(record["dni"], to_airtable(record))
+    return list(records.values())
+
+
+def padron_sintetico(n, seed=7):
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        titulares = [str(20000000 + i)] + ([str(30000000 + i)] if i % 4 == 0 else [])
+        fields = {
+            "ID_Contribuyente": titulares[0],
+            "Nombre_Contribuyente": f"{rng.choice(APELLIDOS)} {rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}",
+            "Monto_Mensual_Impuesto": 18600.0,
+            "DNIs": " ".join(titulares),
+            "Nomenclatura_Catastral": str(16300400000 + i * 7),
+            "Lote": str(rng.randint(1, 40)),
+            "Manzana": rng.choice("ABCDEFGH"),
+        }
+        records.append({"id": f"rec{i:08d}", "fields": fields})
+    return records
+
+
+def con_error(word, rng):
+    """Cambia una letra del medio: 'Alvarado' -> 'Alvxrado'."""
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + ("x" if word[i] != "x" else "z") + word[i + 1:]
+
+
+def keys(result):
+    return [r["dni"] for r in result["results"]]
+
+
+def propiedades(records):
+    index = ContribuyentesIndex()
+    index.sync(records)
+    rng = random.Random(1)
+    errores = []
+    for record in records:
+        fields = record["fields"]
+        key = fields["ID_Contribuyente"]
+        for dni in fields.get("DNIs", "").split():
+            # Con puntos, como está en el padrón
+            dotted = f"{dni[:-6]}.{dni[-6:-3]}.{dni[-3:]}"
+            if keys(index.search(dotted, limit=1)) != [key]:
+                errores.append(f"DNI {dotted} no devuelve primero a {key}")
+        nomenclatura = fields.get("Nomenclatura_Catastral")
+        if nomenclatura and key not in keys(index.search(nomenclatura, limit=5)):
+            errores.append(f"nomenclatura {nomenclatura} no encuentra a {key}")
+        palabras = [w for w in tokenize(fields.get("Nombre_Contribuyente")) if len(w) >= 6]
+        if palabras:
+            consulta = con_error(max(palabras, key=len), rng)
+            if key not in keys(index.search(consulta, limit=100)):
+                errores.append(f"'{consulta}' no encuentra a {key} ({fields['Nombre_Contribuyente']})")
+        if fields.get("Lote"):
+            resultado = index.search("", lote=fields["Lote"], manzana=fields.get("Manzana"), limit=100)
+            if key not in keys(resultado):
+                errores.append(f"lote {fields['Lote']} manzana {fields.get('Manzana')} no encuentra a {key}")
+            if any(r["lote"] != fields["Lote"] for r in resultado["results"]):
+                errores.append(f"el filtro de lote {fields['Lote']} devolvió otros lotes")
+    return errores
+
+
+def incremental(records):
+    index = ContribuyentesIndex()
+    errores = []
+    start = time.perf_counter()
+    armado = index.sync(records)
+    armado_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    resync = index.sync(records)
+    resync_ms = (time.perf_counter() - start) * 1000
+    if resync["changed"] or resync["removed"]:
+        errores.append(f"resincronizar sin cambios reindexó {resync}")
+
+    editado = dict(records[0], fields=dict(records[0]["fields"], Nombre_Contribuyente="Zyxwabcd Renombrado"))
+    cambios = index.sync([editado] + records[2:])
+    if cambios != {"indexed": len(records) - 1, "changed": 1, "removed": 1}:
+        errores.append(f"editar uno y borrar otro dio {cambios}")
+    if keys(index.search("zyxwabcd")) != [editado["fields"]["ID_Contribuyente"]]:
+        errores.append("el nombre editado no se encuentra")
+    borrado = records[1]["fields"]["ID_Contribuyente"]
+    if borrado in keys(index.search(borrado, limit=100)):
+        errores.append("el registro borrado sigue apareciendo")
+    return armado_ms, resync_ms, errores
+
+
+def latencias(records, consultas, rng):
+    index = ContribuyentesIndex()
+    index.sync(records)
+    mezcla = []
+    for _ in range(consultas):
+        fields = rng.choice(records)["fields"]
+        apellido = fields["Nombre_Contribuyente"].split()[0]
+        mezcla.append(rng.choice([
+            fields["ID_Contribuyente"],
+            fields["DNIs"].split()[-1][:5],
+            apellido[:3],
+            fields["Nombre_Contribuyente"],
+            con_error(apellido, rng) if len(apellido) > 3 else apellido,
+            fields["Nomenclatura_Catastral"],
+        ]))
+    tiempos = []
+    for consulta in mezcla:
+        start = time.perf_counter()
+        index.search(consulta, limit=20)
+        tiempos.append((time.perf_counter() - start) * 1000)
+    tiempos.sort()
+    return {
+        "p50": statistics.median(tiempos),
+        "p95": tiempos[int(len(tiempos) * 0.95)],
+        "p99": tiempos[int(len(tiempos) * 0.99)],
+    }, index.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contribuyentes", type=int, default=20000, help="Tamaño del padrón sintético")
+    parser.add_argument("--consultas", type=int, default=2000)
+    parser.add_argument("--presupuesto-ms", type=float, default=25.0, help="Máximo p99 por búsqueda")
+    args = parser.parse_args()
+
+    reales = padrones_reales()
+    errores = propiedades(reales)
+    print(f"padrones reales: {len(reales)} contribuyentes, {len(errores)} propiedades fallidas")
+
+    sinteticos = padron_sintetico(args.contribuyentes)
+    armado_ms, resync_ms, incrementales = incremental(sinteticos)
+    errores += incrementales
+    print(f"padrón sintético de {args.contribuyentes}: armado {armado_ms:.0f} ms, resincronizar sin cambios {resync_ms:.0f} ms")
+
+    tiempos, stats = latencias(sinteticos, args.consultas, random.Random(3))
+    print(f"índice: {stats['documents']} documentos, {stats['tokens']} tokens, {stats['trigrams']} trigramas")
+    print(f"{args.consultas} búsquedas: p50 {tiempos['p50']:.2f} ms, p95 {tiempos['p95']:.2f} ms, "
+          f"p99 {tiempos['p99']:.2f} ms (presupuesto {args.presupuesto_ms:.0f} ms)")
+    if tiempos["p99"] > args.presupuesto_ms:
+        errores.append(f"p99 de {tiempos['p99']:.1f} ms supera el presupuesto")
+
+    for error in errores[:20]:
+        print(f"FALLÓ: {error}")
+    print("OK" if not errores else f"{len(errores)} errores")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark de carga de /contribuyentes y /pagar contra stubs locales de Airtable y MercadoPago.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.carga --clientes 100 --requests 2000 --latencia 0.05
+    python -m benchmarks.carga --almacenamiento sql --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from benchmarks.stubs import ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_requests(base_url, requests, concurrency, is_error=lambda status: status >= 400):
+    """Ejecuta [(etiqueta, método, path, json)] con `concurrency` clientes, en orden.
+
+    Devuelve {etiqueta: {requests, errors, status, rps, p50_ms, p95_ms, p99_ms}}.
+    Un error de conexión cuenta como status 0.
+    """
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def worker(client):
+        while True:
+            try:
+                label, method, path, body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            latencies[label].append(time.perf_counter() - start)
+            statuses[label][status] += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        label: {
+            "requests": len(values),
+            "errors": sum(n for status, n in statuses[label].items() if status == 0 or is_error(status)),
+            "status": {str(status): n for status, n in sorted(statuses[label].items())},
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+        }
+        for label, values in latencies.items()
+    }
+
+
+async def drive(base_url, method, path_for, total, concurrency, label="requests"):
+    requests = [(label, method, path_for(i), None) for i in range(total)]
+    result = (await run_requests(base_url, requests, concurrency))[label]
+    del result["status"]
+    return result
+
+
+def seed_database(records):
+    """Carga los contribuyentes de prueba en la base SQL temporal."""
+    from backend import models
+    from backend.database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        db.add_all([
+            models.Contribuyente(
+                dni=r["fields"]["ID_Contribuyente"],
+                nombre=r["fields"]["Nombre_Contribuyente"],
+                monto_mensual_impuesto=r["fields"]["Monto_Mensual_Impuesto"],
+                tipo_impuesto=r["fields"]["Tipo_Impuesto"],
+                telefono=r["fields"].get("Telefono"),
+            )
+            for r in records
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latencia simulada de cada upstream (s)")
+    parser.add_argument("--puerto", type=int, default=18000)
+    parser.add_argument("--almacenamiento", choices=["airtable", "sql"], default="airtable")
+    parser.add_argument("--json", action="store_true", help="Imprimir el resultado como JSON")
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(100)
+    airtable = ServerThread(airtable_stub(records, latency=args.latencia), args.puerto + 1)
+    mercadopago = ServerThread(mercadopago_stub(latency=args.latencia), args.puerto + 2)
+
+    with airtable, mercadopago:
+        os.environ.update({
+            "AIRTABLE_API_URL": f"{airtable.url}/v0",
+            "MERCADOPAGO_API_URL": mercadopago.url,
+            "AIRTABLE_API_KEY": "stub",
+            "AIRTABLE_BASE_ID": "appStub",
+            "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+            "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+            "MERCADOPAGO_ACCESS_TOKEN": "stub",
+            "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+            "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+            # Sin cache para medir el camino que llega al almacenamiento
+            "CONTRIBUYENTES_CACHE_TTL": "0",
+            "STORAGE_BACKEND": args.almacenamiento,
+        })
+        if args.almacenamiento == "sql":
+            seed_database(records)
+        from backend.main import app
+
+        dnis = [r["fields"]["ID_Contribuyente"] for r in records]
+        with ServerThread(app, args.puerto) as backend:
+            results = {
+                "/contribuyentes": asyncio.run(drive(
+                    backend.url, "GET", lambda i: f"/contribuyentes/{random.choice(dnis)}",
+                    args.requests, args.clientes)),
+                "/pagar": asyncio.run(drive(
+                    backend.url, "POST", lambda i: f"/pagar?dni={random.choice(dnis)}&monto=18600",
+                    args.requests, args.clientes)),
+            }
+
+    if args.json:
+        print(json.dumps({"almacenamiento": args.almacenamiento, "clientes": args.clientes,
+                          "latencia_upstream": args.latencia, "resultados": results}))
+        return
+    print(f"almacenamiento={args.almacenamiento} clientes={args.clientes} latencia_upstream={args.latencia}s")
+    for endpoint, result in results.items():
+        print(f"{endpoint:16} {result}")
+
+
+if __name__ == "__main__":
+    main()
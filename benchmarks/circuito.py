@@ -0,0 +1,200 @@
+"""
+Circuit breakers (backend/breaker.py) contra los stubs locales, con caídas
+simuladas de Airtable y de MercadoPago.
+
+  1. Airtable caído (todo 500): las consultas de contribuyentes se sirven del
+     snapshot local marcadas como stale y rápido, el circuito se abre y las
+     escrituras de los webhooks quedan en el outbox en lugar de fallar.
+  2. MercadoPago caído: las notificaciones se posponen sin gastar intentos
+     (ninguna termina en dead-letter).
+  3. Los dos vuelven: los circuitos se cierran, el outbox se vacía, la cola de
+     webhooks termina y las consultas dejan de ser stale.
+
+Sale con código 1 si algo no se cumple.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.circuito
+    python -m benchmarks.circuito --contribuyentes 500 --consultas 300
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.stubs import (
+    FaultInjector, ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes, sample_payments,
+)
+
+
+def pedir(method, url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def get_json(url):
+    return pedir("GET", url)[1]
+
+
+def consultar(api, dnis):
+    """[(ms, status, body)] de GET /contribuyentes/{dni} de a uno."""
+    resultados = []
+    for dni in dnis:
+        start = time.perf_counter()
+        status, body = pedir("GET", f"{api.url}/contribuyentes/{dni}")
+        resultados.append(((time.perf_counter() - start) * 1000, status, body))
+    return resultados
+
+
+def notificar(api, payments):
+    for payment in payments:
+        body = {"type": "payment", "action": "payment.updated", "data": {"id": str(payment["id"])}}
+        pedir("POST", f"{api.url}/webhook/mercadopago", body)
+
+
+def esperar(condicion, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if condicion():
+            return round(time.perf_counter() - start, 2)
+        time.sleep(0.1)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contribuyentes", type=int, default=200)
+    parser.add_argument("--consultas", type=int, default=100, help="Consultas con Airtable caído")
+    parser.add_argument("--pagos", type=int, default=40, help="Notificaciones por cada caída")
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia simulada de cada upstream (s)")
+    parser.add_argument("--reset", type=float, default=2.0, help="Segundos con el circuito abierto antes de probar")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--puerto", type=int, default=18800)
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(args.contribuyentes)
+    payments = sample_payments(args.pagos * 2, args.contribuyentes)
+    airtable_app = FaultInjector(airtable_stub(records, latency=args.latencia), seed=1)
+    mercadopago_app = FaultInjector(mercadopago_stub(latency=args.latencia, payments=payments), seed=2)
+    os.environ.update({
+        "AIRTABLE_API_URL": f"http://127.0.0.1:{args.puerto + 1}/v0",
+        "MERCADOPAGO_API_URL": f"http://127.0.0.1:{args.puerto + 2}",
+        "AIRTABLE_API_KEY": "stub",
+        "AIRTABLE_BASE_ID": "appStub",
+        "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+        "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+        "MERCADOPAGO_ACCESS_TOKEN": "stub",
+        "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+        "STORAGE_BACKEND": "airtable",
+        "CONCILIACION_INTERVAL_SECONDS": "0",
+        "BUSQUEDA_REFRESH_SECONDS": "0",
+        # El cache vence enseguida: las consultas tienen que ir a Airtable (o al snapshot)
+        "CONTRIBUYENTES_CACHE_TTL": "1",
+        "CIRCUIT_FAILURE_THRESHOLD": "3",
+        "CIRCUIT_RESET_SECONDS": str(args.reset),
+        "CONTRIBUYENTE_LOOKUP_TIMEOUT_SECONDS": "1",
+        "WEBHOOK_BACKOFF_BASE_SECONDS": "0.2",
+        "WEBHOOK_BACKOFF_MAX_SECONDS": "1",
+        "AIRTABLE_RATE_LIMIT": "50",
+    })
+    from backend.main import app
+
+    dnis = [r["fields"]["ID_Contribuyente"] for r in records]
+    errores = []
+    with ServerThread(airtable_app, args.puerto + 1), ServerThread(mercadopago_app, args.puerto + 2), \
+            ServerThread(app, args.puerto) as api:
+        while get_json(f"{api.url}/cache/stats")["last_warm_at"] is None:
+            time.sleep(0.05)
+        sanas = consultar(api, dnis[:20])
+        time.sleep(1.5)  # vence el cache precargado
+
+        # 1. Airtable caído
+        airtable_app.error_rate = 1.0
+        caido = consultar(api, [dnis[i % len(dnis)] for i in range(args.consultas)])
+        circuitos = get_json(f"{api.url}/circuitos")
+        if circuitos["airtable"]["state"] == "closed":
+            errores.append(f"el circuito de Airtable no se abrió: {circuitos['airtable']}")
+        if any(status != 200 or not body.get("stale") for _, status, body in caido):
+            malas = [(status, body.get("stale")) for _, status, body in caido if status != 200 or not body.get("stale")]
+            errores.append(f"{len(malas)} consultas sin copia stale: {malas[:5]}")
+        status, body = pedir("GET", f"{api.url}/contribuyentes/99999999")
+        if status != 503:
+            errores.append(f"un DNI sin copia local devolvió {status} en lugar de 503: {body}")
+        notificar(api, payments[:args.pagos])
+        esperar(lambda: get_json(f"{api.url}/webhook/queue/metrics")["depth"]["pending"] == 0, args.timeout)
+        durante = get_json(f"{api.url}/webhook/queue/metrics")
+        diferidas = sum(w["deferred"] for k, w in durante["airtable_writers"].items() if k != "throttled_429")
+        if not diferidas:
+            errores.append(f"ninguna escritura quedó en el outbox: {durante['airtable_writers']}")
+
+        # 2. MercadoPago caído
+        mercadopago_app.error_rate = 1.0
+        notificar(api, payments[args.pagos:])
+        esperar(lambda: get_json(f"{api.url}/circuitos")["mercadopago"]["state"] != "closed", args.timeout)
+        time.sleep(args.reset)
+        pospuestas = get_json(f"{api.url}/circuitos")["webhooks_pospuestos"]
+        if not pospuestas:
+            errores.append("ninguna notificación se pospuso con MercadoPago caído")
+
+        # 3. Vuelven los dos
+        airtable_antes = dict(airtable_app.state.calls)
+        airtable_app.error_rate = 0.0
+        mercadopago_app.error_rate = 0.0
+
+        def recuperado():
+            estado = get_json(f"{api.url}/webhook/queue/metrics")
+            outbox = estado["airtable_outbox"]["depth"]
+            return (estado["depth"]["pending"] == 0 and estado["depth"]["processing"] == 0
+                    and not outbox.get("pending") and not outbox.get("processing"))
+
+        recuperacion = esperar(recuperado, args.timeout)
+        if recuperacion is None:
+            errores.append(f"no se recuperó en {args.timeout}s: {get_json(api.url + '/webhook/queue/metrics')}")
+        final = get_json(f"{api.url}/webhook/queue/metrics")
+        circuitos = get_json(f"{api.url}/circuitos")
+        for nombre in ("airtable", "mercadopago"):
+            if circuitos[nombre]["state"] != "closed":
+                errores.append(f"el circuito de {nombre} sigue {circuitos[nombre]['state']}")
+        if final["dead"] or final["depth"].get("dead"):
+            errores.append(f"notificaciones en dead-letter: {final['depth']}")
+        if final["airtable_outbox"]["depth"].get("dead"):
+            errores.append(f"escrituras del outbox perdidas: {final['airtable_outbox']['depth']}")
+        replicado = {k: v - airtable_antes.get(k, 0) for k, v in airtable_app.state.calls.items()}
+        time.sleep(1.5)
+        despues = consultar(api, dnis[:20])
+        if any(body.get("stale") for _, _, body in despues):
+            errores.append("las consultas siguen stale con Airtable de vuelta")
+        prometheus = urllib.request.urlopen(f"{api.url}/metrics", timeout=10).read().decode()
+        for nombre in ("traful_circuit_state", "traful_circuit_opened_total", "traful_stale_served_total",
+                       "traful_airtable_writer_deferred_total", "traful_webhook_postponed_total"):
+            if nombre not in prometheus:
+                errores.append(f"falta {nombre} en /metrics")
+
+    def mediana(resultados):
+        return statistics.median(ms for ms, _, _ in resultados)
+
+    print(f"contribuyentes={args.contribuyentes} latencia={args.latencia}s reset={args.reset}s")
+    print(f"consultas con Airtable sano: mediana {mediana(sanas):.0f} ms")
+    print(f"consultas con Airtable caído: mediana {mediana(caido):.0f} ms, máximo "
+          f"{max(ms for ms, _, _ in caido):.0f} ms, stale {sum(bool(b.get('stale')) for _, _, b in caido)}/{len(caido)}")
+    print(f"circuitos: {json.dumps({k: circuitos[k] for k in ('airtable', 'mercadopago')})}")
+    print(f"escrituras diferidas al outbox: {diferidas}; notificaciones pospuestas: {pospuestas}; "
+          f"recuperación en {recuperacion}s con {replicado} requests a Airtable")
+
+    for error in errores[:20]:
+        print(f"FALLÓ: {error}")
+    print("OK" if not errores else f"{len(errores)} errores")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
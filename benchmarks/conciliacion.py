@@ -0,0 +1,141 @@
+"""
+Conciliación de pagos contra el stub local de MercadoPago (/v1/payments/search).
+
+Carga en la tabla pagos una parte de los pagos del stub (algunos con un estado
+anterior), corta una primera corrida a mitad de camino, la retoma y corre una
+tercera que no debe aplicar nada. Sale con código 1 si al final la tabla pagos
+no coincide con el stub o si se aplicaron pagos de más.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.conciliacion --pagos 5000
+    python -m benchmarks.conciliacion --almacenamiento airtable --pagos 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.carga import seed_database
+from benchmarks.stubs import ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes, sample_payments
+
+
+def seed_pagos(payments):
+    """Registra el 40% de los pagos como ya conocidos y un 10% más con estado 'pending'."""
+    from backend.database import SessionLocal
+    from backend.models import Pago
+
+    conocidos = int(len(payments) * 0.4)
+    atrasados = int(len(payments) * 0.1)
+    db = SessionLocal()
+    try:
+        for i, p in enumerate(payments[:conocidos + atrasados]):
+            status = p["status"] if i < conocidos else "pending"
+            db.add(Pago(
+                id_transaccion_mp=str(p["id"]), contribuyente_dni=p["external_reference"],
+                monto_pagado=p["transaction_amount"], estado_pago=status,
+                fecha_pago_real=datetime.fromisoformat(p["date_approved"]), metodo_registro="Webhook_MP",
+            ))
+        db.commit()
+    finally:
+        db.close()
+    cambiados = sum(1 for p in payments[conocidos:conocidos + atrasados] if p["status"] != "pending")
+    return len(payments) - conocidos - atrasados + cambiados
+
+
+def estado_pagos():
+    from backend.database import SessionLocal
+    from backend.models import Pago
+
+    db = SessionLocal()
+    try:
+        return dict(db.query(Pago.id_transaccion_mp, Pago.estado_pago).all())
+    finally:
+        db.close()
+
+
+async def correr(api, paginas_primera):
+    await asyncio.to_thread(api.models.Base.metadata.create_all, bind=api.engine)
+    api.contribuyentes_writer.start()
+    api.pagos_writer.start()
+    try:
+        cortada = await api.conciliador.run_once(max_pages=paginas_primera)
+        tracemalloc.start()
+        retomada = await api.conciliador.run_once()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        repetida = await api.conciliador.run_once()
+        return cortada, retomada, repetida, pico
+    finally:
+        await api.contribuyentes_writer.stop()
+        await api.pagos_writer.stop()
+        await api.airtable_http.aclose()
+        await api.mercadopago_client.http.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pagos", type=int, default=5000)
+    parser.add_argument("--contribuyentes", type=int, default=200)
+    parser.add_argument("--pagina", type=int, default=100)
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia simulada de cada upstream (s)")
+    parser.add_argument("--puerto", type=int, default=18400)
+    parser.add_argument("--almacenamiento", choices=["airtable", "sql"], default="sql")
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(args.contribuyentes)
+    payments = sample_payments(args.pagos, args.contribuyentes)
+    mercadopago_app = mercadopago_stub(latency=args.latencia, payments=payments)
+    airtable = ServerThread(airtable_stub(records, latency=args.latencia), args.puerto + 1)
+    mercadopago = ServerThread(mercadopago_app, args.puerto + 2)
+
+    with airtable, mercadopago:
+        os.environ.update({
+            "AIRTABLE_API_URL": f"{airtable.url}/v0",
+            "MERCADOPAGO_API_URL": mercadopago.url,
+            "AIRTABLE_API_KEY": "stub",
+            "AIRTABLE_BASE_ID": "appStub",
+            "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+            "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+            "MERCADOPAGO_ACCESS_TOKEN": "stub",
+            "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+            "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+            "STORAGE_BACKEND": args.almacenamiento,
+            "CONCILIACION_PAGE_SIZE": str(args.pagina),
+            "CONCILIACION_INTERVAL_SECONDS": "0",
+            "CONCILIACION_DESDE": payments[0]["date_last_updated"],
+            # El stub no limita: el writer puede ir más rápido que los 5 req/s reales
+            "AIRTABLE_RATE_LIMIT": "200",
+        })
+        from backend import main as api
+
+        api.models.Base.metadata.create_all(bind=api.engine)
+        if args.almacenamiento == "sql":
+            seed_database(records)
+        esperados = seed_pagos(payments)
+        paginas_primera = max(1, args.pagos // args.pagina // 2)
+        cortada, retomada, repetida, pico = asyncio.run(correr(api, paginas_primera))
+        busquedas = mercadopago_app.state.calls["search"]
+
+    final = estado_pagos()
+    faltantes = [p["id"] for p in payments if final.get(str(p["id"])) != p["status"]]
+    aplicados = cortada["applied"] + retomada["applied"]
+
+    print(f"pagos={args.pagos} contribuyentes={args.contribuyentes} página={args.pagina} "
+          f"latencia={args.latencia}s almacenamiento={args.almacenamiento}")
+    print(f"corrida cortada ({paginas_primera} páginas): {cortada['seen']} vistos, {cortada['applied']} aplicados")
+    print(f"corrida retomada: {retomada['seen']} vistos, {retomada['applied']} aplicados en {retomada['seconds']}s "
+          f"({round(retomada['seen'] / retomada['seconds']) if retomada['seconds'] else '-'} pagos/s), "
+          f"pico de memoria {pico / 1024:.0f} KiB")
+    print(f"corrida repetida: {repetida['seen']} vistos, {repetida['applied']} aplicados")
+    print(f"aplicados {aplicados} de {esperados} esperados; búsquedas al stub: {busquedas}")
+
+    ok = not faltantes and aplicados == esperados and repetida["applied"] == 0
+    print("OK" if ok else f"FALLÓ: {len(faltantes)} pagos no coinciden con el stub")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
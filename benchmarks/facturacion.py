@@ -0,0 +1,106 @@
+"""
+Corrida de facturación masiva contra los stubs locales de Airtable y MercadoPago.
+
+Primero lanza una corrida y la corta a mitad de camino; después lanza otra que
+debe retomar desde los checkpoints sin volver a crear los links ya generados.
+Sale con código 1 si al final falta algún link o si quedó alguna preferencia
+repetida en MercadoPago: las que estaban en vuelo al cortar se vuelven a pedir
+con el mismo X-Idempotency-Key.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.facturacion --contribuyentes 2000 --latencia 0.05
+    python -m benchmarks.facturacion --almacenamiento sql
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+from benchmarks.carga import seed_database
+from benchmarks.stubs import ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes
+
+PERIODO = "2026-11"
+
+
+async def correr(api, cortar_a_los):
+    await asyncio.to_thread(api.models.Base.metadata.create_all, bind=api.engine)
+    api.contribuyentes_writer.start()
+    try:
+        records = await api.listar_contribuyentes()
+        cortada = api.nueva_facturacion(PERIODO)
+        try:
+            await asyncio.wait_for(cortada.run(records), timeout=cortar_a_los)
+        except asyncio.TimeoutError:
+            pass
+        completa = api.nueva_facturacion(PERIODO)
+        await completa.run(records)
+        return cortada.stats(), completa.stats()
+    finally:
+        await api.contribuyentes_writer.stop()
+        await api.airtable_http.aclose()
+        await api.mercadopago_client.http.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contribuyentes", type=int, default=2000)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latencia simulada de cada upstream (s)")
+    parser.add_argument("--concurrencia", type=int, default=10)
+    parser.add_argument("--tasa", type=float, default=100.0, help="Preferencias por segundo")
+    parser.add_argument("--cortar", type=float, default=None, help="Segundos hasta cortar la primera corrida")
+    parser.add_argument("--puerto", type=int, default=18100)
+    parser.add_argument("--almacenamiento", choices=["airtable", "sql"], default="airtable")
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(args.contribuyentes)
+    airtable_app = airtable_stub(records, latency=args.latencia)
+    mercadopago_app = mercadopago_stub(latency=args.latencia)
+    airtable = ServerThread(airtable_app, args.puerto + 1)
+    mercadopago = ServerThread(mercadopago_app, args.puerto + 2)
+
+    with airtable, mercadopago:
+        os.environ.update({
+            "AIRTABLE_API_URL": f"{airtable.url}/v0",
+            "MERCADOPAGO_API_URL": mercadopago.url,
+            "AIRTABLE_API_KEY": "stub",
+            "AIRTABLE_BASE_ID": "appStub",
+            "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+            "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+            "MERCADOPAGO_ACCESS_TOKEN": "stub",
+            "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+            "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+            "STORAGE_BACKEND": args.almacenamiento,
+            "FACTURACION_CONCURRENCY": str(args.concurrencia),
+            "FACTURACION_RATE_LIMIT": str(args.tasa),
+            # El stub no limita: el writer puede ir más rápido que los 5 req/s reales
+            "AIRTABLE_RATE_LIMIT": "50",
+        })
+        if args.almacenamiento == "sql":
+            seed_database(records)
+        from backend import facturacion
+        from backend import main as api
+
+        cortar_a_los = args.cortar or args.contribuyentes / args.tasa / 2
+        cortada, completa = asyncio.run(correr(api, cortar_a_los))
+        checkpoints = facturacion.progress(PERIODO)
+        pedidas = mercadopago_app.state.calls["preferences"]
+        preferencias = len(mercadopago_app.state.preferences)
+        escrituras = airtable_app.state.calls["PATCH"]
+
+    print(f"contribuyentes={args.contribuyentes} latencia={args.latencia}s concurrencia={args.concurrencia} "
+          f"tasa={args.tasa}/s almacenamiento={args.almacenamiento}")
+    print(f"corrida cortada a los {cortar_a_los:.1f}s: {cortada['creados']} creados")
+    print(f"corrida retomada: {completa['creados']} creados en {completa['segundos']}s "
+          f"({completa['por_segundo']}/s), {completa['fallidos']} fallidos")
+    print(f"checkpoints: {checkpoints}")
+    print(f"preferencias creadas en el stub: {preferencias} ({pedidas} pedidos); PATCH a Airtable: {escrituras}")
+
+    repetidas = preferencias - checkpoints["done"] - checkpoints["failed"]
+    ok = checkpoints["done"] == args.contribuyentes and repetidas == 0
+    print("OK" if ok else f"FALLÓ: {repetidas} preferencias repetidas")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
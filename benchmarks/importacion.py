@@ -0,0 +1,54 @@
+"""
+Benchmark del importador de padrones (backend/importer.py) con un CSV sintético
+del mismo formato que retributivos.csv.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.importacion --filas 500000
+"""
+import argparse
+import csv
+import os
+import resource
+import tempfile
+
+
+def generate_csv(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["CONTRIBUYENTE", "DNI", "LOTE ", "MANZANA ", "NOMENCLATURA CATASTRAL ",
+                         "DEUDA a octubre- S/INTERES ", "NOVIEMBRE", "DICIEMBRE"])
+        for i in range(rows):
+            dni = 10_000_000 + i
+            dni_text = f"{dni // 1_000_000}.{dni // 1000 % 1000:03d}.{dni % 1000:03d}"
+            if i % 7 == 0:
+                dni_text += f"  {dni_text}"  # celdas con varios titulares
+            monto = f" $  {18 + i % 90}.{i % 1000:03d},00 " if i % 11 else " $  -   "
+            writer.writerow([f"Contribuyente {i}", dni_text, str(i % 80), "A", f"163{i:08d}",
+                             monto, monto, monto])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=500_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/importacion.db"
+    from backend import models
+    from backend.database import engine
+    from backend.importer import import_file
+
+    models.Base.metadata.create_all(bind=engine)
+    path = os.path.join(workdir, "padron.csv")
+    generate_csv(path, args.filas)
+
+    for etapa in ("carga inicial", "reimportación (sin cambios)"):
+        report = import_file(path)
+        print(f"{etapa}: {report.elapsed:.1f} s, {report.read / report.elapsed:,.0f} filas/s, "
+              f"altas={report.inserted} modificaciones={report.updated} sin_cambios={report.unchanged}")
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"memoria máxima del proceso: {peak_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Corpus de propiedades y micro-benchmark de backend/normalizacion.py.
+
+El corpus son las filas reales de los CSV del repositorio más casos armados a
+mano (CASOS_MONTOS: celdas numéricas del XLSX, punto decimal, puntos de miles
+sin coma). Para cada columna se verifican propiedades contra una implementación
+de referencia celda por celda y luego se compara el tiempo de ambas sobre el
+corpus replicado (el mejor de --repeticiones). Sale con código 1 si alguna
+propiedad no se cumple o si alguna columna va más lenta que celda por celda.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.normalizacion --celdas 500000
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+from backend import normalizacion
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CORPUS_FILES = ["retributivos.csv", "CONTIBUYENTES Retributivos (1) - Hoja 1.csv"]
+AMOUNT_COLUMNS = ["DEUDA A OCTUBRE- S/INTERES", "DEUDA A OCTUBRE", "NOVIEMBRE", "DICIEMBRE"]
+DNI_RE = re.compile(r"\d{1,3}(?:\.\d{3}){2}|\d{7,8}")
+
+
+def load_corpus():
+    columns = {"montos": [], "dnis": [], "nomenclaturas": []}
+    for name in CORPUS_FILES:
+        with open(os.path.join(ROOT, name), encoding="utf-8", newline="") as file:
+            reader = csv.reader(file)
+            headers = [normalizacion.normalize_header(h) for h in next(reader)]
+            for row in reader:
+                cells = dict(zip(headers, row))
+                columns["montos"].extend(cells[c] for c in AMOUNT_COLUMNS if c in cells)
+                columns["dnis"].append(cells["DNI"])
+                columns["nomenclaturas"].append(cells["NOMENCLATURA CATASTRAL"])
+    return columns
+
+
+# Casos que no están en los CSV: celdas numéricas del XLSX, números con punto decimal y puntos de miles sin coma
+CASOS_MONTOS = [
+    (" $  37.200,00 ", 37200.0),
+    ("$ 1.234.567,89", 1234567.89),
+    ("37.200", 37200.0),
+    ("1.500", 1500.0),
+    ("37200.0", 37200.0),
+    ("1.5", 1.5),
+    ("189571.93", 189571.93),
+    ("-1.500,50", -1500.5),
+    (189571.93, 189571.93),
+    (37200.0, 37200.0),
+    (1.234, 1.234),
+    (18600, 18600.0),
+    (" $  -   ", 0.0),
+    ("", 0.0),
+    (None, 0.0),
+    ("sin dato", None),
+]
+
+
+def reference_amount(raw):
+    """Parser celda por celda: la regla de parse_amounts escrita de la forma más directa."""
+    if isinstance(raw, (int, float)):
+        return float(raw)
+    cleaned = (raw or "").replace("$", "").replace(" ", "").replace("\t", "").replace("\xa0", "")
+    if "," in cleaned:
+        cleaned = cleaned.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"-?\d{1,3}(?:\.\d{3})+", cleaned):
+        cleaned = cleaned.replace(".", "")
+    if cleaned in ("", "-"):
+        return 0.0
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def format_amount(value):
+    """37200.0 -> ' $  37.200,00 ' (formato de la planilla)."""
+    entero, decimales = f"{value:,.2f}".split(".")
+    return f" $  {entero.replace(',', '.')},{decimales} "
+
+
+def check_properties(corpus):
+    failures = []
+    casos = normalizacion.parse_amounts([raw for raw, _ in CASOS_MONTOS])
+    for (raw, expected), parsed in zip(CASOS_MONTOS, casos):
+        if parsed != expected or normalizacion.parse_amount(raw) != expected:
+            failures.append(f"monto {raw!r}: {parsed} != {expected}")
+
+    montos = normalizacion.parse_amounts(corpus["montos"])
+    for raw, parsed in zip(corpus["montos"], montos):
+        if parsed != reference_amount(raw):
+            failures.append(f"monto {raw!r}: {parsed} != referencia {reference_amount(raw)}")
+        if parsed is not None and parsed < 0:
+            failures.append(f"monto {raw!r}: negativo {parsed}")
+        if parsed is not None and normalizacion.parse_amount(format_amount(parsed)) != parsed:
+            failures.append(f"monto {raw!r}: no sobrevive formatear y volver a leer")
+
+    # Procesar por bloques da lo mismo que procesar la columna entera
+    for size in (1, 7, 64):
+        chunks = [corpus["montos"][i:i + size] for i in range(0, len(corpus["montos"]), size)]
+        if [m for chunk in chunks for m in normalizacion.parse_amounts(chunk)] != montos:
+            failures.append(f"montos: el resultado cambia con bloques de {size}")
+
+    dnis = normalizacion.parse_dnis(corpus["dnis"])
+    for raw, parsed in zip(corpus["dnis"], dnis):
+        if any(not (d.isdigit() and 7 <= len(d) <= 8) for d in parsed):
+            failures.append(f"dni {raw!r}: valores inválidos {parsed}")
+        # Todo DNI que encuentra la referencia también lo encuentra la versión por columna
+        if not set(d.replace(".", "") for d in DNI_RE.findall(raw)) <= set(parsed):
+            failures.append(f"dni {raw!r}: {parsed} no incluye los DNIs de la referencia")
+
+    nomenclaturas = normalizacion.parse_nomenclaturas(corpus["nomenclaturas"])
+    ids = normalizacion.contribuyente_ids(dnis, nomenclaturas)
+    for raw_dni, raw_nom, parsed_dnis, nom, id_ in zip(corpus["dnis"], corpus["nomenclaturas"], dnis, nomenclaturas, ids):
+        if nom is not None and (nom != nom.strip() or nom.lower() == normalizacion.SIN_MENSURA):
+            failures.append(f"nomenclatura {raw_nom!r}: mal normalizada {nom!r}")
+        expected = parsed_dnis[0] if parsed_dnis else nom
+        if id_ != expected:
+            failures.append(f"id ({raw_dni!r}, {raw_nom!r}): {id_!r} != {expected!r}")
+    return failures
+
+
+def timed(function, *args, repeticiones=1):
+    """Mejor tiempo de `repeticiones` corridas: el mínimo es el menos afectado por el ruido."""
+    tiempos = []
+    for _ in range(repeticiones):
+        start = time.perf_counter()
+        function(*args)
+        tiempos.append(time.perf_counter() - start)
+    return min(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--celdas", type=int, default=500_000)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    failures = check_properties(corpus)
+    total = sum(len(v) for v in corpus.values())
+    print(f"corpus: {total} celdas reales, {len(failures)} propiedades fallidas")
+    for failure in failures[:20]:
+        print(f"  - {failure}")
+
+    montos = (corpus["montos"] * (args.celdas // len(corpus["montos"]) + 1))[:args.celdas]
+    dnis = (corpus["dnis"] * (args.celdas // len(corpus["dnis"]) + 1))[:args.celdas]
+    veces = args.repeticiones
+    resultados = {
+        "montos": (timed(lambda: [reference_amount(m) for m in montos], repeticiones=veces),
+                   timed(normalizacion.parse_amounts, montos, repeticiones=veces)),
+        "dnis": (timed(lambda: [[d.replace(".", "") for d in DNI_RE.findall(c)] for c in dnis], repeticiones=veces),
+                 timed(normalizacion.parse_dnis, dnis, repeticiones=veces)),
+    }
+    for columna, (celda, vectorizado) in resultados.items():
+        print(f"{columna:7} {args.celdas} celdas: celda por celda {celda * 1000:.0f} ms, "
+              f"por columna {vectorizado * 1000:.0f} ms ({celda / vectorizado:.1f}x)")
+    lentas = [columna for columna, (celda, vectorizado) in resultados.items() if vectorizado > celda]
+    if lentas:
+        print(f"FALLÓ: por columna es más lento que celda por celda en {', '.join(lentas)}")
+
+    sys.exit(1 if failures or lentas else 0)
+
+
+if __name__ == "__main__":
+    main()
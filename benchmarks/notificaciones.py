@@ -0,0 +1,219 @@
+"""
+Avisos de pago por WhatsApp (backend/notificaciones.py) contra los stubs
+locales de Airtable, MercadoPago y Evolution API, con el stub de WhatsApp lento
+y con fallas inyectadas.
+
+  1. Desacople: una tanda de notificaciones de MercadoPago (cada una repetida)
+     se drena sin esperar a WhatsApp; los webhooks tardan lo mismo que siempre
+     aunque cada mensaje tarde `--latencia-whatsapp`.
+  2. Un mensaje por pago: cada pago aprobado o rechazado de un contribuyente
+     con Telefono recibe exactamente un aviso, al número correcto, aunque la
+     notificación llegue repetida y aunque se vuelva a mandar toda la tanda.
+  3. Límite: la tasa de envíos sostenida no pasa de WHATSAPP_RATE_LIMIT.
+  4. Reintentos: los 500 del stub se reintentan con backoff y ningún aviso
+     termina en dead-letter.
+
+Sale con código 1 si algo no se cumple.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.notificaciones
+    python -m benchmarks.notificaciones --pagos 200 --limite 10 --errores 0.3
+    python -m benchmarks.notificaciones --almacenamiento sql
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+
+from benchmarks.carga import run_requests, seed_database
+from benchmarks.stubs import (
+    FaultInjector, ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes, sample_payments, whatsapp_stub,
+)
+from benchmarks.workers import Reloj
+
+OPERACION_RE = re.compile(r"Operación N° (\d+)")
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def esperar(condicion, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if condicion():
+            return round(time.perf_counter() - start, 2)
+        time.sleep(0.05)
+    return None
+
+
+def notificaciones(payments, repeticiones):
+    return [
+        ("POST /webhook/mercadopago", "POST", "/webhook/mercadopago",
+         {"type": "payment", "action": "payment.updated", "data": {"id": str(p["id"])}})
+        for p in payments for _ in range(repeticiones)
+    ]
+
+
+def webhooks_drenados(api):
+    depth = get_json(f"{api.url}/webhook/queue/metrics")["depth"]
+    return depth["pending"] == 0 and depth["processing"] == 0
+
+
+def avisos_enviados(api):
+    depth = get_json(f"{api.url}/notificaciones/metrics")["depth"].get("whatsapp", {})
+    return depth.get("pending", 0) == 0 and depth.get("processing", 0) == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contribuyentes", type=int, default=200)
+    parser.add_argument("--pagos", type=int, default=100)
+    parser.add_argument("--repeticiones", type=int, default=2, help="Veces que llega cada notificación")
+    parser.add_argument("--latencia", type=float, default=0.01, help="Latencia de Airtable y MercadoPago (s)")
+    parser.add_argument("--latencia-whatsapp", type=float, default=1.5, help="Latencia de cada envío (s)")
+    parser.add_argument("--errores", type=float, default=0.2, help="Fracción de envíos que responden 500")
+    parser.add_argument("--limite", type=float, default=5.0, help="WHATSAPP_RATE_LIMIT (mensajes/s)")
+    parser.add_argument("--clientes", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--puerto", type=int, default=19000)
+    parser.add_argument("--almacenamiento", choices=["airtable", "sql"], default="airtable")
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(args.contribuyentes)
+    payments = sample_payments(args.pagos, args.contribuyentes)
+    telefonos = {r["fields"]["ID_Contribuyente"]: r["fields"].get("Telefono") for r in records}
+    airtable_app = airtable_stub(records, latency=args.latencia)
+    mercadopago_app = mercadopago_stub(latency=args.latencia, payments=payments)
+    whatsapp_app = Reloj(FaultInjector(whatsapp_stub(latency=args.latencia_whatsapp), error_rate=args.errores, seed=3))
+    os.environ.update({
+        "AIRTABLE_API_URL": f"http://127.0.0.1:{args.puerto + 1}/v0",
+        "MERCADOPAGO_API_URL": f"http://127.0.0.1:{args.puerto + 2}",
+        "WHATSAPP_API_URL": f"http://127.0.0.1:{args.puerto + 3}",
+        "AIRTABLE_API_KEY": "stub",
+        "AIRTABLE_BASE_ID": "appStub",
+        "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+        "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+        "MERCADOPAGO_ACCESS_TOKEN": "stub",
+        "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+        "WHATSAPP_API_KEY": "stub",
+        "WHATSAPP_INSTANCE": "club-futbol",
+        "WHATSAPP_RATE_LIMIT": str(args.limite),
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+        "STORAGE_BACKEND": args.almacenamiento,
+        "CONCILIACION_INTERVAL_SECONDS": "0",
+        "BUSQUEDA_REFRESH_SECONDS": "0",
+        "AIRTABLE_RATE_LIMIT": "50",
+        # Con tantos envíos en vuelo el que manda es el límite por segundo, no la latencia
+        "NOTIFICACIONES_BATCH_SIZE": "20",
+        "NOTIFICACIONES_CONCURRENCY": "20",
+        "NOTIFICACIONES_BACKOFF_BASE_SECONDS": "0.2",
+        "NOTIFICACIONES_BACKOFF_MAX_SECONDS": "1",
+    })
+    if args.almacenamiento == "sql":
+        seed_database(records)
+    from backend.main import app
+
+    # Los pagos que tienen que avisarse: aprobados y rechazados de contribuyentes con teléfono
+    avisables = [p for p in payments if p["status"] in ("approved", "rejected", "cancelled")]
+    esperados = {str(p["id"]): telefonos[p["external_reference"]] for p in avisables if telefonos[p["external_reference"]]}
+    sin_telefono = len(avisables) - len(esperados)
+    errores = []
+    with ServerThread(airtable_app, args.puerto + 1), ServerThread(mercadopago_app, args.puerto + 2), \
+            ServerThread(whatsapp_app, args.puerto + 3), ServerThread(app, args.puerto) as api:
+        while get_json(f"{api.url}/cache/stats")["last_warm_at"] is None:
+            time.sleep(0.05)
+
+        # 1. Desacople
+        start = time.perf_counter()
+        endpoints = asyncio.run(run_requests(api.url, notificaciones(payments, args.repeticiones), args.clientes))
+        drenada = esperar(lambda: webhooks_drenados(api), args.timeout)
+        if drenada is not None:
+            drenada = round(time.perf_counter() - start, 2)
+        enviados_en = esperar(lambda: avisos_enviados(api), args.timeout)
+        if enviados_en is not None:
+            enviados_en = round(time.perf_counter() - start, 2)
+        webhooks = get_json(f"{api.url}/webhook/queue/metrics")
+        minimo_envio = max(0.0, len(esperados) - args.limite) / args.limite
+        if drenada is None:
+            errores.append("la cola de webhooks no se drenó")
+        elif enviados_en is not None and minimo_envio > 1 and drenada >= minimo_envio:
+            errores.append(f"los webhooks tardaron {drenada}s, tanto como mandar los avisos ({minimo_envio:.1f}s)")
+        p95 = webhooks["processing_seconds"]["p95"]
+        if p95 is not None and p95 >= args.latencia_whatsapp:
+            errores.append(f"procesar una notificación tarda {p95}s: espera a WhatsApp")
+        if enviados_en is None:
+            errores.append(f"los avisos no terminaron de mandarse en {args.timeout}s")
+
+        # 2. La tanda entera otra vez: nada nuevo que avisar
+        mandados = len(whatsapp_app.state.mensajes)
+        asyncio.run(run_requests(api.url, notificaciones(payments, 1), args.clientes))
+        esperar(lambda: webhooks_drenados(api), args.timeout)
+        time.sleep(1.0)
+        if len(whatsapp_app.state.mensajes) != mandados:
+            errores.append(f"repetir las notificaciones mandó {len(whatsapp_app.state.mensajes) - mandados} avisos más")
+
+        metricas = get_json(f"{api.url}/notificaciones/metrics")
+        prometheus = urllib.request.urlopen(f"{api.url}/metrics", timeout=10).read().decode()
+
+    # Un aviso por pago, al número del contribuyente
+    mensajes = whatsapp_app.state.mensajes
+    por_pago = Counter()
+    for instancia, numero, texto in mensajes:
+        match = OPERACION_RE.search(texto)
+        payment_id = match.group(1) if match else None
+        por_pago[payment_id] += 1
+        if instancia != "club-futbol" or esperados.get(payment_id) != numero:
+            errores.append(f"aviso inesperado: {(instancia, numero, texto)}")
+    repetidos = {p: n for p, n in por_pago.items() if n > 1}
+    if repetidos:
+        errores.append(f"{len(repetidos)} pagos con más de un aviso: {list(repetidos.items())[:5]}")
+    faltantes = set(esperados) - set(por_pago)
+    if faltantes:
+        errores.append(f"{len(faltantes)} pagos sin aviso: {sorted(faltantes)[:5]}")
+
+    # Límite de envíos: después de la ráfaga inicial (capacidad del bucket) no pasa de WHATSAPP_RATE_LIMIT
+    llegadas = sorted(whatsapp_app.llegadas)
+    sostenida = None
+    if len(llegadas) > args.limite + 1:
+        sostenida = (len(llegadas) - args.limite) / (llegadas[-1] - llegadas[0])
+        if sostenida > args.limite * 1.15:
+            errores.append(f"WhatsApp recibió {sostenida:.1f} mensajes/s con un límite de {args.limite}")
+
+    contadores = metricas["contadores"]["whatsapp"]
+    depth = metricas["depth"].get("whatsapp", {})
+    if depth.get("dead") or contadores["dead"]:
+        errores.append(f"avisos en dead-letter: {depth}")
+    if depth.get("sin_destino") != sin_telefono:
+        errores.append(f"{depth.get('sin_destino')} avisos sin teléfono en lugar de {sin_telefono}")
+    fallas = whatsapp_app.state.faults["500"]
+    if fallas and contadores["retried"] < fallas:
+        errores.append(f"{fallas} envíos fallaron pero solo se reintentaron {contadores['retried']}")
+    for nombre in ("traful_notifications_sent_total", "traful_notification_queue_depth"):
+        if nombre not in prometheus:
+            errores.append(f"falta {nombre} en /metrics")
+
+    print(f"pagos={args.pagos} x{args.repeticiones} almacenamiento={args.almacenamiento} "
+          f"latencia_whatsapp={args.latencia_whatsapp}s errores={args.errores} limite={args.limite}/s")
+    print(f"webhooks: {json.dumps(endpoints)}")
+    print(f"cola de webhooks drenada en {drenada}s (procesamiento p95 {p95}s); "
+          f"avisos mandados en {enviados_en}s (mínimo por el límite: {minimo_envio:.1f}s)")
+    print(f"avisos: {len(mensajes)} mensajes para {len(esperados)} pagos, {sin_telefono} sin teléfono; "
+          f"requests a WhatsApp {len(llegadas)} (500: {fallas}); tasa sostenida "
+          f"{round(sostenida, 2) if sostenida else None}/s; {json.dumps(contadores)}")
+
+    for error in errores[:20]:
+        print(f"FALLÓ: {error}")
+    print("OK" if not errores else f"{len(errores)} errores")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import asyncio
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# Servidores locales que imitan a Airtable y MercadoPago para correr
+# benchmarks sin salir a internet.
+
+FORMULA_RE = re.compile(r"\{(?P<field>[^}]+)\}='(?P<value>.*)'")
+
+
+def sample_contribuyentes(n=100):
+    """Registros con el mismo formato que devuelve Airtable para la tabla Contribuyentes.
+
+    Uno de cada diez no tiene Telefono (no recibe avisos de pago).
+    """
+    records = []
+    for i in range(n):
+        fields = {
+            "ID_Contribuyente": str(20000000 + i),
+            "Nombre_Contribuyente": f"Contribuyente {i}",
+            "Monto_Mensual_Impuesto": 18600.0,
+            "Tipo_Impuesto": "Tasa Retributiva",
+        }
+        if i % 10 != 7:
+            fields["Telefono"] = f"549294{i:07d}"
+        records.append({"id": f"rec{i:08d}", "createdTime": "2025-12-04T00:00:00.000Z", "fields": fields})
+    return records
+
+
+def airtable_stub(records, latency=0.0):
+    """App Starlette que responde como la API v0 de Airtable."""
+    by_id = {r["fields"]["ID_Contribuyente"]: r for r in records}
+    by_record_id = {r["id"]: r for r in records}
+    ids = itertools.count(1)
+    calls = {"GET": 0, "PATCH": 0, "POST": 0}
+
+    def apply_update(record_id, fields):
+        # Los PATCH quedan aplicados, como en Airtable: una lectura posterior los ve
+        if record_id in by_record_id:
+            by_record_id[record_id]["fields"].update(fields)
+
+    async def list_records(request):
+        calls["GET"] += 1
+        await asyncio.sleep(latency)
+        formula = request.query_params.get("filterByFormula")
+        if not formula:
+            return JSONResponse({"records": list(by_id.values())})
+        match = FORMULA_RE.match(formula)
+        record = by_id.get(match.group("value")) if match else None
+        return JSONResponse({"records": [record] if record else []})
+
+    async def create_record(request):
+        calls["POST"] += 1
+        await asyncio.sleep(latency)
+        body = await request.json()
+        if "records" in body:
+            return JSONResponse({"records": [
+                {"id": f"recNEW{next(ids)}", "fields": r.get("fields", {})} for r in body["records"]
+            ]})
+        return JSONResponse({"id": f"recNEW{next(ids)}", "fields": body.get("fields", {})})
+
+    async def update_record(request):
+        calls["PATCH"] += 1
+        await asyncio.sleep(latency)
+        body = await request.json()
+        apply_update(request.path_params["record_id"], body.get("fields", {}))
+        return JSONResponse({"id": request.path_params["record_id"], "fields": body.get("fields", {})})
+
+    async def update_records(request):
+        calls["PATCH"] += 1
+        await asyncio.sleep(latency)
+        body = await request.json()
+        for record in body.get("records", []):
+            if "id" in record:
+                apply_update(record["id"], record.get("fields", {}))
+        return JSONResponse({"records": body.get("records", [])})
+
+    app = Starlette(routes=[
+        Route("/v0/{base}/{table}", list_records, methods=["GET"]),
+        Route("/v0/{base}/{table}", create_record, methods=["POST"]),
+        Route("/v0/{base}/{table}", update_records, methods=["PATCH"]),
+        Route("/v0/{base}/{table}/{record_id}", update_record, methods=["PATCH"]),
+    ])
+    app.state.calls = calls
+    return app
+
+
+def sample_payments(n=1000, contribuyentes=100, start="2026-10-01T00:00:00.000-03:00"):
+    """Pagos con el formato de /v1/payments/search, de a varios por segundo de date_last_updated."""
+    base = datetime.fromisoformat(start)
+    statuses = ["approved", "approved", "approved", "rejected", "pending"]
+    payments = []
+    for i in range(n):
+        updated = (base + timedelta(seconds=i // 3)).isoformat(timespec="milliseconds")
+        payments.append({
+            "id": 90000000 + i,
+            "status": statuses[i % len(statuses)],
+            "external_reference": str(20000000 + i % contribuyentes),
+            "transaction_amount": 18600.0,
+            "date_approved": updated,
+            "date_last_updated": updated,
+        })
+    return payments
+
+
+def mercadopago_stub(latency=0.0, payments=None):
+    """App Starlette que responde como la API de MercadoPago (preferencias, pagos y planes).
+
+    `payments` es la lista que devuelven /v1/payments/search y /v1/payments/{id}.
+    Los planes creados quedan en app.state.plans y los IDs de las preferencias en
+    app.state.preferences. Un POST con un X-Idempotency-Key ya
+    usado devuelve la respuesta del primero, como MercadoPago.
+    """
+    ids = itertools.count(1)
+    calls = {"preferences": 0, "payments": 0, "search": 0, "plans": 0}
+    plans = {}
+    preferences = []
+    idempotentes = {}
+    payments = sorted(payments or [], key=lambda p: (datetime.fromisoformat(p["date_last_updated"]), p["id"]))
+    by_id = {str(p["id"]): p for p in payments}
+
+    async def create_preference(request):
+        calls["preferences"] += 1
+        await asyncio.sleep(latency)
+        key = request.headers.get("X-Idempotency-Key")
+        if key in idempotentes:
+            return JSONResponse(idempotentes[key], status_code=201)
+        body = await request.json()
+        pref_id = f"pref-{next(ids)}"
+        preferences.append(pref_id)
+        response = {
+            "id": pref_id,
+            "init_point": f"https://mercadopago.local/checkout?pref_id={pref_id}",
+            "external_reference": body.get("external_reference"),
+        }
+        if key:
+            idempotentes[key] = response
+        return JSONResponse(response, status_code=201)
+
+    async def get_payment(request):
+        calls["payments"] += 1
+        await asyncio.sleep(latency)
+        payment_id = request.path_params["payment_id"]
+        if payment_id in by_id:
+            return JSONResponse(by_id[payment_id])
+        return JSONResponse({
+            "id": int(payment_id),
+            "status": "approved",
+            "external_reference": "20000000",
+            "transaction_amount": 18600.0,
+            "date_approved": "2025-12-10T12:00:00.000-03:00",
+        })
+
+    async def search_payments(request):
+        calls["search"] += 1
+        await asyncio.sleep(latency)
+        params = request.query_params
+        begin = params.get("begin_date", "")
+        results = payments
+        if not begin.startswith("NOW"):
+            begin_at = datetime.fromisoformat(begin)
+            results = [p for p in payments if datetime.fromisoformat(p["date_last_updated"]) >= begin_at]
+        offset, limit = int(params.get("offset", 0)), int(params.get("limit", 30))
+        return JSONResponse({
+            "paging": {"total": len(results), "limit": limit, "offset": offset},
+            "results": results[offset:offset + limit],
+        })
+
+    async def create_plan(request):
+        calls["plans"] += 1
+        await asyncio.sleep(latency)
+        key = request.headers.get("X-Idempotency-Key")
+        if key in idempotentes:
+            return JSONResponse(idempotentes[key], status_code=201)
+        body = await request.json()
+        plan_id = f"plan-{next(ids)}"
+        plans[plan_id] = dict(body, id=plan_id, status="active")
+        response = dict(plans[plan_id], init_point=(
+            f"https://mercadopago.local/subscriptions/checkout?preapproval_plan_id={plan_id}"
+        ))
+        if key:
+            idempotentes[key] = response
+        return JSONResponse(response, status_code=201)
+
+    async def update_plan(request):
+        calls["plans"] += 1
+        await asyncio.sleep(latency)
+        plan = plans.get(request.path_params["plan_id"])
+        if plan is None:
+            return JSONResponse({"message": "plan not found"}, status_code=404)
+        body = await request.json()
+        plan["auto_recurring"] = dict(plan.get("auto_recurring", {}), **body.pop("auto_recurring", {}))
+        plan.update(body)
+        return JSONResponse(plan)
+
+    app = Starlette(routes=[
+        Route("/checkout/preferences", create_preference, methods=["POST"]),
+        Route("/preapproval_plan", create_plan, methods=["POST"]),
+        Route("/preapproval_plan/{plan_id}", update_plan, methods=["PUT"]),
+        Route("/v1/payments/search", search_payments, methods=["GET"]),
+        Route("/v1/payments/{payment_id}", get_payment, methods=["GET"]),
+    ])
+    app.state.calls = calls
+    app.state.plans = plans
+    app.state.preferences = preferences
+    return app
+
+
+def whatsapp_stub(latency=0.0, api_key="stub"):
+    """App Starlette que responde como Evolution API (POST /message/sendText/{instancia}).
+
+    Los mensajes aceptados quedan en app.state.mensajes como (instancia, número, texto).
+    """
+    calls = {"sendText": 0}
+    mensajes = []
+
+    async def send_text(request):
+        calls["sendText"] += 1
+        await asyncio.sleep(latency)
+        if request.headers.get("apikey") != api_key:
+            return JSONResponse({"message": "Unauthorized"}, status_code=401)
+        body = await request.json()
+        if not body.get("number") or not body.get("text"):
+            return JSONResponse({"message": "number y text son obligatorios"}, status_code=400)
+        mensajes.append((request.path_params["instance"], body["number"], body["text"]))
+        return JSONResponse({
+            "key": {"remoteJid": f"{body['number']}@s.whatsapp.net", "id": f"MSG{len(mensajes):08d}"},
+            "status": "PENDING",
+        }, status_code=201)
+
+    app = Starlette(routes=[Route("/message/sendText/{instance}", send_text, methods=["POST"])])
+    app.state.calls = calls
+    app.state.mensajes = mensajes
+    return app
+
+
+class FaultInjector:
+    """Envuelve una app ASGI de stub y le agrega fallas reproducibles (misma semilla, mismas fallas).
+
+    - `error_rate`: fracción de requests que responden 500.
+    - `throttle_rate`: fracción de requests que responden 429 aunque no se pase el límite.
+    - `rate_limit`: requests por segundo aceptados (como los 5 req/s por base de
+      Airtable); por encima responde 429 con Retry-After.
+    """
+
+    def __init__(self, app, error_rate=0.0, throttle_rate=0.0, rate_limit=None, retry_after=1.0, seed=0):
+        self.app = app
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.state = app.state
+        self.state.faults = {"500": 0, "429": 0}
+        self._window_start = 0.0
+        self._window_count = 0
+
+    def _over_limit(self):
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+        return self._window_count > self.rate_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        roll = self.random.random()
+        if self._over_limit() or roll < self.throttle_rate:
+            self.state.faults["429"] += 1
+            await self._respond(send, 429, {"errors": [{"error": "RATE_LIMIT_REACHED"}]},
+                                [(b"retry-after", str(self.retry_after).encode())])
+            return
+        if roll < self.throttle_rate + self.error_rate:
+            self.state.faults["500"] += 1
+            await self._respond(send, 500, {"message": "internal_error"})
+            return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _respond(send, status, body, headers=()):
+        payload = json.dumps(body).encode()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), *headers]})
+        await send({"type": "http.response.body", "body": payload})
+
+
+class ServerThread:
+    """Levanta una app ASGI con uvicorn en un hilo aparte."""
+
+    def __init__(self, app, port, host="127.0.0.1"):
+        self.url = f"http://{host}:{port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
@@ -0,0 +1,258 @@
+"""
+Suite de carga reproducible de la API contra stubs locales de Airtable y
+MercadoPago (sin red: todo corre en este proceso, en hilos con uvicorn).
+
+Escenarios, en este orden y sobre la misma app:
+  consultas  ráfagas de GET /contribuyentes/{dni} con DNIs populares y algunos inexistentes
+  pagar      clicks en POST /pagar, con dobles clicks
+  webhooks   tormenta de POST /webhook/mercadopago con notificaciones repetidas,
+             hasta que la cola queda vacía
+  mixto      los tres a la vez
+
+Los stubs pueden tener latencia, errores 500, 429 al azar y un límite de
+requests por segundo (como los 5 req/s de Airtable). Todo sale de una semilla:
+la misma semilla genera los mismos pedidos y las mismas fallas.
+
+Imprime un JSON con throughput, p50/p95/p99 y llamadas a cada upstream por
+escenario; --salida lo guarda y --comparar muestra la diferencia contra una
+corrida anterior.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.suite --salida base.json
+    python -m benchmarks.suite --latencia 0.1 --error-mercadopago 0.05 --limite-airtable 5 --comparar base.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.carga import run_requests, seed_database
+from benchmarks.stubs import (
+    FaultInjector, ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes, sample_payments,
+)
+
+ESCENARIOS = ["consultas", "pagar", "webhooks", "mixto"]
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def populares(dnis, rng, n):
+    """DNIs con popularidad tipo Zipf: pocos contribuyentes concentran la mayoría de las consultas."""
+    weights = [1 / (rank + 1) for rank in range(len(dnis))]
+    return rng.choices(dnis, weights=weights, k=n)
+
+
+def consultas(dnis, rng, n):
+    requests = []
+    for dni in populares(dnis, rng, n):
+        if rng.random() < 0.05:
+            dni = str(rng.randint(10000000, 19999999))  # no existe: 404 esperado
+        requests.append(("GET /contribuyentes/{dni}", "GET", f"/contribuyentes/{dni}", None))
+    return requests
+
+
+def clicks(dnis, rng, n):
+    requests = []
+    while len(requests) < n:
+        dni = rng.choice(dnis)
+        # Uno de cada cinco hace doble click
+        for _ in range(2 if rng.random() < 0.2 else 1):
+            requests.append(("POST /pagar", "POST", f"/pagar?dni={dni}&monto=18600", None))
+    return requests[:n]
+
+
+def tormenta(payments, rng):
+    """Cada pago notificado entre 1 y 4 veces; las repeticiones llegan cerca de la original."""
+    requests = []
+    for payment in payments:
+        body = {"type": "payment", "action": "payment.updated", "data": {"id": str(payment["id"])}}
+        for _ in range(rng.randint(1, 4)):
+            requests.append(("POST /webhook/mercadopago", "POST", "/webhook/mercadopago", body))
+    # Mezcla local: se desordenan de a ventanas de 20, no toda la tormenta
+    for start in range(0, len(requests), 20):
+        window = requests[start:start + 20]
+        rng.shuffle(window)
+        requests[start:start + 20] = window
+    return requests
+
+
+def snapshot(airtable_app, mercadopago_app):
+    return {
+        "airtable": dict(airtable_app.state.calls, **{f"fallas_{k}": v for k, v in airtable_app.state.faults.items()}),
+        "mercadopago": dict(mercadopago_app.state.calls,
+                            **{f"fallas_{k}": v for k, v in mercadopago_app.state.faults.items()}),
+    }
+
+
+def delta(before, after):
+    return {
+        upstream: {k: after[upstream][k] - before[upstream].get(k, 0) for k in after[upstream]}
+        for upstream in after
+    }
+
+
+def esperar_cola(base_url, timeout):
+    """Segundos hasta que la cola de webhooks no tiene pendientes ni en proceso."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        depth = get_json(f"{base_url}/webhook/queue/metrics")["depth"]
+        if depth["pending"] == 0 and depth["processing"] == 0:
+            return round(time.perf_counter() - start, 2), depth
+        time.sleep(0.05)
+    return None, depth
+
+
+def correr_escenario(nombre, requests, backend, stubs, args, esperar_webhooks=False):
+    before = snapshot(*stubs)
+    start = time.perf_counter()
+    # 404 de un DNI inexistente es la respuesta correcta: solo los 5xx y las caídas cuentan como error
+    endpoints = asyncio.run(run_requests(backend.url, requests, args.clientes, is_error=lambda s: s >= 500))
+    result = {"segundos": round(time.perf_counter() - start, 2), "endpoints": endpoints}
+    if esperar_webhooks:
+        drenado, depth = esperar_cola(backend.url, args.timeout_cola)
+        result["cola"] = {"drenada_en_segundos": drenado, "estado": depth}
+    result["upstream"] = delta(before, snapshot(*stubs))
+    print(f"{nombre}: {result['segundos']}s " + ", ".join(
+        f"{label} {r['rps']}/s p99 {r['p99_ms']} ms ({r['errors']} errores)" for label, r in endpoints.items()
+    ), file=sys.stderr)
+    return result
+
+
+def comparar(base, actual):
+    """Diferencia de throughput y p99 por escenario y endpoint contra una corrida anterior."""
+    lines = []
+    for escenario, result in actual["escenarios"].items():
+        previous = base.get("escenarios", {}).get(escenario)
+        if not previous:
+            continue
+        for label, r in result["endpoints"].items():
+            p = previous["endpoints"].get(label)
+            if not p:
+                continue
+            lines.append(
+                f"{escenario:10} {label:28} rps {p['rps']:>8} -> {r['rps']:>8} ({pct(p['rps'], r['rps'])})   "
+                f"p99 {p['p99_ms']:>8} -> {r['p99_ms']:>8} ms ({pct(p['p99_ms'], r['p99_ms'])})"
+            )
+    return "\n".join(lines)
+
+
+def pct(before, after):
+    if not before:
+        return "-"
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--contribuyentes", type=int, default=500)
+    parser.add_argument("--consultas", type=int, default=3000)
+    parser.add_argument("--clicks", type=int, default=300)
+    parser.add_argument("--pagos", type=int, default=300, help="Pagos distintos en la tormenta de webhooks")
+    parser.add_argument("--clientes", type=int, default=50, help="Clientes concurrentes")
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia simulada de cada upstream (s)")
+    parser.add_argument("--error-airtable", type=float, default=0.0, help="Fracción de 500 en Airtable")
+    parser.add_argument("--error-mercadopago", type=float, default=0.0, help="Fracción de 500 en MercadoPago")
+    parser.add_argument("--throttle-airtable", type=float, default=0.0, help="Fracción de 429 al azar en Airtable")
+    parser.add_argument("--limite-airtable", type=float, default=None, help="Requests/s antes de responder 429")
+    parser.add_argument("--almacenamiento", choices=["airtable", "sql"], default="airtable")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--timeout-cola", type=float, default=120.0)
+    parser.add_argument("--puerto", type=int, default=18600)
+    parser.add_argument("--salida", help="Guardar el JSON en este archivo")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    records = sample_contribuyentes(args.contribuyentes)
+    dnis = [r["fields"]["ID_Contribuyente"] for r in records]
+    rng.shuffle(dnis)  # el orden de popularidad también sale de la semilla
+    payments = sample_payments(args.pagos * 2, args.contribuyentes)
+    airtable_app = FaultInjector(
+        airtable_stub(records, latency=args.latencia), error_rate=args.error_airtable,
+        throttle_rate=args.throttle_airtable, rate_limit=args.limite_airtable, seed=args.semilla,
+    )
+    mercadopago_app = FaultInjector(
+        mercadopago_stub(latency=args.latencia, payments=payments), error_rate=args.error_mercadopago,
+        seed=args.semilla + 1,
+    )
+    stubs = (airtable_app, mercadopago_app)
+
+    os.environ.update({
+        "AIRTABLE_API_URL": f"http://127.0.0.1:{args.puerto + 1}/v0",
+        "MERCADOPAGO_API_URL": f"http://127.0.0.1:{args.puerto + 2}",
+        "AIRTABLE_API_KEY": "stub",
+        "AIRTABLE_BASE_ID": "appStub",
+        "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+        "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+        "MERCADOPAGO_ACCESS_TOKEN": "stub",
+        "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/suite.db",
+        "STORAGE_BACKEND": args.almacenamiento,
+        "CONCILIACION_INTERVAL_SECONDS": "0",
+        "BUSQUEDA_REFRESH_SECONDS": "0",
+        # Reintentos cortos para que la tormenta termine en segundos aun con fallas
+        "WEBHOOK_BACKOFF_BASE_SECONDS": "0.2",
+        "WEBHOOK_BACKOFF_MAX_SECONDS": "2",
+    })
+    if args.almacenamiento == "sql":
+        seed_database(records)
+    from backend.main import app
+
+    pedidos = {
+        "consultas": consultas(dnis, rng, args.consultas),
+        "pagar": clicks(dnis, rng, args.clicks),
+        "webhooks": tormenta(payments[:args.pagos], rng),
+    }
+    mixto = (
+        consultas(dnis, rng, int(args.consultas * 0.7))
+        + clicks(dnis, rng, int(args.clicks * 0.3))
+        + tormenta(payments[args.pagos:], rng)
+    )
+    rng.shuffle(mixto)
+    pedidos["mixto"] = mixto
+
+    resultado = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar", "puerto")},
+        "escenarios": {},
+    }
+    # Los print de la API van a stderr: stdout queda solo para el JSON
+    with contextlib.redirect_stdout(sys.stderr), \
+            ServerThread(airtable_app, args.puerto + 1), ServerThread(mercadopago_app, args.puerto + 2), \
+            ServerThread(app, args.puerto) as backend:
+        # Misma condición de partida en cada corrida: cache precargado
+        arranque = time.perf_counter()
+        while get_json(f"{backend.url}/cache/stats")["last_warm_at"] is None:
+            if time.perf_counter() - arranque > 60:
+                break
+            time.sleep(0.05)
+        resultado["arranque_segundos"] = round(time.perf_counter() - arranque, 2)
+        inicial = snapshot(*stubs)
+        for nombre in args.escenarios.split(","):
+            resultado["escenarios"][nombre] = correr_escenario(
+                nombre, pedidos[nombre], backend, stubs, args, esperar_webhooks=nombre in ("webhooks", "mixto"),
+            )
+        resultado["upstream_total"] = delta(inicial, snapshot(*stubs))
+        resultado["cola_webhooks"] = get_json(f"{backend.url}/webhook/queue/metrics")["depth"]
+
+    salida = json.dumps(resultado, indent=2, ensure_ascii=False)
+    print(salida)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as file:
+            file.write(salida)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as file:
+            print(comparar(json.load(file), resultado), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Suscripciones (backend/suscripciones.py) contra los stubs locales, por HTTP.
+
+Mide cuánto tarda crear, actualizar y cancelar el plan de un contribuyente
+(una sola llamada a la API), verifica que un doble click cree un solo plan y
+corre las operaciones masivas de alta y baja sobre todo el padrón. Al final
+compara lo que quedó en MercadoPago, en los contribuyentes y en /resumen. Sale
+con código 1 si algo no coincide.
+
+Para comparar: los flujos de n8n hacían por cada click un GET y un update a
+Airtable además de la llamada a MercadoPago, uno detrás del otro.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.suscripciones --contribuyentes 1000 --latencia 0.05
+    python -m benchmarks.suscripciones --almacenamiento sql
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter
+
+from benchmarks.carga import seed_database
+from benchmarks.stubs import ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes
+
+
+ADMIN_TOKEN = "bench"
+
+
+def pedir(method, url, body=None, token=ADMIN_TOKEN):
+    data = json.dumps(body).encode() if body is not None else None
+    headers = {"Content-Type": "application/json", "X-Admin-Token": token}
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def medir(method, url):
+    start = time.perf_counter()
+    status, body = pedir(method, url)
+    return (time.perf_counter() - start) * 1000, status, body
+
+
+def esperar(url, timeout=300):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        _, estado = pedir("GET", url)
+        if not estado.get("en_curso") and estado.get("procesados") == estado.get("total"):
+            return estado
+        time.sleep(0.1)
+    raise TimeoutError(url)
+
+
+def campos_finales(args, airtable_app):
+    """{dni: fields} como quedaron en el almacenamiento (stub de Airtable o base local)."""
+    if args.almacenamiento == "sql":
+        from backend import storage
+        return {r["fields"]["ID_Contribuyente"]: r["fields"] for r in storage.get_all_contribuyente_records()}
+    return {r["fields"]["ID_Contribuyente"]: r["fields"] for r in airtable_app.state.records}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contribuyentes", type=int, default=1000)
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latencia simulada de cada upstream (s)")
+    parser.add_argument("--individuales", type=int, default=20, help="Operaciones de a una para medir latencia")
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--tasa", type=float, default=200.0, help="Planes por segundo en las masivas")
+    parser.add_argument("--puerto", type=int, default=18700)
+    parser.add_argument("--almacenamiento", choices=["airtable", "sql"], default="airtable")
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(args.contribuyentes)
+    airtable_app = airtable_stub(records, latency=args.latencia)
+    airtable_app.state.records = records
+    mercadopago_app = mercadopago_stub(latency=args.latencia)
+    os.environ.update({
+        "AIRTABLE_API_URL": f"http://127.0.0.1:{args.puerto + 1}/v0",
+        "MERCADOPAGO_API_URL": f"http://127.0.0.1:{args.puerto + 2}",
+        "AIRTABLE_API_KEY": "stub",
+        "AIRTABLE_BASE_ID": "appStub",
+        "AIRTABLE_CONTRIBUYENTES_TABLE_NAME": "Contribuyentes",
+        "AIRTABLE_PAGOS_TABLE_NAME": "Pagos_Mensuales",
+        "MERCADOPAGO_ACCESS_TOKEN": "stub",
+        "MERCADOPAGO_PAYER_EMAIL": "stub@example.com",
+        "DATABASE_URL": f"sqlite:///{tempfile.mkdtemp()}/bench.db",
+        "STORAGE_BACKEND": args.almacenamiento,
+        "ADMIN_TOKEN": ADMIN_TOKEN,
+        "CONCILIACION_INTERVAL_SECONDS": "0",
+        "BUSQUEDA_REFRESH_SECONDS": "0",
+        "SUSCRIPCIONES_CONCURRENCY": str(args.concurrencia),
+        "SUSCRIPCIONES_RATE_LIMIT": str(args.tasa),
+        # El stub no limita: el writer puede ir más rápido que los 5 req/s reales
+        "AIRTABLE_RATE_LIMIT": "50",
+    })
+    if args.almacenamiento == "sql":
+        seed_database(records)
+    from backend.main import app
+
+    dnis = [r["fields"]["ID_Contribuyente"] for r in records]
+    errores = []
+    with ServerThread(airtable_app, args.puerto + 1), ServerThread(mercadopago_app, args.puerto + 2), \
+            ServerThread(app, args.puerto) as api:
+        while pedir("GET", f"{api.url}/cache/stats")[1]["last_warm_at"] is None:
+            time.sleep(0.05)
+        airtable_antes = dict(airtable_app.state.calls)
+
+        # De a una, como el botón de Airtable
+        individuales = dnis[:args.individuales]
+        tiempos = {"crear": [], "actualizar": [], "cancelar": []}
+        for dni in individuales:
+            for nombre, method, path in (("crear", "POST", f"/suscripciones/{dni}"),
+                                         ("actualizar", "PUT", f"/suscripciones/{dni}?monto=20000"),
+                                         ("cancelar", "DELETE", f"/suscripciones/{dni}")):
+                ms, status, body = medir(method, api.url + path)
+                tiempos[nombre].append(ms)
+                if status != 200:
+                    errores.append(f"{nombre} {dni}: {status} {body}")
+
+        # Doble click: dos altas a la vez para el mismo DNI
+        dni = dnis[args.individuales]
+        respuestas = []
+        clicks = [threading.Thread(target=lambda: respuestas.append(pedir("POST", f"{api.url}/suscripciones/{dni}")))
+                  for _ in range(2)]
+        for click in clicks:
+            click.start()
+        for click in clicks:
+            click.join()
+        planes_doble_click = {body.get("plan_id") for _, body in respuestas}
+        if len(planes_doble_click) != 1 or [s for s, _ in respuestas] != [200, 200]:
+            errores.append(f"doble click: {respuestas}")
+        if pedir("DELETE", f"{api.url}/suscripciones/{dni}")[0] != 200:
+            errores.append("no se pudo cancelar el plan del doble click")
+        if pedir("DELETE", f"{api.url}/suscripciones/{dni}")[0] != 409:
+            errores.append("cancelar dos veces no devolvió 409")
+
+        # Sin token no se cancela nada, y una masiva sin dnis pide confirmación
+        if pedir("DELETE", f"{api.url}/suscripciones/{dnis[-1]}", token="")[0] != 401:
+            errores.append("cancelar sin X-Admin-Token no devolvió 401")
+        if pedir("POST", f"{api.url}/suscripciones/masivas", {"accion": "cancelar"})[0] != 400:
+            errores.append('una masiva sin dnis ni "todos" no devolvió 400')
+
+        # Masivas sobre todo el padrón
+        masivas = {}
+        for accion in ("crear", "cancelar"):
+            status, body = pedir("POST", f"{api.url}/suscripciones/masivas", {"accion": accion, "todos": True})
+            if status != 202:
+                errores.append(f"masiva {accion}: {status} {body}")
+                continue
+            masivas[accion] = esperar(api.url + body["estado"])
+            # Una segunda corrida no tiene nada que hacer
+            _, body = pedir("POST", f"{api.url}/suscripciones/masivas", {"accion": accion, "dnis": dnis[:50]})
+            repetida = esperar(api.url + body["estado"])
+            if repetida["resultados"]["hecho"]:
+                errores.append(f"repetir la masiva {accion} volvió a operar: {repetida['resultados']}")
+
+        time.sleep(1)  # último lote del writer
+        _, resumen = pedir("GET", f"{api.url}/resumen")
+        airtable = {k: v - airtable_antes.get(k, 0) for k, v in airtable_app.state.calls.items()}
+        finales = campos_finales(args, airtable_app)
+
+    plans = mercadopago_app.state.plans
+    por_dni = Counter(p["external_reference"] for p in plans.values())
+    # Las de a una y la del doble click ya estaban canceladas: la masiva les crea un plan nuevo
+    esperados = args.contribuyentes
+    repetidos = set(individuales) | {dni}
+    if masivas.get("crear", {}).get("resultados", {}).get("hecho") != esperados:
+        errores.append(f"la masiva de alta creó {masivas.get('crear')} en lugar de {esperados}")
+    if any(n != (2 if d in repetidos else 1) for d, n in por_dni.items()) or len(por_dni) != args.contribuyentes:
+        errores.append(f"planes por contribuyente: {[(d, n) for d, n in por_dni.items() if n > 1][:10]}")
+    if any(p["status"] != "cancelled" for p in plans.values()):
+        errores.append(f"{sum(p['status'] != 'cancelled' for p in plans.values())} planes sin cancelar")
+    if any(plans[p]["auto_recurring"]["transaction_amount"] != 20000
+           for p in {plans_id for plans_id, p in plans.items() if p["external_reference"] in individuales}):
+        errores.append("la actualización no cambió el monto de los planes")
+    estados = Counter(f.get("Estado_Suscripcion") for f in finales.values())
+    if estados != Counter({"Cancelada": args.contribuyentes}):
+        errores.append(f"estados al final: {dict(estados)}")
+    if resumen["suscripciones"] != {"Cancelada": args.contribuyentes, "Pendiente": 0, "Sin_Estado": 0}:
+        errores.append(f"/resumen no coincide: {resumen['suscripciones']}")
+
+    operaciones = 3 * args.individuales + 2 + 2 * esperados
+    print(f"contribuyentes={args.contribuyentes} latencia={args.latencia}s concurrencia={args.concurrencia} "
+          f"almacenamiento={args.almacenamiento}")
+    for nombre, ms in tiempos.items():
+        print(f"{nombre} de a uno: mediana {statistics.median(ms):.0f} ms, máximo {max(ms):.0f} ms")
+    for accion, estado in masivas.items():
+        print(f"masiva {accion}: {estado['resultados']} en {estado['segundos']}s ({estado['por_segundo']}/s)")
+    print(f"planes en MercadoPago: {len(plans)}; Airtable: {airtable} para {operaciones} operaciones "
+          f"(n8n: un GET y un update por operación)")
+
+    for error in errores[:20]:
+        print(f"FALLÓ: {error}")
+    print("OK" if not errores else f"{len(errores)} errores")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Modo multi-worker (backend/compartido.py): la API con `uvicorn --workers N`
+en un proceso aparte, contra los stubs locales de Airtable y MercadoPago.
+
+  1. Elección: entre todos los workers hay un solo líder.
+  2. Presupuesto de Airtable: consultas de DNIs que no existen (cada una va a
+     Airtable) desde todos los workers a la vez; el stub mide cuántas requests
+     por segundo recibió en total, que tiene que quedar cerca de
+     AIRTABLE_RATE_LIMIT y no N veces eso.
+  3. Webhooks: una tormenta de notificaciones repartida entre los workers; la
+     cola la drena el líder y cada pago queda registrado una vez.
+  4. Caída del líder: se mata su proceso y otro worker toma el lease; la cola
+     se sigue drenando.
+
+Con --sin-compartir corre los mismos pasos con SHARED_STATE=0 (cada worker con
+su cache, su token bucket y sus tareas de fondo) para comparar. Sale con código
+1 si algo no se cumple.
+
+Uso (desde la raíz del proyecto):
+    python -m benchmarks.workers --workers 4
+    python -m benchmarks.workers --workers 4 --sin-compartir
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.carga import run_requests
+from benchmarks.stubs import ServerThread, airtable_stub, mercadopago_stub, sample_contribuyentes, sample_payments
+
+
+class Reloj:
+    """Envuelve una app ASGI y anota cuándo llegó cada request (para medir req/s en el stub)."""
+
+    def __init__(self, app):
+        self.app = app
+        self.state = app.state
+        self.llegadas = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.llegadas.append(time.monotonic())
+        await self.app(scope, receive, send)
+
+    def tasa(self, desde, hasta):
+        llegadas = [t for t in self.llegadas if desde <= t <= hasta]
+        return len(llegadas) / (hasta - desde) if hasta > desde else 0.0
+
+
+def get_json(url):
+    # Conexión nueva en cada pedido: el kernel reparte entre los workers
+    request = urllib.request.Request(url, headers={"Connection": "close"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read() or b"{}")
+
+
+def workers_vistos(url, pedidos=60):
+    """{worker: lider} según /readyz, preguntando muchas veces para pasar por todos."""
+    vistos = {}
+    for _ in range(pedidos):
+        workers = get_json(f"{url}/readyz").get("workers")
+        if workers:
+            vistos[workers["worker"]] = workers["lider"]
+    return vistos
+
+
+def esperar(condicion, timeout):
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        try:
+            if condicion():
+                return round(time.perf_counter() - start, 2)
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return None
+
+
+def cola_vacia(url):
+    depth = get_json(f"{url}/webhook/queue/metrics")["depth"]
+    return depth.get("pending", 0) == 0 and depth.get("processing", 0) == 0
+
+
+def notificaciones(payments):
+    return [
+        ("POST /webhook/mercadopago", "POST", "/webhook/mercadopago",
+         {"type": "payment", "action": "payment.updated", "data": {"id": str(p["id"])}})
+        for p in payments
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--contribuyentes", type=int, default=300)
+    parser.add_argument("--consultas", type=int, default=150, help="Consultas de DNIs inexistentes")
+    parser.add_argument("--pagos", type=int, default=100, help="Notificaciones por tanda")
+    parser.add_argument("--limite-airtable", type=float, default=10.0, help="AIRTABLE_RATE_LIMIT (req/s)")
+    parser.add_argument("--latencia", type=float, default=0.01)
+    parser.add_argument("--clientes", type=int, default=20)
+    parser.add_argument("--sin-compartir", action="store_true", help="SHARED_STATE=0, para comparar")
+    parser.add_argument("--timeout", type=float, default=90.0)
+    parser.add_argument("--puerto", type=int, default=18900)
+    args = parser.parse_args()
+
+    records = sample_contribuyentes(args.contribuyentes)
+    payments = sample_payments(args.pagos * 2, args.contribuyentes)
+    airtable_app = Reloj(airtable_stub(records, latency=args.latencia))
+    mercadopago_app = mercadopago_stub(latency=args.latencia, payments=payments)
+    tmp = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        AIRTABLE_API_URL=f"http://127.0.0.1:{args.puerto + 1}/v0",
+        MERCADOPAGO_API_URL=f"http://127.0.0.1:{args.puerto + 2}",
+        AIRTABLE_API_KEY="stub",
+        AIRTABLE_BASE_ID="appStub",
+        AIRTABLE_CONTRIBUYENTES_TABLE_NAME="Contribuyentes",
+        AIRTABLE_PAGOS_TABLE_NAME="Pagos_Mensuales",
+        MERCADOPAGO_ACCESS_TOKEN="stub",
+        MERCADOPAGO_PAYER_EMAIL="stub@example.com",
+        DATABASE_URL=f"sqlite:///{tmp}/api.db",
+        SHARED_STATE_PATH=f"{tmp}/compartido.db",
+        WEB_CONCURRENCY=str(args.workers),
+        SHARED_STATE="0" if args.sin_compartir else "1",
+        AIRTABLE_RATE_LIMIT=str(args.limite_airtable),
+        LEADER_LEASE_SECONDS="3",
+        CONCILIACION_INTERVAL_SECONDS="0",
+        BUSQUEDA_REFRESH_SECONDS="0",
+        WEBHOOK_BACKOFF_BASE_SECONDS="0.2",
+        WEBHOOK_BACKOFF_MAX_SECONDS="1",
+    )
+    api_url = f"http://127.0.0.1:{args.puerto}"
+    errores = []
+    resultado = {"workers": args.workers, "compartido": not args.sin_compartir}
+    log = open(os.path.join(tmp, "api.log"), "w")
+    with ServerThread(airtable_app, args.puerto + 1), ServerThread(mercadopago_app, args.puerto + 2):
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1",
+             "--port", str(args.puerto), "--workers", str(args.workers), "--log-level", "warning"],
+            env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        try:
+            arranque = esperar(lambda: get_json(f"{api_url}/cache/stats")["last_warm_at"] is not None, args.timeout)
+            resultado["arranque_segundos"] = arranque
+            lecturas_warm = airtable_app.state.calls["GET"]
+            resultado["airtable_get_en_arranque"] = lecturas_warm
+
+            # 1. Elección
+            vistos = workers_vistos(api_url)
+            resultado["workers_vistos"] = len(vistos)
+            lideres = [w for w, lider in vistos.items() if lider]
+            if not args.sin_compartir and len(lideres) != 1:
+                errores.append(f"{len(lideres)} líderes entre {len(vistos)} workers: {vistos}")
+
+            # 2. Presupuesto de Airtable compartido
+            consultas = [("GET /contribuyentes (inexistente)", "GET", f"/contribuyentes/{10000000 + i}", None)
+                         for i in range(args.consultas)]
+            desde = time.monotonic()
+            endpoints = asyncio.run(run_requests(api_url, consultas, args.clientes, is_error=lambda s: s >= 500))
+            hasta = time.monotonic()
+            tasa = airtable_app.tasa(desde, hasta)
+            resultado["consultas"] = endpoints
+            resultado["airtable_req_por_segundo"] = round(tasa, 2)
+            if not args.sin_compartir and tasa > args.limite_airtable * 1.15:
+                errores.append(f"Airtable recibió {tasa:.1f} req/s con un límite de {args.limite_airtable}")
+
+            # 3. Webhooks
+            antes = dict(mercadopago_app.state.calls)
+            endpoints = asyncio.run(run_requests(api_url, notificaciones(payments[:args.pagos]), args.clientes))
+            drenada = esperar(lambda: cola_vacia(api_url), args.timeout)
+            resultado["webhooks"] = {"endpoints": endpoints, "drenada_en_segundos": drenada,
+                                     "get_payment": mercadopago_app.state.calls["payments"] - antes["payments"]}
+            if drenada is None:
+                errores.append("la cola de webhooks no se drenó")
+
+            # 4. Caída del líder
+            if lideres:
+                pid = int(lideres[0].rsplit(":", 1)[1])
+                os.kill(pid, signal.SIGKILL)
+                nuevo = esperar(lambda: any(lider and w != lideres[0] for w, lider in workers_vistos(api_url, 20).items()),
+                                args.timeout)
+                resultado["nuevo_lider_en_segundos"] = nuevo
+                if nuevo is None:
+                    errores.append("ningún worker tomó el lease después de matar al líder")
+                asyncio.run(run_requests(api_url, notificaciones(payments[args.pagos:]), args.clientes))
+                drenada = esperar(lambda: cola_vacia(api_url), args.timeout)
+                resultado["cola_drenada_tras_la_caida"] = drenada
+                if drenada is None:
+                    errores.append("la cola no se drenó después de la caída del líder")
+            metricas = get_json(f"{api_url}/webhook/queue/metrics")
+            resultado["cola"] = metricas["depth"]
+            if metricas["depth"].get("dead"):
+                errores.append(f"notificaciones en dead-letter: {metricas['depth']}")
+            if lideres and metricas["depth"].get("done") != 2 * args.pagos:
+                errores.append(f"{metricas['depth'].get('done')} notificaciones procesadas de {2 * args.pagos}")
+            resultado["airtable"] = dict(airtable_app.state.calls)
+        finally:
+            api.send_signal(signal.SIGINT)
+            try:
+                api.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                api.kill()
+            log.close()
+
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    for error in errores:
+        print(f"FALLÓ: {error}")
+    print("OK" if not errores else f"{len(errores)} errores")
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Base SQLite temporal para los tests: DATABASE_URL se fija antes de que algún
+test importe backend.database, así nunca se toca sql_app.db.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/tests.db"
+
+
+@pytest.fixture
+def base():
+    """Tablas vacías para cada test."""
+    from backend import models
+    from backend.database import engine
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    yield engine
+
+
+@pytest.fixture
+def cliente_mercadopago():
+    """Arma un MercadoPagoClient contra una app stub de benchmarks/stubs.py, sin levantar un servidor."""
+    import httpx
+
+    from backend.upstream import MercadoPagoClient
+
+    def build(app):
+        http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mercadopago.stub")
+        return MercadoPagoClient(http, asyncio.Semaphore(20))
+    return build
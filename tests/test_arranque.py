@@ -0,0 +1,23 @@
+"""
+Presupuesto de arranque (ver benchmarks/arranque.py): importar backend.main no
+pasa de ARRANQUE_PRESUPUESTO_MS y no carga los módulos que se difieren hasta el
+primer request.
+"""
+import os
+import statistics
+
+from benchmarks import arranque
+
+PRESUPUESTO_MS = float(os.getenv("ARRANQUE_PRESUPUESTO_MS", "1200"))
+
+
+def test_import_dentro_del_presupuesto():
+    env = arranque.entorno()
+    corridas = [arranque.importtime(env) for _ in range(3)]
+    mediana_ms = statistics.median(total for _, total in corridas) / 1000
+    assert mediana_ms <= PRESUPUESTO_MS, f"import backend.main: {mediana_ms:.0f} ms"
+
+
+def test_import_no_carga_modulos_diferidos():
+    modules, _ = arranque.importtime(arranque.entorno())
+    assert [name for name in arranque.DIFERIDOS if name in modules] == []
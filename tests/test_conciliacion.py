@@ -0,0 +1,112 @@
+"""
+Cursor y dead-letter de backend/conciliacion.py contra el stub de MercadoPago:
+una corrida cortada retoma desde la última página completa sin reaplicar pagos,
+y un pago que falla siempre no frena el cursor.
+"""
+import asyncio
+
+import pytest
+
+from backend import conciliacion
+from backend.database import SessionLocal
+from backend.models import Pago
+from benchmarks.stubs import mercadopago_stub, sample_payments
+
+
+class Registro:
+    """apply_payment de prueba: deja el pago en la tabla pagos, como registrar_pago en modo sql."""
+
+    def __init__(self, falla=()):
+        self.falla = set(falla)
+        self.aplicados = []
+
+    async def __call__(self, payment):
+        payment_id = str(payment["id"])
+        if payment_id in self.falla:
+            raise RuntimeError("Airtable no disponible")
+        self.aplicados.append(payment_id)
+        await asyncio.to_thread(self._guardar, payment)
+
+    def _guardar(self, payment):
+        db = SessionLocal()
+        try:
+            db.add(Pago(id_transaccion_mp=str(payment["id"]), estado_pago=payment["status"],
+                        contribuyente_dni=payment["external_reference"]))
+            db.commit()
+        finally:
+            db.close()
+
+
+def conciliador(mercadopago, registro, **kwargs):
+    return conciliacion.Conciliador(mercadopago, registro, page_size=30, **kwargs)
+
+
+def test_cursor_avanza_y_retoma_sin_reaplicar(base, cliente_mercadopago):
+    payments = sample_payments(200)
+    mercadopago = cliente_mercadopago(mercadopago_stub(payments=payments))
+    registro = Registro()
+
+    primera = asyncio.run(conciliador(mercadopago, registro).run_once(max_pages=3))
+    assert primera["pages"] == 3
+    begin_date, skip = conciliacion.load_cursor()
+    assert (begin_date, skip) == (primera["cursor"]["begin_date"], primera["cursor"]["skip"])
+
+    segunda = asyncio.run(conciliador(mercadopago, registro).run_once())
+    assert primera["applied"] + segunda["applied"] == 200
+    assert sorted(registro.aplicados) == sorted(str(p["id"]) for p in payments)
+
+    # Sin pagos nuevos, otra corrida no aplica nada
+    tercera = asyncio.run(conciliador(mercadopago, registro).run_once())
+    assert tercera["applied"] == 0
+
+
+def test_pagina_con_error_no_avanza_el_cursor(base, cliente_mercadopago):
+    payments = sample_payments(60)
+    mercadopago = cliente_mercadopago(mercadopago_stub(payments=payments))
+    fallido = str(payments[40]["id"])
+
+    with pytest.raises(Exception, match="no se pudieron aplicar"):
+        asyncio.run(conciliador(mercadopago, Registro(falla=[fallido])).run_once())
+    assert conciliacion.load_cursor()[0] == payments[29]["date_last_updated"]
+
+    registro = Registro()
+    stats = asyncio.run(conciliador(mercadopago, registro).run_once())
+    # Lo demás de la página ya estaba en la tabla pagos: solo se aplica el que había fallado
+    assert registro.aplicados == [fallido]
+    assert stats["applied"] == 1
+    assert conciliacion.dead_payments() == []
+
+
+def test_pago_que_falla_siempre_pasa_a_dead_letter(base, cliente_mercadopago):
+    payments = sample_payments(45)
+    mercadopago = cliente_mercadopago(mercadopago_stub(payments=payments))
+    fallido = str(payments[10]["id"])
+    registro = Registro(falla=[fallido])
+
+    for _ in range(2):
+        with pytest.raises(Exception, match="no se pudieron aplicar"):
+            asyncio.run(conciliador(mercadopago, registro, max_attempts=3).run_once())
+    assert conciliacion.load_cursor() == (conciliacion.DEFAULT_BEGIN_DATE, 0)
+
+    stats = asyncio.run(conciliador(mercadopago, registro, max_attempts=3).run_once())
+    assert stats["dead"] == 1
+    assert conciliacion.load_cursor()[0] == payments[-1]["date_last_updated"]
+    assert [d["payment_id"] for d in conciliacion.dead_payments()] == [fallido]
+    assert len(registro.aplicados) == 44
+
+
+def test_pagos_ya_registrados_en_airtable_no_se_reaplican(base, cliente_mercadopago):
+    payments = sample_payments(30)
+    mercadopago = cliente_mercadopago(mercadopago_stub(payments=payments))
+    en_airtable = {str(p["id"]): p["status"] for p in payments[:20]}
+    consultados = []
+
+    async def known_upstream(payment_ids):
+        consultados.extend(payment_ids)
+        return {i: en_airtable[i] for i in payment_ids if i in en_airtable}
+
+    registro = Registro()
+    asyncio.run(conciliador(mercadopago, registro, known_upstream=known_upstream).run_once())
+
+    assert sorted(registro.aplicados) == sorted(str(p["id"]) for p in payments[20:])
+    assert sorted(consultados) == sorted(str(p["id"]) for p in payments)
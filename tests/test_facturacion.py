@@ -0,0 +1,111 @@
+"""
+Checkpoints de backend/facturacion.py contra el stub de MercadoPago: una corrida
+cortada a mitad de camino se retoma sin repetir preferencias.
+"""
+import asyncio
+
+from backend import facturacion
+from benchmarks.stubs import mercadopago_stub, sample_contribuyentes
+
+PERIODO = "2026-11"
+
+
+def build_preference(dni, fields, monto, periodo):
+    return facturacion.build_preference_data(dni, fields, monto, "stub@example.com", "http://api.stub", periodo)
+
+
+async def sin_escritura(links):
+    pass
+
+
+def nueva_corrida(mercadopago, **kwargs):
+    opciones = dict(concurrency=5, rate=10_000.0, checkpoint_every=5, backoff_base_seconds=0.001)
+    opciones.update(kwargs)
+    return facturacion.FacturacionRun(PERIODO, mercadopago, build_preference, sin_escritura, **opciones)
+
+
+class Cortado:
+    """Deja pasar `hasta` preferencias; las siguientes se crean pero la respuesta no llega nunca."""
+
+    def __init__(self, mercadopago, hasta):
+        self.mercadopago = mercadopago
+        self.hasta = hasta
+        self.pedidas = 0
+        self.cortado = asyncio.Event()
+
+    async def create_preference(self, preference_data, idempotency_key=None):
+        self.pedidas += 1
+        response = await self.mercadopago.create_preference(preference_data, idempotency_key=idempotency_key)
+        if self.pedidas > self.hasta:
+            self.cortado.set()
+            await asyncio.Event().wait()
+        return response
+
+
+async def cortar_y_retomar(mercadopago, records, hasta):
+    cortado = Cortado(mercadopago, hasta)
+    primera = nueva_corrida(cortado)
+    task = asyncio.create_task(primera.run(records))
+    await cortado.cortado.wait()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    antes = await asyncio.to_thread(facturacion.progress, PERIODO)
+    segunda = nueva_corrida(mercadopago)
+    await segunda.run(records)
+    return antes, segunda
+
+
+def test_corrida_cortada_retoma_desde_el_checkpoint(base, cliente_mercadopago):
+    stub = mercadopago_stub()
+    records = sample_contribuyentes(60)
+    antes, segunda = asyncio.run(cortar_y_retomar(cliente_mercadopago(stub), records, hasta=20))
+
+    assert 0 < antes["done"] <= 20
+    assert antes["pending"] == 60 - antes["done"]
+    assert segunda.total == 60 - antes["done"]
+    assert facturacion.progress(PERIODO) == {"pending": 0, "done": 60, "failed": 0, "total": 60}
+    # Las que quedaron en vuelo al cortar se vuelven a pedir con el mismo X-Idempotency-Key
+    assert len(stub.state.preferences) == 60
+
+
+def test_monto_cambiado_vuelve_a_pendiente(base, cliente_mercadopago):
+    stub = mercadopago_stub()
+    records = sample_contribuyentes(10)
+    mercadopago = cliente_mercadopago(stub)
+    asyncio.run(nueva_corrida(mercadopago).run(records))
+
+    records[3]["fields"]["Monto_Mensual_Impuesto"] = 20000.0
+    segunda = nueva_corrida(mercadopago)
+    asyncio.run(segunda.run(records))
+
+    assert segunda.total == 1
+    assert facturacion.find_link(PERIODO, records[3]["fields"]["ID_Contribuyente"], 20000.0) is not None
+    assert len(stub.state.preferences) == 11
+
+
+class Rechaza:
+    """Responde 400 para un DNI y delega el resto."""
+
+    def __init__(self, mercadopago, dni):
+        self.mercadopago = mercadopago
+        self.dni = dni
+
+    async def create_preference(self, preference_data, idempotency_key=None):
+        if preference_data["external_reference"] == self.dni:
+            return {"status": 400, "response": {"message": "invalid payer"}}
+        return await self.mercadopago.create_preference(preference_data, idempotency_key=idempotency_key)
+
+
+def test_fallidos_se_reintentan_solo_si_se_pide(base, cliente_mercadopago):
+    records = sample_contribuyentes(10)
+    mercadopago = cliente_mercadopago(mercadopago_stub())
+    dni = records[0]["fields"]["ID_Contribuyente"]
+    asyncio.run(nueva_corrida(Rechaza(mercadopago, dni)).run(records))
+    assert facturacion.progress(PERIODO)["failed"] == 1
+
+    sin_reintento = nueva_corrida(mercadopago)
+    asyncio.run(sin_reintento.run(records))
+    assert sin_reintento.total == 0
+
+    asyncio.run(nueva_corrida(mercadopago).run(records, retry_failed=True))
+    assert facturacion.progress(PERIODO) == {"pending": 0, "done": 10, "failed": 0, "total": 10}
@@ -0,0 +1,23 @@
+"""
+Propiedades de backend/normalizacion.py sobre el corpus de benchmarks/normalizacion.py.
+La comparación de tiempos contra la referencia celda por celda queda en ese benchmark.
+"""
+import pytest
+
+from backend import normalizacion
+from benchmarks.normalizacion import CASOS_MONTOS, check_properties, load_corpus
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    return load_corpus()
+
+
+@pytest.mark.parametrize("raw, expected", CASOS_MONTOS)
+def test_casos_montos(raw, expected):
+    assert normalizacion.parse_amount(raw) == expected
+    assert normalizacion.parse_amounts([raw]) == [expected]
+
+
+def test_propiedades_del_corpus(corpus):
+    assert check_properties(corpus) == []
@@ -0,0 +1,107 @@
+"""
+Cola de avisos de backend/notificaciones.py con el stub de Evolution API: un
+aviso por pago aunque MercadoPago repita la notificación, reintentos con
+backoff hasta dead-letter, y los 429 no gastan intentos.
+"""
+import asyncio
+
+import httpx
+
+from backend import notificaciones
+from backend.ratelimit import TokenBucket
+from backend.upstream import UpstreamError, WhatsAppClient
+from benchmarks.stubs import whatsapp_stub
+
+CANAL = "whatsapp"
+
+
+def encolar(payment_id, destino="5492940000001", evento=notificaciones.PAGO_APROBADO):
+    texto = notificaciones.mensaje(evento, "Contribuyente", 18600.0, "2026-11", payment_id)
+    return notificaciones.encolar([CANAL], evento, payment_id, "20000001", destino, texto)
+
+
+def dispatcher(enviar, max_attempts=3):
+    return notificaciones.NotificacionesDispatcher(
+        {CANAL: (enviar, TokenBucket(1000))}, batch_size=10, max_attempts=max_attempts, backoff_base_seconds=0.0,
+    )
+
+
+def cliente_whatsapp(app):
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://whatsapp.stub",
+                             headers={"apikey": "stub"})
+    return WhatsAppClient(http, "traful")
+
+
+def test_un_aviso_por_pago_y_evento(base):
+    assert encolar("90000001") == 1
+    assert encolar("90000001") == 0
+    assert encolar("90000001", evento=notificaciones.PAGO_RECHAZADO) == 1
+    assert encolar("90000002", destino=None) == 1
+    assert notificaciones.depth()[CANAL] == {"pending": 2, "processing": 0, "sent": 0, "dead": 0, "sin_destino": 1}
+
+
+def test_dispatcher_manda_los_pendientes(base):
+    stub = whatsapp_stub()
+    for i in range(15):
+        encolar(f"9000{i:04d}", destino=f"549294{i:07d}")
+    encolar("90009999", destino=None)
+    despachador = dispatcher(cliente_whatsapp(stub).send_text)
+
+    async def vaciar():
+        while await despachador.drain_once(CANAL):
+            pass
+    asyncio.run(vaciar())
+
+    assert len(stub.state.mensajes) == 15
+    assert notificaciones.depth()[CANAL]["sent"] == 15
+    assert notificaciones.depth()[CANAL]["sin_destino"] == 1
+    assert despachador.contadores[CANAL]["batches"] == 2
+
+
+def test_error_reintentable_hasta_dead_letter(base):
+    encolar("90000001")
+    intentos = []
+
+    async def caido(destino, texto):
+        intentos.append(destino)
+        raise UpstreamError("whatsapp", 503, "Service Unavailable")
+    despachador = dispatcher(caido, max_attempts=3)
+
+    for _ in range(4):
+        asyncio.run(despachador.drain_once(CANAL))
+
+    assert len(intentos) == 3
+    assert notificaciones.depth()[CANAL]["dead"] == 1
+    assert despachador.contadores[CANAL]["retried"] == 2
+
+
+def test_error_4xx_va_directo_a_dead_letter(base):
+    encolar("90000001")
+
+    async def numero_invalido(destino, texto):
+        raise UpstreamError("whatsapp", 400, "number not exists")
+    asyncio.run(dispatcher(numero_invalido).drain_once(CANAL))
+
+    assert notificaciones.depth()[CANAL]["dead"] == 1
+
+
+def test_429_pospone_sin_gastar_intentos(base):
+    encolar("90000001")
+
+    async def limitado(destino, texto):
+        raise UpstreamError("whatsapp", 429, "Too Many Requests", retry_after=0.0)
+    despachador = dispatcher(limitado, max_attempts=1)
+    for _ in range(3):
+        asyncio.run(despachador.drain_once(CANAL))
+
+    assert notificaciones.depth()[CANAL]["pending"] == 1
+    assert despachador.contadores[CANAL]["throttled"] == 3
+
+
+def test_requeue_de_los_que_quedaron_en_processing(base):
+    encolar("90000001")
+    encolar("90000002")
+    assert len(notificaciones.claim_batch(CANAL, 10)) == 2
+    assert notificaciones.claim_batch(CANAL, 10) == []
+    assert notificaciones.requeue_stuck() == 2
+    assert len(notificaciones.claim_batch(CANAL, 10)) == 2